@@ -0,0 +1,3 @@
+"""Pytest configuration shared by the E2E (test DB) and production verification suites."""
+
+pytest_plugins = ["tests.harness.plugin", "pytester"]
@@ -4,12 +4,19 @@ import subprocess
 import logging
 import os
 import time
-import signal
+
+from ..harness import budgets, policy
+from ..harness.budgets import BudgetStore
+from ..harness.device import appium_url
+from ..harness.http_tier import needs_device
+from ..harness.kube import delete_pods, patch_configmap, pod_status, psql, rollout_restart, vpn_service_ip
+from ..harness.scheduler import measure_transition
+from ..harness.watchdog import kill_wda_processes
+from .video_channels import VideoChannelCache, whitelist_keys
 
 # Configuration
 TEST_DATABASE = "mitmproxy_e2e_tests"  # Separate test database (not production!)
 PROD_DATABASE = "mitmproxy"
-K8S_NAMESPACE = "hocuspocus"
 
 # Test data that should be seeded before E2E tests run
 TEST_ALLOWED_HOSTS = [
@@ -39,15 +46,19 @@ TEST_LOCATION_WHITELIST = [
 ]
 
 
-def _run_kubectl_command(args: list, timeout: int = 30) -> subprocess.CompletedProcess:
-    """Run a kubectl command."""
-    cmd = ["kubectl", "-n", K8S_NAMESPACE] + args
-    return subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=timeout
-    )
+def seed_policy_snapshot() -> dict:
+    """Policy snapshot of the seed spec, for --policy-impact."""
+    rows = [("allowed_hosts", h, "true") for h in TEST_ALLOWED_HOSTS]
+    rows += [("youtube_channels", c[0], "true") for c in TEST_YOUTUBE_CHANNELS]
+    rows += [
+        ("blocked_locations", loc[0], f"{loc[1]},{loc[2]},{loc[3]},true")
+        for loc in TEST_BLOCKED_LOCATIONS
+    ]
+    rows += [
+        ("blocked_location_whitelist", domain, f"{loc_name},true")
+        for loc_name, domain in TEST_LOCATION_WHITELIST
+    ]
+    return policy.snapshot_from_rows(rows)
 
 
 def _check_wda_status():
@@ -78,25 +89,15 @@ def _check_wda_status():
 def force_cleanup_wda():
     """Force kill all WebDriverAgent processes.
 
-    Call this manually if tests are hanging due to stale WDA.
+    The WDA watchdog (harness/watchdog.py) does this automatically when a
+    command hangs; call it manually to start the next run from scratch.
     Usage: pytest --setup-show -k "cleanup" or call from test.
     """
     print("\n🧹 [CLEANUP] Force killing WebDriverAgent processes...")
     try:
-        result = subprocess.run(
-            ["pgrep", "-f", "xcodebuild.*WebDriverAgent"],
-            capture_output=True,
-            text=True
-        )
-        if result.stdout.strip():
-            pids = result.stdout.strip().split('\n')
-            print(f"  Found {len(pids)} WDA process(es): {pids}")
-            for pid in pids:
-                try:
-                    os.kill(int(pid), signal.SIGTERM)
-                    print(f"  Killed PID {pid}")
-                except (ProcessLookupError, ValueError):
-                    pass
+        pids = kill_wda_processes()
+        if pids:
+            print(f"  Killed {len(pids)} WDA process(es): {pids}")
             time.sleep(2)
             print("  ✅ WDA processes killed - run tests again to start fresh")
         else:
@@ -107,11 +108,7 @@ def force_cleanup_wda():
 
 def _get_postgres_pod_ip() -> str:
     """Get the postgres pod IP address."""
-    result = _run_kubectl_command([
-        "get", "pod", "-l", "app=postgres",
-        "-o", "jsonpath={.items[0].status.podIP}"
-    ])
-    return result.stdout.strip()
+    return pod_status("app=postgres", "podIP")
 
 
 def _switch_vpn_database(database: str) -> bool:
@@ -131,20 +128,16 @@ def _switch_vpn_database(database: str) -> bool:
     # Update the configmap with new database
     try:
         # Patch configmap
-        result = _run_kubectl_command([
-            "patch", "configmap", "mitmproxy-config",
-            "--type", "merge",
-            "-p", f'{{"data":{{"POSTGRES_DB":"{database}","POSTGRES_HOST":"{postgres_ip}"}}}}'
-        ], timeout=30)
+        result = patch_configmap(
+            "mitmproxy-config", {"POSTGRES_DB": database, "POSTGRES_HOST": postgres_ip}
+        )
 
         if result.returncode != 0:
             logging.error(f"Failed to patch configmap: {result.stderr}")
             return False
 
         # Restart mitmproxy deployment
-        result = _run_kubectl_command([
-            "rollout", "restart", "deployment/mitmproxy"
-        ], timeout=30)
+        result = rollout_restart("mitmproxy")
 
         if result.returncode != 0:
             logging.error(f"Failed to restart mitmproxy: {result.stderr}")
@@ -152,26 +145,30 @@ def _switch_vpn_database(database: str) -> bool:
 
         # Delete existing pods to force restart (hostNetwork port conflict)
         time.sleep(2)
-        _run_kubectl_command([
-            "delete", "pod", "-l", "app=mitmproxy",
-            "--force", "--grace-period=0"
-        ], timeout=30)
+        delete_pods("app=mitmproxy", force=True)
 
         # Wait for new pod to be ready
         print("⏳ [SWITCH] Waiting for mitmproxy to restart...")
         logging.info("⏳ Waiting for mitmproxy to restart...")
-        for i in range(30):
+        # Up to 60s, less once the restart history shows it's usually quicker
+        store = BudgetStore()
+        started = time.monotonic()
+        deadline = store.deadline("mitmproxy_restart", 60) if budgets.ENABLED else started + 60
+        check = 0
+        while time.monotonic() < deadline:
             time.sleep(2)
-            result = _run_kubectl_command([
-                "get", "pod", "-l", "app=mitmproxy",
-                "-o", "jsonpath={.items[0].status.phase}"
-            ])
-            print(f"  [SWITCH] Check {i+1}/30: pod status = '{result.stdout.strip()}'")
-            if result.stdout.strip() == "Running":
+            check += 1
+            phase = pod_status("app=mitmproxy")
+            print(f"  [SWITCH] Check {check}: pod status = '{phase}'")
+            if phase == "Running":
+                store.record("mitmproxy_restart", time.monotonic() - started)
+                store.save()
                 print(f"✅ [SWITCH] VPN proxy switched to {database}")
                 logging.info(f"✅ VPN proxy switched to {database}")
                 return True
 
+        store.record("mitmproxy_restart", deadline - started)
+        store.save()
         print("❌ [SWITCH] Timeout waiting for mitmproxy to start")
         logging.error("Timeout waiting for mitmproxy to start")
         return False
@@ -198,11 +195,7 @@ def seed_test_database():
 
     # Create test database if it doesn't exist
     logging.info(f"📦 Creating test database {TEST_DATABASE} if not exists...")
-    create_db_result = _run_kubectl_command([
-        "exec", "postgres-0", "--",
-        "psql", "-U", "mitmproxy", "-d", "postgres", "-c",
-        f"CREATE DATABASE {TEST_DATABASE};"
-    ], timeout=30)
+    create_db_result = psql(f"CREATE DATABASE {TEST_DATABASE};", database="postgres", timeout=30)
     # Ignore error if database already exists
 
     # Create tables in test database
@@ -259,13 +252,12 @@ def seed_test_database():
     CREATE INDEX IF NOT EXISTS idx_location_whitelist_location ON blocked_location_whitelist(blocked_location_id);
     CREATE INDEX IF NOT EXISTS idx_location_whitelist_domain ON blocked_location_whitelist(domain);
     """
-    _run_kubectl_command([
-        "exec", "postgres-0", "--",
-        "psql", "-U", "mitmproxy", "-d", TEST_DATABASE, "-c", create_tables_sql
-    ], timeout=30)
+    psql(create_tables_sql, database=TEST_DATABASE, timeout=30)
 
     # Switch VPN to test database
-    if not _switch_vpn_database(TEST_DATABASE):
+    with measure_transition("db_switch"):
+        switched = _switch_vpn_database(TEST_DATABASE)
+    if not switched:
         pytest.exit("Failed to switch VPN proxy to test database")
 
     # Wait for proxy to start
@@ -302,10 +294,7 @@ def seed_test_database():
     full_sql = f"{hosts_sql} {channels_sql} {locations_sql} {location_whitelist_sql}"
 
     try:
-        result = _run_kubectl_command([
-            "exec", "postgres-0", "--",
-            "psql", "-U", "mitmproxy", "-d", TEST_DATABASE, "-c", full_sql
-        ], timeout=30)
+        result = psql(full_sql, database=TEST_DATABASE, timeout=30)
         if result.returncode != 0:
             logging.warning(f"Database seeding warning: {result.stderr}")
         else:
@@ -319,7 +308,8 @@ def seed_test_database():
 
     # Cleanup: switch back to production database
     logging.info("🔄 Switching VPN proxy back to production database...")
-    _switch_vpn_database(PROD_DATABASE)
+    with measure_transition("db_switch"):
+        _switch_vpn_database(PROD_DATABASE)
 
 
 def pytest_configure(config):
@@ -330,37 +320,34 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "location: marks tests that require GPS mocking"
     )
+    policy.register_source(os.path.dirname(__file__), "seed", seed_policy_snapshot)
 
 
 @pytest.fixture(scope="session", autouse=True)
-def appium_preflight_check():
+def appium_preflight_check(request):
     """Preflight check that runs before all tests.
 
     This fixture:
-    1. Verifies Appium server is running
+    1. Starts (or verifies) the Appium server
     2. Cleans up any stale WebDriverAgent processes
     3. Verifies iOS device is connected
 
     This prevents tests from hanging due to stale WDA sessions.
+    Skipped when no selected test uses the device (--tier=http).
     """
+    if not needs_device(request.session):
+        print("\n⏭️  [PREFLIGHT] No device tests selected - skipping Appium checks")
+        yield
+        return
+
     print("\n" + "="*60)
     print("🚀 [PREFLIGHT] Running E2E test preflight checks...")
     print("="*60)
 
-    # Check 1: Appium server
+    # Check 1: Appium server (started on a free port unless APPIUM_URL is set)
     print("\n📱 [PREFLIGHT] Checking Appium server...")
-    try:
-        import requests
-        response = requests.get("http://127.0.0.1:4723/status", timeout=5)
-        if response.status_code == 200:
-            print("  ✅ Appium server is running")
-        else:
-            pytest.exit("Appium server returned unexpected status")
-    except Exception as e:
-        pytest.exit(
-            f"Appium server is not running! Error: {e}\n"
-            "Start it with: appium"
-        )
+    request.getfixturevalue("appium_server")
+    print(f"  ✅ Appium server is running at {appium_url()}")
 
     # Check 2: Check WDA status (don't kill - just report)
     _check_wda_status()
@@ -397,11 +384,7 @@ def appium_preflight_check():
 def vpn_server_info():
     """Get VPN server connection details from kubectl."""
     try:
-        result = _run_kubectl_command([
-            "get", "svc", "vpn-service",
-            "-o", "jsonpath={.status.loadBalancer.ingress[0].ip}"
-        ])
-        vpn_ip = result.stdout.strip()
+        vpn_ip = vpn_service_ip()
 
         if not vpn_ip:
             pytest.exit("Could not get VPN service external IP")
@@ -414,29 +397,13 @@ def vpn_server_info():
         pytest.exit(f"Failed to get VPN server info: {e}")
 
 
-@pytest.fixture(autouse=True)
-def screenshot_on_failure(request):
-    """Automatically take screenshot on test failure."""
-    yield
+@pytest.fixture(scope="session")
+def whitelisted_channels():
+    """Lower-cased IDs, names and handles of the channels seeded as whitelisted."""
+    return whitelist_keys(TEST_YOUTUBE_CHANNELS)
 
-    if hasattr(request.node, 'rep_call') and request.node.rep_call.failed:
-        try:
-            # Get ios_driver from the test instance if available
-            ios_driver = request.node.funcargs.get('ios_driver')
-            if ios_driver:
-                # Save screenshots to tests/e2e/screenshots/ folder
-                screenshots_dir = os.path.join(os.path.dirname(__file__), "screenshots")
-                os.makedirs(screenshots_dir, exist_ok=True)
-                screenshot_path = os.path.join(screenshots_dir, f"failure_{request.node.name}.png")
-                ios_driver.save_screenshot(screenshot_path)
-                print(f"\n📸 Screenshot saved: {screenshot_path}")
-        except Exception as e:
-            print(f"\n⚠️  Could not save screenshot: {e}")
-
-
-@pytest.hookimpl(tryfirst=True, hookwrapper=True)
-def pytest_runtest_makereport(item, call):
-    """Hook to track test results for screenshot_on_failure fixture."""
-    outcome = yield
-    rep = outcome.get_result()
-    setattr(item, f"rep_{rep.when}", rep)
+
+@pytest.fixture(scope="session")
+def video_channel_cache():
+    """Persisted video -> channel map (see video_channels.py)."""
+    return VideoChannelCache()
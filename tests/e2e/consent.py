@@ -0,0 +1,164 @@
+"""Single-call YouTube/Google consent dismissal.
+
+_handle_youtube_consent used to sleep, then probe fourteen XPaths with one
+find_elements/is_displayed round-trip each before falling back to JS. The
+whole search now runs in one injected async script: it evaluates the same
+XPaths in the page, clicks the first visible match and reports which selector
+hit, so the next call can try that one first.
+"""
+import logging
+import os
+
+# "Read more" sometimes hides the Accept button on the consent bump
+READ_MORE_SELECTORS = [
+    "//button[contains(@aria-label, 'Read more')]",
+    "//button[contains(text(), 'Read more')]",
+    "//div[contains(text(), 'Read more')]",  # Sometimes it's a div
+]
+
+CONSENT_SELECTORS = [
+    # "Accept all" or "I agree" buttons
+    "//button[contains(text(), 'Accept')]",
+    "//button[contains(text(), 'accept')]",
+    "//button[contains(text(), 'I agree')]",
+    "//button[contains(text(), 'Agree')]",
+    "//button[contains(@aria-label, 'Accept')]",
+    # YouTube specific consent buttons
+    "//ytm-button-renderer//button[contains(text(), 'Accept')]",
+    "//tp-yt-paper-button[contains(text(), 'Accept')]",
+    # Generic "OK" or "Continue" buttons
+    "//button[contains(text(), 'OK')]",
+    "//button[contains(text(), 'Continue')]",
+    # GDPR consent forms
+    "//button[@aria-label='Accept all']",
+    "//button[@aria-label='Accept the use of cookies']",
+]
+
+# Reported as the selector when the text-matching fallback did the click
+JS_TEXT_FALLBACK = "js:button-text"
+
+# How long the script keeps polling for a dialog. readyState is already
+# "complete" after driver.get, and YouTube injects the dialog after load, so
+# the page state can't cut this short.
+CONSENT_WAIT_BUDGET_MS = int(os.getenv("E2E_CONSENT_WAIT_MS", "2000"))
+
+DISMISS_SCRIPT = """
+var readMore = arguments[0];
+var consent = arguments[1];
+var budgetMs = arguments[2];
+var done = arguments[arguments.length - 1];
+var started = Date.now();
+var readMoreHit = null;
+
+function visible(el) {
+    var rect = el.getBoundingClientRect();
+    var style = window.getComputedStyle(el);
+    return rect.width > 0 && rect.height > 0 &&
+        style.visibility !== 'hidden' && style.display !== 'none';
+}
+
+function firstVisible(xpath) {
+    try {
+        var snap = document.evaluate(xpath, document, null,
+            XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (var i = 0; i < snap.snapshotLength; i++) {
+            if (visible(snap.snapshotItem(i))) return snap.snapshotItem(i);
+        }
+    } catch (e) {}
+    return null;
+}
+
+function textFallback() {
+    var buttons = document.querySelectorAll('button');
+    for (var i = 0; i < buttons.length; i++) {
+        var text = buttons[i].textContent.toLowerCase();
+        if ((text.includes('accept') || text.includes('agree') || text.includes('ok')) &&
+                visible(buttons[i])) {
+            return buttons[i];
+        }
+    }
+    return null;
+}
+
+function tryConsent() {
+    for (var i = 0; i < consent.length; i++) {
+        var el = firstVisible(consent[i]);
+        if (el) {
+            el.click();
+            return done({clicked: true, selector: consent[i], readMore: readMoreHit});
+        }
+    }
+    var fallback = textFallback();
+    if (fallback) {
+        fallback.click();
+        return done({clicked: true, selector: '%s',
+                     text: fallback.textContent.trim().slice(0, 40), readMore: readMoreHit});
+    }
+    if (Date.now() - started >= budgetMs) {
+        return done({clicked: false, readyState: document.readyState, readMore: readMoreHit,
+                     waitedMs: Date.now() - started});
+    }
+    setTimeout(attempt, 100);
+}
+
+function attempt() {
+    if (!readMoreHit) {
+        for (var i = 0; i < readMore.length; i++) {
+            var el = firstVisible(readMore[i]);
+            if (el) {
+                el.click();
+                readMoreHit = readMore[i];
+                window.scrollBy(0, 500);
+                // Give the expanded dialog a moment to render its buttons
+                return setTimeout(tryConsent, 300);
+            }
+        }
+    }
+    tryConsent();
+}
+
+attempt();
+""" % JS_TEXT_FALLBACK
+
+
+class ConsentDismisser:
+    """Find and click a consent control in a single execute_async_script.
+
+    Remembers the selector that matched last time and tries it first, since
+    the same dialog variant tends to show up for the whole run.
+    """
+
+    def __init__(self, budget_ms: int = CONSENT_WAIT_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.last_hit = None
+
+    def ordered_selectors(self) -> list:
+        if self.last_hit in CONSENT_SELECTORS:
+            return [self.last_hit] + [s for s in CONSENT_SELECTORS if s != self.last_hit]
+        return list(CONSENT_SELECTORS)
+
+    def dismiss(self, driver, budget_ms: int = None) -> bool:
+        """Click the consent control if a dialog is showing.
+
+        ``budget_ms`` overrides how long to poll for one; 0 checks once.
+        Returns True if something was clicked.
+        """
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        result = driver.execute_async_script(
+            DISMISS_SCRIPT, READ_MORE_SELECTORS, self.ordered_selectors(), budget_ms
+        ) or {}
+
+        if result.get("readMore"):
+            logging.info(f"✅ Clicked 'Read more' using {result['readMore']}")
+
+        if result.get("clicked"):
+            self.last_hit = result["selector"]
+            detail = f" ({result['text']})" if result.get("text") else ""
+            logging.info(f"✅ Clicked YouTube consent button: {self.last_hit}{detail}")
+            return True
+
+        logging.info(
+            f"No YouTube consent dialog found after {result.get('waitedMs', 0)}ms "
+            f"(readyState={result.get('readyState')})"
+        )
+        return False
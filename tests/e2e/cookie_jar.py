@@ -0,0 +1,138 @@
+"""Persistent jar for YouTube/Google consent and preference cookies.
+
+Consent walls are the slowest and flakiest step of the YouTube tests, and
+they came back on every test because reset_safari_state wiped cookies. The
+jar captures the consent cookies once, stores them on disk with an expiry,
+and re-injects them before the first YouTube/Google navigation of a driver
+session. reset_safari_state puts exactly these cookies back after clearing
+a page of these domains; everything else is still cleared.
+"""
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+from ..harness.cache import cache_path
+from ..harness.scheduler import measure_transition
+
+CONSENT_COOKIE_NAMES = ("CONSENT", "SOCS", "PREF")
+CONSENT_COOKIE_DOMAINS = ("youtube.com", "google.com")
+
+# Cap on how long a captured cookie is trusted, even if the site set a longer
+# expiry (or none at all, for session cookies).
+JAR_MAX_AGE_DAYS = int(os.getenv("E2E_CONSENT_JAR_MAX_AGE_DAYS", "30"))
+
+
+def consent_domain(host: str):
+    """Map a hostname to its consent domain (m.youtube.com -> youtube.com)."""
+    host = (host or "").lower().lstrip(".")
+    for domain in CONSENT_COOKIE_DOMAINS:
+        if host == domain or host.endswith("." + domain):
+            return domain
+    return None
+
+
+class ConsentCookieJar:
+    """Capture, persist and re-inject consent cookies."""
+
+    def __init__(self, path: str = None):
+        self.path = path or cache_path("consent_cookies.json")
+        self._cookies = None
+        # (session_id, {domain, ...}) - domains already injected in that session
+        self._primed = (None, set())
+
+    @property
+    def cookies(self) -> list:
+        if self._cookies is None:
+            self._cookies = self._load()
+        return self._cookies
+
+    def _load(self) -> list:
+        try:
+            with open(self.path) as f:
+                cookies = json.load(f)
+        except (OSError, ValueError):
+            return []
+        now = time.time()
+        return [c for c in cookies if c.get("expiry", 0) > now]
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.cookies, f, indent=2)
+
+    def _primed_domains(self, driver) -> set:
+        if self._primed[0] != driver.session_id:
+            self._primed = (driver.session_id, set())
+        return self._primed[1]
+
+    def primed(self, driver, domain: str) -> bool:
+        """Whether this driver session already holds the jar's cookies for ``domain``."""
+        return domain in self._primed_domains(driver)
+
+    def has_cookies_for(self, domain: str) -> bool:
+        return any(consent_domain(c["domain"]) == domain for c in self.cookies)
+
+    def capture(self, driver) -> int:
+        """Store the consent cookies visible on the current page.
+
+        Returns the number of cookies captured.
+        """
+        domain = consent_domain(urlsplit(driver.current_url).hostname)
+        if not domain:
+            return 0
+
+        max_expiry = int(time.time()) + JAR_MAX_AGE_DAYS * 86400
+        captured = []
+        for cookie in driver.get_cookies():
+            if cookie.get("name") not in CONSENT_COOKIE_NAMES:
+                continue
+            if consent_domain(cookie.get("domain")) != domain:
+                continue
+            captured.append({
+                "name": cookie["name"],
+                "value": cookie["value"],
+                "domain": cookie.get("domain") or f".{domain}",
+                "path": cookie.get("path") or "/",
+                "secure": bool(cookie.get("secure", True)),
+                "httpOnly": bool(cookie.get("httpOnly", False)),
+                "expiry": min(int(cookie.get("expiry") or max_expiry), max_expiry),
+            })
+        if not captured:
+            return 0
+
+        keys = {(c["name"], c["domain"], c["path"]) for c in captured}
+        self._cookies = [
+            c for c in self.cookies if (c["name"], c["domain"], c["path"]) not in keys
+        ] + captured
+        self.save()
+        self._primed_domains(driver).add(domain)
+        logging.info(f"🍪 Captured {len(captured)} consent cookie(s) for {domain}")
+        return len(captured)
+
+    def prime(self, driver, url: str) -> bool:
+        """Inject stored consent cookies before navigating to ``url``.
+
+        WebDriver only accepts cookies for the current document, so this
+        loads the site's robots.txt first. It happens once per driver session
+        and domain, because the reset keeps these cookies between tests.
+        Timed as the scheduler's consent_prime transition.
+        """
+        host = urlsplit(url).hostname
+        domain = consent_domain(host)
+        if not domain or domain in self._primed_domains(driver):
+            return False
+        cookies = [c for c in self.cookies if consent_domain(c["domain"]) == domain]
+        if not cookies:
+            return False
+
+        with measure_transition("consent_prime"):
+            driver.get(f"https://{host}/robots.txt")
+            for cookie in cookies:
+                try:
+                    driver.add_cookie(dict(cookie))
+                except Exception as e:
+                    logging.debug(f"  ⚠️  Could not inject cookie {cookie['name']}: {e}")
+        self._primed_domains(driver).add(domain)
+        logging.info(f"🍪 Injected {len(cookies)} consent cookie(s) for {domain}")
+        return True
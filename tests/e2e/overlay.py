@@ -0,0 +1,119 @@
+"""Event-driven detection of the proxy-injected location overlay.
+
+The overlay tests used to sleep a fixed 5s after each navigation and then
+grep page_source. Instead, one execute_async_script installs a
+MutationObserver and resolves the moment #location-permission-overlay is
+attached and visible (or removed/hidden), so the test continues as soon as
+the page is ready and the time the overlay took to render is measured on the
+device's own clock.
+
+Times are performance.now() values, i.e. milliseconds since the document's
+navigation start. When the overlay was already in place by the time the
+script ran (driver.get usually returns after load), ``observed`` is False
+and ``at_ms`` is only an upper bound.
+"""
+import logging
+import os
+from dataclasses import dataclass
+
+OVERLAY_ID = "location-permission-overlay"
+
+# Upper bound on how long to wait for the overlay to change state. The
+# default script timeout is 30s, keep this below it.
+OVERLAY_WAIT_BUDGET_MS = int(os.getenv("E2E_OVERLAY_WAIT_MS", "10000"))
+
+# How long an overlay that must NOT come back is given to show up anyway
+OVERLAY_ABSENT_BUDGET_MS = int(os.getenv("E2E_OVERLAY_ABSENT_MS", "3000"))
+
+WAIT_SCRIPT = """
+var overlayId = arguments[0];
+var want = arguments[1];
+var budgetMs = arguments[2];
+var done = arguments[arguments.length - 1];
+var started = performance.now();
+var observer = null, timer = null;
+
+function visible() {
+    var el = document.getElementById(overlayId);
+    if (!el || !el.isConnected) return false;
+    var style = window.getComputedStyle(el);
+    return style.display !== 'none' && style.visibility !== 'hidden';
+}
+
+function matched() {
+    return (want === 'visible') === visible();
+}
+
+function finish(observed) {
+    if (observer) observer.disconnect();
+    if (timer) clearTimeout(timer);
+    var now = performance.now();
+    done({matched: matched(), visible: visible(), observed: observed,
+          atMs: now, waitedMs: now - started, present: !!document.getElementById(overlayId)});
+}
+
+if (matched()) {
+    finish(false);
+} else {
+    observer = new MutationObserver(function () {
+        if (matched()) finish(true);
+    });
+    observer.observe(document.documentElement, {
+        childList: true, subtree: true,
+        attributes: true, attributeFilter: ['style', 'class', 'hidden']
+    });
+    timer = setTimeout(function () { finish(false); }, budgetMs);
+}
+"""
+
+
+@dataclass
+class OverlayState:
+    matched: bool  # reached the requested state within the budget
+    visible: bool
+    present: bool  # node in the DOM, visible or not
+    observed: bool  # the change happened while watching, so at_ms is exact
+    at_ms: float  # ms since navigation start when the state was seen
+    waited_ms: float
+
+
+def _wait(driver, want: str, budget_ms: int) -> OverlayState:
+    result = driver.execute_async_script(WAIT_SCRIPT, OVERLAY_ID, want, budget_ms) or {}
+    return OverlayState(
+        matched=bool(result.get("matched")),
+        visible=bool(result.get("visible")),
+        present=bool(result.get("present")),
+        observed=bool(result.get("observed")),
+        at_ms=float(result.get("atMs") or 0.0),
+        waited_ms=float(result.get("waitedMs") or 0.0),
+    )
+
+
+def wait_for_overlay(driver, budget_ms: int = OVERLAY_WAIT_BUDGET_MS, node=None) -> OverlayState:
+    """Wait until the overlay is attached and visible.
+
+    With ``node`` (a pytest item) the time-to-appear is added to its
+    user_properties as ``overlay:time_to_appear_ms`` when the overlay was
+    seen appearing. An overlay that was already there only gives an upper
+    bound, recorded as ``overlay:appeared_by_ms`` instead.
+    """
+    state = _wait(driver, "visible", budget_ms)
+    if state.matched:
+        bound = "" if state.observed else " (already present, upper bound)"
+        logging.info(f"📍 Location overlay visible {state.at_ms:.0f} ms after navigation start{bound}")
+        if node is not None:
+            name = "overlay:time_to_appear_ms" if state.observed else "overlay:appeared_by_ms"
+            node.user_properties.append((name, round(state.at_ms, 1)))
+    else:
+        logging.info(f"📍 No visible location overlay after {state.waited_ms:.0f} ms (present={state.present})")
+    return state
+
+
+def wait_for_overlay_gone(driver, budget_ms: int = OVERLAY_WAIT_BUDGET_MS) -> OverlayState:
+    """Wait until the overlay is removed or hidden."""
+    state = _wait(driver, "gone", budget_ms)
+    if state.matched:
+        logging.info(f"📍 Location overlay gone after {state.waited_ms:.0f} ms")
+    else:
+        logging.info(f"📍 Location overlay still visible after {state.waited_ms:.0f} ms")
+    return state
@@ -0,0 +1,127 @@
+"""Dirty-tracking Safari state reset for E2E tests.
+
+The old reset_safari_state issued delete_all_cookies, current_url and an
+execute_script after every test, even when the test never left about:blank.
+SafariStateTracker records the origins a test navigates to and skips the
+cleanup entirely when nothing was touched; otherwise it is delete_all_cookies
+plus one script call that clears storage and restores the consent cookies.
+"""
+import logging
+from urllib.parse import urlsplit
+
+from ..harness.driver_hooks import add_command_middleware
+
+# Runs in the page that is current when the test ends, right after
+# delete_all_cookies (the only way to reach HttpOnly cookies): clears its
+# storage and puts back the preserved cookies of its host in the same call.
+RESET_SCRIPT = """
+var preserve = arguments[0] || [];
+var result = {origin: window.location.origin, storage: false, restored: 0};
+if (result.origin === 'null') return result;
+try {
+    localStorage.clear();
+    sessionStorage.clear();
+    result.storage = true;
+} catch (e) {}
+var host = window.location.hostname.toLowerCase();
+preserve.forEach(function (c) {
+    var domain = (c.domain || '').toLowerCase().replace(/^\\./, '');
+    if (!domain || (host !== domain && !host.endsWith('.' + domain))) return;
+    var cookie = c.name + '=' + c.value + '; domain=' + c.domain + '; path=' + (c.path || '/');
+    if (c.expiry) cookie += '; expires=' + new Date(c.expiry * 1000).toUTCString();
+    if (c.secure) cookie += '; secure';
+    document.cookie = cookie;
+    result.restored++;
+});
+return result;
+"""
+
+
+def _cookie_matches(host: str, cookie: dict) -> bool:
+    domain = (cookie.get("domain") or "").lower().lstrip(".")
+    return bool(domain) and (host == domain or host.endswith("." + domain))
+
+
+def url_origin(url: str):
+    """Return scheme://host[:port] for http(s) URLs, None for anything else."""
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc.lower()}"
+
+
+class SafariStateTracker:
+    """Track the origins a test touches and reset only those.
+
+    Attach once per driver; the tracker watches every ``get`` command. Call
+    reset() after each test: it is a no-op when nothing was visited, and
+    starts the next test with a clean dirty set either way.
+    """
+
+    def __init__(self):
+        self.dirty_origins = set()
+
+    def attach(self, driver):
+        add_command_middleware(driver, self._track_navigation)
+        return self
+
+    def _track_navigation(self, call_next, command, params):
+        if command == "get" and params:
+            self.record(params.get("url"))
+        return call_next(command, params)
+
+    def record(self, url: str):
+        origin = url_origin(url)
+        if origin:
+            self.dirty_origins.add(origin)
+
+    def reset(self, driver, preserve: list = None) -> dict:
+        """Clear cookies and storage of the page the test ended on.
+
+        Runs when the test navigated anywhere. The page it ended on counts
+        as dirty even if it was reached by a redirect or a click rather than
+        a ``get``. Its cookies (HttpOnly included) go with delete_all_cookies;
+        one script then clears its storage and puts back the ``preserve``
+        cookies (the consent jar) of its host. Only HttpOnly preserved
+        cookies need an add_cookie each.
+
+        Other origins the test visited can't be reached without a navigation;
+        they are reported and dropped, so they don't keep later tests from
+        skipping the reset.
+        """
+        if not self.dirty_origins:
+            logging.info("  ⏭️  No origins visited - Safari reset skipped")
+            return {"skipped": True}
+        visited, self.dirty_origins = self.dirty_origins, set()
+
+        try:
+            driver.delete_all_cookies()
+        except Exception as e:
+            # e.g. the test ended on about:blank
+            logging.debug(f"  ⚠️  delete_all_cookies failed: {e}")
+        preserve = preserve or []
+        result = driver.execute_script(RESET_SCRIPT, [c for c in preserve if not c.get("httpOnly")]) or {}
+        origin = result.get("origin")
+        if not origin or origin == "null":
+            logging.info(f"  ⏭️  Current page has no origin - {len(visited)} visited origin(s) not reset")
+            result["skipped"] = True
+            return result
+
+        host = urlsplit(origin).hostname or ""
+        restored = result.get("restored", 0)
+        for cookie in preserve:
+            if cookie.get("httpOnly") and _cookie_matches(host, cookie):
+                try:
+                    driver.add_cookie(dict(cookie))
+                    restored += 1
+                except Exception as e:
+                    logging.debug(f"  ⚠️  Could not restore cookie {cookie.get('name')}: {e}")
+        result["restored"] = restored
+        logging.info(
+            f"  ✅ Cleared cookies{' and storage' if result.get('storage') else ''} for {origin}"
+            f"{f' (kept {restored} consent cookie(s))' if restored else ''}"
+        )
+        left = visited - {origin}
+        if left:
+            logging.info(f"  ℹ️  Not reachable without navigating, not reset: {', '.join(sorted(left))}")
+        return result
@@ -13,50 +13,55 @@ Requirements:
 import pytest
 import time
 import logging
-from appium import webdriver
-from appium.options.ios import XCUITestOptions
-from appium.webdriver.common.appiumby import AppiumBy
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import subprocess
 import json
 
+from ..harness import device, kube, location
+from ..harness.blockpage import is_block_page
+from ..harness.device import By
+from ..harness.latency import DecisionLatency
+from ..harness.roundtrips import find_visible
+from .consent import ConsentDismisser
+from .cookie_jar import ConsentCookieJar
+from .safari_state import SafariStateTracker
+from .video_channels import CLICK_SCRIPT
+
 
 @pytest.mark.usefixtures("seed_test_database")
 class TestIOSProxyFlows:
     """E2E tests for iOS Safari through VPN proxy."""
 
+    # Shared across tests so the last matching consent selector is tried first
+    _consent = ConsentDismisser()
+    # Consent cookies persisted across tests and runs (see cookie_jar.py)
+    _cookie_jar = ConsentCookieJar()
+
     @pytest.fixture(scope="class")
     def vpn_server_ip(self):
         """Get VPN server IP from kubectl (GKE LoadBalancer)."""
-        result = subprocess.run(
-            ["kubectl", "-n", "hocuspocus", "get", "svc", "vpn-service",
-             "-o", "jsonpath={.status.loadBalancer.ingress[0].ip}"],
-            capture_output=True,
-            text=True
-        )
-        return result.stdout.strip()
+        return kube.vpn_service_ip()
 
     @pytest.fixture(scope="class")
     def is_simulator(self, ios_driver):
         """Detect if running on iOS Simulator vs real device."""
         caps = ios_driver.capabilities
-        # Simulator UDIDs are very long and look like: "XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX"
-        # Real device UDIDs are shorter: "00008020-0004695621DA002E"
         udid = caps.get('udid', '')
-        device_name = caps.get('deviceName', '')
-
-        # Check if it's a simulator
-        is_sim = 'simulator' in device_name.lower() or len(udid) > 30
+        is_sim = device.is_simulator(ios_driver)
         logging.info(f"📱 Device type: {'iOS Simulator' if is_sim else 'Real Device'} (UDID: {udid})")
         return is_sim
 
+    @pytest.fixture(scope="class")
+    def safari_state(self, ios_driver):
+        """Track which origins the tests navigate to, for reset_safari_state."""
+        return SafariStateTracker().attach(ios_driver)
+
     @pytest.fixture(autouse=True)
-    def reset_safari_state(self, ios_driver, request):
+    def reset_safari_state(self, ios_driver, safari_state, request):
         """Reset Safari state between tests to ensure test isolation.
 
-        This runs automatically after each test to clear cookies and storage,
-        preventing state carryover between tests.
+        This runs automatically after each test. Tests that never navigated
+        cost no round-trips; otherwise the page the test ended on loses its
+        cookies and storage. Consent cookies from the jar are put back so
+        YouTube doesn't show its consent wall again.
         """
         # Let the test run first
         yield
@@ -65,33 +70,7 @@ class TestIOSProxyFlows:
         try:
             test_name = request.node.name
             logging.info(f"🔄 Cleaning up after test: {test_name}")
-
-            # Clear cookies to prevent authentication/session carryover
-            try:
-                ios_driver.delete_all_cookies()
-                logging.info("  ✅ Cookies cleared")
-            except Exception as e:
-                logging.debug(f"  ⚠️  Could not clear cookies: {e}")
-
-            # Clear localStorage and sessionStorage to prevent data carryover
-            try:
-                current_url = ios_driver.current_url
-                if current_url and "about:blank" not in current_url:
-                    ios_driver.execute_script("""
-                        try {
-                            localStorage.clear();
-                            sessionStorage.clear();
-                            console.log('Storage cleared');
-                        } catch(e) {
-                            console.log('Could not clear storage:', e);
-                        }
-                    """)
-                    logging.info("  ✅ Storage cleared")
-            except Exception as e:
-                logging.debug(f"  ⚠️  Could not clear storage: {e}")
-
-            logging.info("  ✅ Safari state reset complete")
-
+            safari_state.reset(ios_driver, preserve=self._cookie_jar.cookies)
         except Exception as e:
             # Don't fail tests if cleanup fails
             logging.warning(f"⚠️  Safari cleanup failed (non-critical): {e}")
@@ -105,7 +84,6 @@ class TestIOSProxyFlows:
         """
         # Verify VPN server is reachable before starting tests
         import socket
-        import os
 
         # Check if VPN port is accessible (UDP 500 for IKEv2)
         try:
@@ -117,83 +95,32 @@ class TestIOSProxyFlows:
         except Exception as e:
             logging.warning(f"⚠️  Could not verify VPN server: {e} (may still work)")
 
-        # Determine device type from environment or default to real device
-        device_type = os.getenv('IOS_DEVICE_TYPE', 'real').lower()
-
-        # Configure Appium options
-        options = XCUITestOptions()
-        options.platform_name = "iOS"
-        options.browser_name = "Safari"
-        options.automation_name = "XCUITest"
-        options.no_reset = True
-        options.full_reset = False
-
-        # Automatically accept location permission alerts
-        options.set_capability("appium:autoAcceptAlerts", True)
+        options = device.xcuitest_options(
+            no_reset=True,
+            auto_accept_alerts=True,
+            capabilities={"fullReset": False},
+            real_device_capabilities=device.e2e_real_device_capabilities(),
+        )
 
-        if device_type == 'simulator':
-            # iOS Simulator configuration
+        if device.device_type() == 'simulator':
             logging.info("🖥️  Configuring for iOS Simulator")
-            options.platform_version = "26.2"  # Adjust as needed
-            options.device_name = "iPhone 17 Pro"  # Adjust as needed
-            # UDID will be auto-detected for booted simulator
-
-            # Simulator doesn't need WDA configuration
-            options.set_capability("appium:wdaLaunchTimeout", 60000)
         else:
-            # Real device configuration
             logging.info("📱 Configuring for Real iOS Device")
-            options.platform_version = os.getenv("IOS_PLATFORM_VERSION", "18.7.3")
-            options.device_name = os.getenv("IOS_DEVICE_NAME", "Tushar's iPhone")
-            options.udid = os.getenv("IOS_UDID", "00008020-0004695621DA002E")
-            options.set_capability("appium:showXcodeLog", True)
-
-            # WebDriverAgent code signing configuration for real device
-            # These settings survive Appium reinstalls (no need to reconfigure Xcode)
-            options.set_capability("appium:xcodeOrgId", os.getenv("IOS_XCODE_ORG_ID", "QG9U628JFD"))  # Apple Team ID
-            options.set_capability("appium:xcodeSigningId", os.getenv("IOS_XCODE_SIGNING_ID", "Apple Development"))
-            options.set_capability("appium:updatedWDABundleId", os.getenv("IOS_WDA_BUNDLE_ID", "com.tushru2004.WebDriverAgentRunner"))
-
-            # After fresh Appium install, run once with: USE_PREBUILT_WDA=false make test-e2e
-            # This builds and installs WDA. Subsequent runs use prebuilt (faster).
-            use_prebuilt = os.getenv("USE_PREBUILT_WDA", "true").lower() == "true"
-            options.set_capability("appium:usePrebuiltWDA", use_prebuilt)
-            # Keep WDA installed so the trust prompt persists if a run fails
-            options.set_capability("appium:skipUninstall", True)
-            options.set_capability("appium:useXctestrunFile", False)
-            options.set_capability("appium:wdaLaunchTimeout", 120000)
-            options.set_capability("appium:wdaConnectionTimeout", 120000)
-            options.set_capability("appium:commandTimeouts", {"default": int(os.getenv("APPIUM_CMD_TIMEOUT_MS", "60000"))})
-            # IMPORTANT: Do NOT set clearSystemFiles=True - it causes WDA to be uninstalled on failure,
-            # which removes the trusted developer certificate and requires manual re-trust on iPhone
-            options.set_capability("appium:clearSystemFiles", False)
-
             # Set default safe location for real device (doesn't work on iOS 17+, but doesn't hurt)
             logging.info("📍 Attempting to set default GPS location (may not work on iOS 17+)")
-            subprocess.run(
-                ["idevicesetlocation", "-u", "00008020-0004695621DA002E", "37.7749", "-122.4194"],
-                check=False,
-                capture_output=True
-            )
-            time.sleep(1)
+            location.set_device_gps(device.device_udid(), *location.SAFE_LOCATION, settle=1)
 
         # Device uses IKEv2 VPN with Always-On profile
         # All traffic automatically routes through VPN proxy (transparent mitmproxy)
 
         # Start Appium driver
-        driver = webdriver.Remote(
-            "http://127.0.0.1:4723",
-            options=options
-        )
+        driver = device.create_driver(options)
 
         # Set default safe location for simulator (this actually works!)
-        caps = driver.capabilities
-        udid = caps.get('udid', '')
-        is_sim = 'simulator' in caps.get('deviceName', '').lower() or len(udid) > 30
-
-        if is_sim:
+        if device.is_simulator(driver):
             logging.info("📍 Setting default GPS location on simulator to San Francisco")
-            driver.set_location(latitude=37.7749, longitude=-122.4194, altitude=0)
+            lat, lng = location.SAFE_LOCATION
+            driver.set_location(latitude=lat, longitude=lng, altitude=0)
             time.sleep(1)
 
         yield driver
@@ -201,6 +128,8 @@ class TestIOSProxyFlows:
         # Teardown
         driver.quit()
 
+    @pytest.mark.policy(allowed_hosts=["google.com"])
+    @pytest.mark.http_tier(url="https://www.google.com", expect="allowed")
     def test_whitelisted_domain_loads(self, ios_driver):
         """Test that whitelisted domains (google.com) load successfully."""
         driver = ios_driver
@@ -216,9 +145,10 @@ class TestIOSProxyFlows:
         assert "Google" in page_source or "google" in page_source.lower()
 
         # Should not see block page
-        assert "not whitelisted" not in page_source.lower()
-        assert "Access denied" not in page_source
+        assert not is_block_page(page_source)
 
+    @pytest.mark.policy(allowed_hosts=["twitter.com"])
+    @pytest.mark.http_tier(url="https://twitter.com", expect="blocked")
     def test_non_whitelisted_domain_blocked(self, ios_driver):
         """Test that non-whitelisted domains are blocked."""
         driver = ios_driver
@@ -231,10 +161,14 @@ class TestIOSProxyFlows:
 
         # Should see block page
         page_source = driver.page_source
-        assert "not whitelisted" in page_source.lower() or \
-               "Access denied" in page_source or \
-               "blocked" in page_source.lower()
-
+        assert is_block_page(page_source) or "blocked" in page_source.lower()
+
+    @pytest.mark.policy(
+        allowed_hosts=["youtube.com"],
+        youtube_channels=["UCzQUP1qoWDoEbmsQxvdjxgQ"],
+    )
+    @pytest.mark.device_state(consent=True)
+    @pytest.mark.http_tier(url="https://m.youtube.com/watch?v=lwgJhmsQz0U", expect="allowed")
     def test_whitelisted_youtube_channel_plays(self, ios_driver):
         """Test that whitelisted YouTube channel videos are allowed and actually plays."""
         driver = ios_driver
@@ -249,6 +183,7 @@ class TestIOSProxyFlows:
         import random
         cache_bust = random.randint(100000, 999999)
         video_url = f"https://m.youtube.com/watch?v=lwgJhmsQz0U&_cb={cache_bust}"
+        self._prime_consent_cookies(driver, video_url)
         driver.get(video_url)
 
         # Handle YouTube consent dialog if it appears
@@ -262,14 +197,11 @@ class TestIOSProxyFlows:
         # Should NOT see block page from proxy
         # Note: We can't just check for "YouTube Video Blocked" in page_source because
         # the injected script contains this string. We must check if the overlay is actually visible.
-        try:
-            block_overlay = driver.find_element(AppiumBy.ID, "yt-video-block-overlay")
-            if block_overlay.is_displayed():
-                # Capture text to verify it's the block page
-                assert "YouTube Video Blocked" not in block_overlay.text, "YouTube block overlay is visible"
-        except:
-            # Overlay not found, which is good
-            pass
+        # One round trip for find + is_displayed + text; a missing overlay is good
+        block_overlay = find_visible(driver, By.ID, "yt-video-block-overlay")
+        if block_overlay.displayed:
+            # Capture text to verify it's the block page
+            assert "YouTube Video Blocked" not in block_overlay.text, "YouTube block overlay is visible"
 
         assert "channel is not allowed" not in page_source.lower(), \
             "Video from whitelisted channel should not be blocked (proxy error)"
@@ -319,7 +251,10 @@ class TestIOSProxyFlows:
             assert "youtube" in page_source.lower() or "video" in page_source.lower(), \
                 "YouTube page should have loaded - check if video is actually blocked"
 
-    def test_non_whitelisted_youtube_video_blocked(self, ios_driver):
+    @pytest.mark.policy(allowed_hosts=["youtube.com"], youtube_channels=True)
+    @pytest.mark.device_state(consent=True)
+    @pytest.mark.http_tier(url="https://m.youtube.com/watch?v=dQw4w9WgXcQ", expect="blocked")
+    def test_non_whitelisted_youtube_video_blocked(self, ios_driver, request):
         """Test that non-whitelisted YouTube channel videos are blocked.
 
         Note: This test may be flaky due to Safari caching or YouTube's SPA behavior.
@@ -343,7 +278,9 @@ class TestIOSProxyFlows:
         import random
         cache_bust = random.randint(100000, 999999)
         non_whitelisted_video_url = f"https://m.youtube.com/watch?v=dQw4w9WgXcQ&_cb={cache_bust}"
-        driver.get(non_whitelisted_video_url)
+        self._prime_consent_cookies(driver, non_whitelisted_video_url)
+        latency = DecisionLatency(request.node.nodeid)
+        latency.navigate(driver, non_whitelisted_video_url)
 
         # Handle YouTube consent dialog if it appears
         self._handle_youtube_consent(driver)
@@ -358,21 +295,24 @@ class TestIOSProxyFlows:
         # 1. An explicit block message
         # 2. A redirect/error page
         # 3. The browser showing cached content (flaky)
-        is_blocked = ("not allowed" in page_source.lower() or
-                     "channel not whitelisted" in page_source.lower() or
-                     "access denied" in page_source.lower() or
-                     "channel is not allowed" in page_source.lower())
-
-        # If explicitly blocked, test passes
-        if is_blocked:
-            return
+        is_blocked = is_block_page(page_source) or "not allowed" in page_source.lower()
 
         # If not explicitly blocked, check that the specific video isn't playing
         # (may still show YouTube UI due to caching, but shouldn't show THIS video's title)
         # Rick Astley's "Never Gonna Give You Up" should not be visible
-        assert "never gonna give you up" not in page_source.lower(), \
-            "Non-whitelisted video should be blocked but video title is visible"
-
+        if not is_blocked:
+            assert "never gonna give you up" not in page_source.lower(), \
+                "Non-whitelisted video should be blocked but video title is visible"
+
+        logs = kube.deployment_logs("mitmproxy", since_time=latency.nav_start - 30, timestamps=True)
+        if logs.returncode == 0:
+            latency.record("youtube_blocked", logs.stdout, needle="dQw4w9WgXcQ")
+
+    @pytest.mark.policy(
+        allowed_hosts=["youtube.com"],
+        youtube_channels=["UCzQUP1qoWDoEbmsQxvdjxgQ"],
+    )
+    @pytest.mark.device_state(consent=True)
     def test_youtube_url_query_params_not_duplicated(self, ios_driver):
         """Regression test: YouTube URLs with query params should not be mangled.
 
@@ -398,6 +338,7 @@ class TestIOSProxyFlows:
         import random
         cache_bust = random.randint(100000, 999999)
         video_with_params = f"https://m.youtube.com/watch?v=lwgJhmsQz0U&t=60&_cb={cache_bust}"
+        self._prime_consent_cookies(driver, video_with_params)
         driver.get(video_with_params)
 
         time.sleep(5)
@@ -414,6 +355,9 @@ class TestIOSProxyFlows:
         assert "youtube" in page_source.lower() or "video" in page_source.lower(), \
             "YouTube page should load correctly with query parameters"
 
+    @pytest.mark.policy(
+        allowed_hosts=["accounts.google.com", "gstatic.com", "googleapis.com", "googleusercontent.com"],
+    )
     def test_google_signin_flow(self, ios_driver):
         """Test that Google sign-in flow works (requires play.google.com)."""
         driver = ios_driver
@@ -440,132 +384,57 @@ class TestIOSProxyFlows:
         try:
             # Wait for alert to appear
             time.sleep(2)
-            # Try to find and click "Allow" button using XCUITest
-            allow_button = driver.find_element(AppiumBy.XPATH, "//XCUIElementTypeButton[@name='Allow']")
-            allow_button.click()
+            # Find and tap "Allow" in one XCUITest call (fails without an alert)
+            driver.execute_script("mobile: alert", {"action": "accept", "buttonLabel": "Allow"})
             logging.info("✅ Clicked Allow on location permission alert")
         except Exception as e:
             # Alert might not appear or already handled by autoAcceptAlerts
             logging.info(f"No location alert to handle: {e}")
 
     def _handle_youtube_consent(self, driver):
-        """Handle YouTube consent/terms and conditions dialog."""
-        try:
-            # Give time for dialog to appear
-            time.sleep(2)
-
-            # Try various selectors for YouTube consent dialogs
-            # Try "Read more" first (sometimes hides Accept button)
-            try:
-                # Look for the Read more button using various attributes
-                read_more_selectors = [
-                    "//button[contains(@aria-label, 'Read more')]",
-                    "//button[contains(text(), 'Read more')]",
-                    "//div[contains(text(), 'Read more')]"  # Sometimes it's a div
-                ]
-                
-                for selector in read_more_selectors:
-                    try:
-                        read_more = driver.find_element(AppiumBy.XPATH, selector)
-                        if read_more.is_displayed():
-                            read_more.click()
-                            logging.info(f"✅ Clicked 'Read more' using {selector}")
-                            time.sleep(1)
-                            break
-                    except:
-                        continue
-            except:
-                pass
-
-            # Scroll down just in case
-            try:
-                driver.execute_script("window.scrollBy(0, 500);")
-            except:
-                pass
-
-            consent_selectors = [
-                # "Accept all" or "I agree" buttons
-                "//button[contains(text(), 'Accept')]",
-                "//button[contains(text(), 'accept')]",
-                "//button[contains(text(), 'I agree')]",
-                "//button[contains(text(), 'Agree')]",
-                "//button[contains(@aria-label, 'Accept')]",
-                # YouTube specific consent buttons
-                "//ytm-button-renderer//button[contains(text(), 'Accept')]",
-                "//tp-yt-paper-button[contains(text(), 'Accept')]",
-                # Generic "OK" or "Continue" buttons
-                "//button[contains(text(), 'OK')]",
-                "//button[contains(text(), 'Continue')]",
-                # GDPR consent forms
-                "//button[@aria-label='Accept all']",
-                "//button[@aria-label='Accept the use of cookies']",
-            ]
-
-            for selector in consent_selectors:
-                try:
-                    buttons = driver.find_elements(AppiumBy.XPATH, selector)
-                    for button in buttons:
-                        if button.is_displayed():
-                            button.click()
-                            logging.info(f"✅ Clicked YouTube consent button: {selector}")
-                            time.sleep(1)
-                            return True
-                except:
-                    continue
-
-            # Try JavaScript click as fallback
-            try:
-                result = driver.execute_script("""
-                    var buttons = document.querySelectorAll('button');
-                    for (var i = 0; i < buttons.length; i++) {
-                        var text = buttons[i].textContent.toLowerCase();
-                        if (text.includes('accept') || text.includes('agree') || text.includes('ok')) {
-                            buttons[i].click();
-                            return 'clicked: ' + buttons[i].textContent;
-                        }
-                    }
-                    return 'no consent button found';
-                """)
-                if result and 'clicked' in result:
-                    logging.info(f"✅ Clicked consent via JS: {result}")
-                    return True
-            except:
-                pass
+        """Handle YouTube consent/terms and conditions dialog.
 
-            logging.info("No YouTube consent dialog found (may already be dismissed)")
-            return False
+        One injected script finds and clicks the control; see consent.py.
+        Consent cookies are then captured into the jar so later tests and
+        runs can skip the dialog entirely. Once the session has them, the
+        script only checks once instead of polling for a dialog that won't
+        come.
+        """
+        try:
+            if self._cookie_jar.primed(driver, "youtube.com"):
+                return self._consent.dismiss(driver, budget_ms=0)
+            clicked = self._consent.dismiss(driver)
+            if clicked or not self._cookie_jar.cookies:
+                self._cookie_jar.capture(driver)
+            return clicked
         except Exception as e:
             logging.info(f"Could not handle YouTube consent: {e}")
             return False
 
+    def _prime_consent_cookies(self, driver, url):
+        """Inject saved consent cookies before the first YouTube/Google load."""
+        try:
+            self._cookie_jar.prime(driver, url)
+        except Exception as e:
+            logging.info(f"Could not inject consent cookies: {e}")
+
     def _set_device_location(self, udid, latitude, longitude):
         """Set GPS location on real iOS device using idevicesetlocation."""
-        try:
-            subprocess.run(
-                ["idevicesetlocation", "-u", udid, str(latitude), str(longitude)],
-                check=True,
-                capture_output=True
-            )
-            logging.info(f"✅ Set device GPS to ({latitude}, {longitude})")
-            time.sleep(3)  # Give device time to update location
-        except subprocess.CalledProcessError as e:
-            logging.error(f"⚠️  Failed to set device location: {e.stderr.decode()}")
-        except FileNotFoundError:
-            logging.warning("⚠️  idevicesetlocation not found, using Appium set_location() fallback")
-            # Fallback to Appium method (works on simulators)
-            # Note: This won't work reliably on real devices for Safari
-            time.sleep(1)
+        location.set_device_gps(udid, latitude, longitude)
 
     def _set_safe_location(self, driver):
         """Set GPS to a safe default location (San Francisco)."""
         try:
             logging.info("📍 Setting GPS to safe default location (San Francisco)")
-            self._set_device_location("00008020-0004695621DA002E", 37.7749, -122.4194)
+            self._set_device_location(device.device_udid(), *location.SAFE_LOCATION)
             logging.info("✅ Location set to safe zone")
         except Exception as e:
             logging.warning(f"⚠️  Could not set safe location: {e}")
 
-    def test_clicking_non_whitelisted_related_video_blocked(self, ios_driver):
+    @pytest.mark.policy(allowed_hosts=["youtube.com"], youtube_channels=True)
+    @pytest.mark.device_state(consent=True)
+    def test_clicking_non_whitelisted_related_video_blocked(
+            self, ios_driver, video_channel_cache, whitelisted_channels):
         """Test that clicking a non-whitelisted related video from a whitelisted video is blocked.
 
         This tests the race condition fix where:
@@ -590,6 +459,7 @@ class TestIOSProxyFlows:
         cache_bust = random.randint(100000, 999999)
         jre_video_url = f"https://m.youtube.com/watch?v=lwgJhmsQz0U&_cb={cache_bust}"
         logging.info(f"📺 Loading JRE video: {jre_video_url}")
+        self._prime_consent_cookies(driver, jre_video_url)
         driver.get(jre_video_url)
 
         # Handle YouTube consent dialog if it appears
@@ -603,14 +473,11 @@ class TestIOSProxyFlows:
         # Verify JRE video loaded (not blocked)
         # Note: We can't just check for "YouTube Video Blocked" in page_source because
         # the injected script contains this string. We must check if the overlay is actually visible.
-        try:
-            block_overlay = driver.find_element(AppiumBy.ID, "yt-video-block-overlay")
-            if block_overlay.is_displayed():
-                # Capture text to verify it's the block page
-                assert "YouTube Video Blocked" not in block_overlay.text, "YouTube block overlay is visible for whitelisted video"
-        except:
-            # Overlay not found, which is good
-            pass
+        # One round trip for find + is_displayed + text; a missing overlay is good
+        block_overlay = find_visible(driver, By.ID, "yt-video-block-overlay")
+        if block_overlay.displayed:
+            # Capture text to verify it's the block page
+            assert "YouTube Video Blocked" not in block_overlay.text, "YouTube block overlay is visible for whitelisted video"
 
         assert "channel is not allowed" not in page_source.lower(), \
             "JRE video should not be blocked (proxy error)"
@@ -626,105 +493,83 @@ class TestIOSProxyFlows:
         except Exception as e:
             logging.warning(f"Could not scroll: {e}")
 
-        # Step 3: Find and click a related video using JavaScript
-        # On mobile YouTube, related videos are in a scrollable list below the video
+        # Step 3: Harvest every related video in one call and pick a target
+        # that is known (from earlier runs) not to be on a whitelisted channel
+        cache = video_channel_cache
         try:
-            # Use JavaScript to find and click a related video link
-            related_video_result = driver.execute_script("""
-                // Find all links that look like video links
-                var links = document.querySelectorAll('a[href*="/watch?v="]');
-                var currentVideoId = 'lwgJhmsQz0U';
-
-                for (var i = 0; i < links.length; i++) {
-                    var href = links[i].href || '';
-                    // Skip the current video
-                    if (href.indexOf(currentVideoId) === -1 && href.indexOf('/watch?v=') !== -1) {
-                        // Extract video ID for logging
-                        var match = href.match(/[?&]v=([^&]+)/);
-                        var videoId = match ? match[1] : 'unknown';
-                        return {found: true, href: href, videoId: videoId, index: i};
-                    }
-                }
-                return {found: false, totalLinks: links.length};
-            """)
+            candidates = cache.harvest(driver, exclude="lwgJhmsQz0U")
+            target = cache.pick_target(candidates, whitelisted_channels)
+            logging.info(f"🔍 {len(candidates)} related video(s), target: {target}")
 
-            logging.info(f"🔍 Related video search result: {related_video_result}")
-
-            if related_video_result and related_video_result.get('found'):
-                # Click the related video using JavaScript
-                video_id = related_video_result.get('videoId', 'unknown')
-                logging.info(f"🖱️ Clicking related video: {video_id}")
-
-                driver.execute_script("""
-                    var links = document.querySelectorAll('a[href*="/watch?v="]');
-                    var currentVideoId = 'lwgJhmsQz0U';
-
-                    for (var i = 0; i < links.length; i++) {
-                        var href = links[i].href || '';
-                        if (href.indexOf(currentVideoId) === -1 && href.indexOf('/watch?v=') !== -1) {
-                            links[i].click();
-                            return true;
-                        }
-                    }
-                    return false;
+            if not target:
+                cache.save()
+                logging.warning(f"Could not find a non-whitelisted related video among {len(candidates)}")
+                pytest.skip("Could not find related video element to click")
+
+            video_id = target["video_id"]
+            logging.info(f"🖱️ Clicking related video: {video_id}")
+            if not driver.execute_script(CLICK_SCRIPT, video_id):
+                cache.save()
+                pytest.skip(f"Related video {video_id} disappeared before the click")
+
+            # Wait for new video to load/block
+            time.sleep(8)
+
+            page_source = driver.page_source
+
+            # The related video should be blocked (not whitelisted channel)
+            is_blocked = (is_block_page(page_source) or
+                          "not allowed" in page_source.lower() or
+                          "YouTube Video Blocked" in page_source)
+
+            if is_blocked:
+                logging.info("✅ Related video was blocked as expected")
+                return
+
+            # Check if video is NOT playing (stuck/error state also counts as blocked)
+            try:
+                video_status = driver.execute_script("""
+                    var video = document.querySelector('video');
+                    if (!video) return {exists: false};
+                    return {
+                        exists: true,
+                        paused: video.paused,
+                        currentTime: video.currentTime,
+                        readyState: video.readyState,
+                        error: video.error ? video.error.message : null
+                    };
                 """)
+                logging.info(f"📺 Video status after click: {video_status}")
 
-                # Wait for new video to load/block
-                time.sleep(8)
-
-                page_source = driver.page_source
-
-                # The related video should be blocked (not whitelisted channel)
-                # Check for block indicators
-                is_blocked = ("not allowed" in page_source.lower() or
-                             "channel not whitelisted" in page_source.lower() or
-                             "access denied" in page_source.lower() or
-                             "channel is not allowed" in page_source.lower() or
-                             "YouTube Video Blocked" in page_source)
-
-                if is_blocked:
-                    logging.info("✅ Related video was blocked as expected")
-                    return
-
-                # Check if video is NOT playing (stuck/error state also counts as blocked)
-                try:
-                    video_status = driver.execute_script("""
-                        var video = document.querySelector('video');
-                        if (!video) return {exists: false};
-                        return {
-                            exists: true,
-                            paused: video.paused,
-                            currentTime: video.currentTime,
-                            readyState: video.readyState,
-                            error: video.error ? video.error.message : null
-                        };
-                    """)
-                    logging.info(f"📺 Video status after click: {video_status}")
-
-                    if video_status:
-                        # If video has error or is stuck (readyState < 2), consider it blocked
-                        if video_status.get('error') or video_status.get('readyState', 0) < 2:
-                            logging.info("✅ Video appears blocked (error or not ready)")
-                            return
-                except Exception as e:
-                    logging.warning(f"Could not check video status: {e}")
-
-                # If not explicitly blocked, the test should fail
-                # because non-JRE videos should be blocked
-                logging.warning("⚠️ Related video may not have been blocked")
-                logging.warning(f"Page source snippet: {page_source[:500]}")
-
-                # For now, mark as a warning rather than hard fail
-                # since related videos might also be JRE content
-                pytest.skip("Could not verify related video blocking - may be JRE content")
-            else:
-                logging.warning(f"Could not find related video. Search result: {related_video_result}")
-                pytest.skip("Could not find related video element to click")
+                if video_status:
+                    # If video has error or is stuck (readyState < 2), consider it blocked
+                    if video_status.get('error') or video_status.get('readyState', 0) < 2:
+                        logging.info("✅ Video appears blocked (error or not ready)")
+                        return
+            except Exception as e:
+                logging.warning(f"Could not check video status: {e}")
+
+            # Not blocked: remember the channel so later runs never pick this
+            # video if it turns out to be whitelisted content
+            cache.learn_from_page(driver, video_id)
+
+            if cache.is_whitelisted(video_id, whitelisted_channels):
+                # Now cached, so the next run picks a different video
+                pytest.skip(f"Related video {video_id} is JRE content - learned for next run")
+
+            logging.warning("⚠️ Related video may not have been blocked")
+            logging.warning(f"Page source snippet: {page_source[:500]}")
+            pytest.skip("Could not verify related video blocking - may be JRE content")
 
         except Exception as e:
             logging.error(f"Error during related video test: {e}")
             pytest.skip(f"Related video test failed with error: {e}")
 
+    @pytest.mark.policy(
+        allowed_hosts=["google.com"],
+        blocked_locations=True,
+        blocked_location_whitelist=["google.com"],
+    )
     def test_location_allowed_outside_blocked_zones(self, ios_driver):
         """Test that browsing works when outside blocked zones.
 
@@ -747,16 +592,9 @@ class TestIOSProxyFlows:
         # Wait for location check and dismiss overlay if needed
         time.sleep(5)
 
-        # Try to click "Continue Anyway" if overlay appears
-        try:
-            continue_button = driver.find_element(
-                AppiumBy.XPATH,
-                "//button[contains(text(), 'Continue Anyway')]"
-            )
-            continue_button.click()
+        # Click "Continue Anyway" if overlay appears (might already be dismissed)
+        if find_visible(driver, By.XPATH, "//button[contains(text(), 'Continue Anyway')]", click=True).clicked:
             time.sleep(2)
-        except:
-            pass  # Overlay might not appear or already dismissed
 
         page_source = driver.page_source
 
@@ -8,13 +8,13 @@ Run separately from other E2E tests:
     PYTHONPATH=src pytest tests/e2e/test_location_overlay.py -v
 """
 import pytest
-import time
 import logging
-import subprocess
 import os
-from appium import webdriver
-from appium.options.ios import XCUITestOptions
-from appium.webdriver.common.appiumby import AppiumBy
+
+from ..harness import device, kube
+from ..harness.device import By
+from ..harness.roundtrips import find_visible
+from .overlay import OVERLAY_ABSENT_BUDGET_MS, wait_for_overlay, wait_for_overlay_gone
 
 
 @pytest.mark.usefixtures("seed_test_database")
@@ -31,20 +31,10 @@ class TestLocationOverlay:
     @pytest.fixture(scope="class")
     def vpn_server_ip(self):
         """Get VPN server IP from kubectl (GKE LoadBalancer)."""
-        try:
-            result = subprocess.run(
-                ["kubectl", "-n", "hocuspocus", "get", "svc", "vpn-service",
-                 "-o", "jsonpath={.status.loadBalancer.ingress[0].ip}"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            ip = result.stdout.strip()
-            if not ip:
-                pytest.fail("Could not get VPN service external IP. Is the GKE cluster running?")
-            return ip
-        except subprocess.CalledProcessError:
-            pytest.fail("Could not get VPN server IP from kubectl. Is kubectl configured?")
+        ip = kube.vpn_service_ip()
+        if not ip:
+            pytest.fail("Could not get VPN service external IP. Is the GKE cluster running?")
+        return ip
 
     @pytest.fixture(scope="class")
     def ios_driver(self, vpn_server_ip):
@@ -66,61 +56,25 @@ class TestLocationOverlay:
         except Exception as e:
             logging.warning(f"⚠️  Could not verify VPN server: {e} (may still work)")
 
-        device_type = os.getenv('IOS_DEVICE_TYPE', 'real').lower()
-
-        options = XCUITestOptions()
-        options.platform_name = "iOS"
-        options.browser_name = "Safari"
-        options.automation_name = "XCUITest"
-        options.no_reset = True
-        options.full_reset = False
-
         # KEY DIFFERENCE: Do NOT auto-accept alerts
         # This allows us to see the location overlay before permission is granted
-        options.set_capability("appium:autoAcceptAlerts", False)
-
-        if device_type == 'simulator':
-            options.platform_version = "26.2"
-            options.device_name = "iPhone 17 Pro"
-            options.set_capability("appium:wdaLaunchTimeout", 60000)
-        else:
-            options.platform_version = os.getenv("IOS_PLATFORM_VERSION", "18.7.3")
-            options.device_name = os.getenv("IOS_DEVICE_NAME", "Tushar's iPhone")
-            options.udid = os.getenv("IOS_UDID", "00008020-0004695621DA002E")
-            options.set_capability("appium:showXcodeLog", True)
-
-            # WebDriverAgent code signing configuration for real device
-            # These settings survive Appium reinstalls (no need to reconfigure Xcode)
-            options.set_capability("appium:xcodeOrgId", os.getenv("IOS_XCODE_ORG_ID", "QG9U628JFD"))  # Apple Team ID
-            options.set_capability("appium:xcodeSigningId", os.getenv("IOS_XCODE_SIGNING_ID", "Apple Development"))
-            options.set_capability("appium:updatedWDABundleId", os.getenv("IOS_WDA_BUNDLE_ID", "com.tushru2004.WebDriverAgentRunner"))
-
-            # After fresh Appium install, run once with: USE_PREBUILT_WDA=false make test-e2e
-            # This builds and installs WDA. Subsequent runs use prebuilt (faster).
-            use_prebuilt = os.getenv("USE_PREBUILT_WDA", "true").lower() == "true"
-            options.set_capability("appium:usePrebuiltWDA", use_prebuilt)
-            # Keep WDA installed so the trust prompt persists if a run fails
-            options.set_capability("appium:skipUninstall", True)
-            options.set_capability("appium:useXctestrunFile", False)
-            options.set_capability("appium:wdaLaunchTimeout", 120000)
-            options.set_capability("appium:wdaConnectionTimeout", 120000)
-            options.set_capability("appium:commandTimeouts", {"default": int(os.getenv("APPIUM_CMD_TIMEOUT_MS", "60000"))})
-            # IMPORTANT: Do NOT set clearSystemFiles=True - it causes WDA to be uninstalled on failure,
-            # which removes the trusted developer certificate and requires manual re-trust on iPhone
-            options.set_capability("appium:clearSystemFiles", False)
-
-        print("🍎 [FIXTURE] Connecting to Appium at http://127.0.0.1:4723...")
-        driver = webdriver.Remote(
-            "http://127.0.0.1:4723",
-            options=options
+        options = device.xcuitest_options(
+            no_reset=True,
+            auto_accept_alerts=False,
+            capabilities={"fullReset": False},
+            real_device_capabilities=device.e2e_real_device_capabilities(),
         )
+
+        print(f"🍎 [FIXTURE] Connecting to Appium at {device.appium_url()}...")
+        driver = device.create_driver(options)
         print("🍎 [FIXTURE] Appium connection established!")
 
         yield driver
         print("🍎 [FIXTURE] Quitting driver...")
         driver.quit()
 
-    def test_location_overlay_appears_and_dismissible(self, ios_driver):
+    @pytest.mark.policy(allowed_hosts=["github.com"], blocked_locations=True)
+    def test_location_overlay_appears_and_dismissible(self, ios_driver, request):
         """Test that location permission overlay appears and can be dismissed.
 
         This test verifies:
@@ -138,25 +92,15 @@ class TestLocationOverlay:
 
         # First clear any existing session storage by going to about:blank
         driver.get("about:blank")
-        time.sleep(1)
 
         driver.get("https://www.github.com")
 
-        # Wait for page to load and overlay to appear
-        time.sleep(5)
-
-        page_source = driver.page_source
-
-        # Check if location overlay is present
-        has_overlay = ("location-permission-overlay" in page_source.lower() or
-                      "location required" in page_source.lower() or
-                      "continue anyway" in page_source.lower() or
-                      "waiting for permission" in page_source.lower())
+        # Returns as soon as the overlay is attached and visible
+        has_overlay = wait_for_overlay(driver, node=request.node).matched
 
         if not has_overlay:
             # Take screenshot for debugging
             try:
-                import os
                 screenshots_dir = os.path.join(os.path.dirname(__file__), "screenshots")
                 os.makedirs(screenshots_dir, exist_ok=True)
                 screenshot_path = os.path.join(screenshots_dir, "debug_no_overlay.png")
@@ -180,12 +124,15 @@ class TestLocationOverlay:
         # Method 1: XPath with text
         try:
             logging.info("Attempting to click 'Continue Anyway' via XPath...")
-            continue_button = driver.find_element(
-                AppiumBy.XPATH,
-                "//button[contains(text(), 'Continue Anyway')] | //button[contains(., 'Continue Anyway')]"
+            continue_button = find_visible(
+                driver,
+                By.XPATH,
+                "//button[contains(text(), 'Continue Anyway')] | //button[contains(., 'Continue Anyway')]",
+                click=True,
             )
-            continue_button.click()
-            time.sleep(2)
+            if not continue_button.clicked:
+                raise LookupError(f"no visible button (found={continue_button.found})")
+            wait_for_overlay_gone(driver, budget_ms=2000)
             dismissed = True
             logging.info("Successfully clicked button via XPath")
         except Exception as e:
@@ -195,9 +142,9 @@ class TestLocationOverlay:
         if not dismissed:
             try:
                 logging.info("Attempting via accessibility ID...")
-                continue_button = driver.find_element(AppiumBy.ACCESSIBILITY_ID, "Continue Anyway")
+                continue_button = driver.find_element(By.ACCESSIBILITY_ID, "Continue Anyway")
                 continue_button.click()
-                time.sleep(2)
+                wait_for_overlay_gone(driver, budget_ms=2000)
                 dismissed = True
                 logging.info("Successfully clicked via accessibility ID")
             except Exception as e:
@@ -216,7 +163,7 @@ class TestLocationOverlay:
                         }
                     }
                 """)
-                time.sleep(2)
+                wait_for_overlay_gone(driver, budget_ms=2000)
                 dismissed = True
                 logging.info("Successfully dismissed via JavaScript")
             except Exception as e:
@@ -228,11 +175,11 @@ class TestLocationOverlay:
                 logging.info("Trying to handle iOS location alert...")
                 # Look for Allow button in iOS alert
                 allow_button = driver.find_element(
-                    AppiumBy.XPATH,
+                    By.XPATH,
                     "//XCUIElementTypeButton[@name='Allow Once'] | //XCUIElementTypeButton[@name='Allow']"
                 )
                 allow_button.click()
-                time.sleep(2)
+                wait_for_overlay_gone(driver, budget_ms=2000)
                 logging.info("Clicked Allow on iOS location dialog")
 
                 # After granting permission, overlay should auto-dismiss
@@ -249,7 +196,8 @@ class TestLocationOverlay:
 
         logging.info("Location overlay test PASSED - overlay appeared and was dismissed")
 
-    def test_location_overlay_blocks_until_action(self, ios_driver):
+    @pytest.mark.policy(allowed_hosts=["google.com"], blocked_locations=True)
+    def test_location_overlay_blocks_until_action(self, ios_driver, request):
         """Test that the overlay blocks page interaction until dismissed.
 
         This verifies the overlay is actually blocking the page content
@@ -259,20 +207,15 @@ class TestLocationOverlay:
 
         # Navigate to a different page to get fresh overlay
         driver.get("https://www.google.com")
-        time.sleep(3)
 
-        page_source = driver.page_source
-
-        # Check for overlay indicators
-        has_overlay = ("location-permission-overlay" in page_source.lower() or
-                      "location required" in page_source.lower())
+        has_overlay = wait_for_overlay(driver, node=request.node).matched
 
         if has_overlay:
             logging.info("Overlay is blocking the page as expected")
 
             # Try to interact with Google search (should fail if overlay is blocking)
             try:
-                search_box = driver.find_element(AppiumBy.NAME, "q")
+                search_box = driver.find_element(By.NAME, "q")
                 # If we can find and interact with the search box, overlay isn't blocking
                 logging.warning("Could access search box - overlay may not be blocking properly")
             except:
@@ -281,7 +224,8 @@ class TestLocationOverlay:
             # Location may already be granted
             pytest.skip("Overlay not present - location permission may already be granted")
 
-    def test_location_overlay_appears_once_per_session(self, ios_driver):
+    @pytest.mark.policy(allowed_hosts=["amazon.com"], blocked_locations=True)
+    def test_location_overlay_appears_once_per_session(self, ios_driver, request):
         """Test that location overlay only appears ONCE per session.
 
         This test specifically addresses the bug where:
@@ -298,7 +242,6 @@ class TestLocationOverlay:
         # Clear session by going to about:blank first
         logging.info("Step 1: Clearing session state...")
         driver.get("about:blank")
-        time.sleep(1)
 
         # Clear sessionStorage via JavaScript to ensure fresh state
         try:
@@ -309,14 +252,9 @@ class TestLocationOverlay:
         # Step 2: Navigate to Amazon (a whitelisted site that triggers overlay)
         logging.info("Step 2: Navigating to amazon.com...")
         driver.get("https://www.amazon.com")
-        time.sleep(5)
-
-        page_source = driver.page_source
 
         # Check if location overlay appeared
-        has_overlay = ("location-permission-overlay" in page_source.lower() or
-                      "location required" in page_source.lower() or
-                      "continue anyway" in page_source.lower())
+        has_overlay = wait_for_overlay(driver, node=request.node).matched
 
         if not has_overlay:
             logging.warning("Location overlay did not appear on first visit")
@@ -337,7 +275,6 @@ class TestLocationOverlay:
                 const btn = document.getElementById('continue-btn');
                 if (btn) btn.click();
             """)
-            time.sleep(2)
             dismissed = True
             logging.info("Clicked Continue Anyway button")
         except Exception as e:
@@ -347,28 +284,22 @@ class TestLocationOverlay:
         if not dismissed:
             try:
                 allow_button = driver.find_element(
-                    AppiumBy.XPATH,
+                    By.XPATH,
                     "//XCUIElementTypeButton[@name='Allow Once'] | //XCUIElementTypeButton[@name='Allow While Using App']"
                 )
                 allow_button.click()
-                time.sleep(3)
                 dismissed = True
                 logging.info("Granted iOS location permission")
             except Exception as e:
                 logging.info(f"No iOS permission dialog: {e}")
 
-        # Wait for overlay to be dismissed and page to load
-        time.sleep(3)
+        # Wait for overlay to be dismissed
+        overlay_gone = wait_for_overlay_gone(driver).matched
 
         # Step 4: Verify site content is visible
         logging.info("Step 4: Verifying site loaded...")
         page_source_after = driver.page_source
 
-        # Check overlay is gone
-        overlay_gone = "location-permission-overlay" not in page_source_after.lower() or \
-                       'display: none' in page_source_after.lower() or \
-                       'display:none' in page_source_after.lower()
-
         # Check Amazon content is visible
         amazon_loaded = "amazon" in page_source_after.lower()
 
@@ -377,44 +308,28 @@ class TestLocationOverlay:
         # Step 5: Navigate to another page (THE KEY TEST)
         logging.info("Step 5: Navigating to Amazon search page...")
         driver.get("https://www.amazon.com/s?k=books")
-        time.sleep(5)
-
-        page_source_second = driver.page_source
 
         # THE CRITICAL CHECK: Overlay should NOT appear again
-        has_overlay_again = ("location required" in page_source_second.lower() and
-                            "waiting for permission" in page_source_second.lower())
-
-        if has_overlay_again:
-            # Check if it's hidden (sessionStorage fix working)
-            overlay_visible = driver.execute_script("""
-                const overlay = document.getElementById('location-permission-overlay');
-                if (!overlay) return false;
-                const style = window.getComputedStyle(overlay);
-                return style.display !== 'none';
-            """)
-            if overlay_visible:
-                pytest.fail(
-                    "BUG: Location overlay appeared AGAIN on second page navigation! "
-                    "The sessionStorage fix is not working."
-                )
-            else:
-                logging.info("Overlay HTML present but hidden (sessionStorage fix working)")
+        second = wait_for_overlay(driver, budget_ms=OVERLAY_ABSENT_BUDGET_MS)
+
+        if second.matched:
+            pytest.fail(
+                "BUG: Location overlay appeared AGAIN on second page navigation! "
+                "The sessionStorage fix is not working."
+            )
+        elif second.present:
+            logging.info("Overlay HTML present but hidden (sessionStorage fix working)")
         else:
             logging.info("No location overlay on second navigation")
 
         # Step 6: Refresh the page and check again
         logging.info("Step 6: Refreshing page to verify overlay doesn't reappear...")
         driver.refresh()
-        time.sleep(5)
 
         # Check overlay is still not visible after refresh
-        overlay_visible_after_refresh = driver.execute_script("""
-            const overlay = document.getElementById('location-permission-overlay');
-            if (!overlay) return false;
-            const style = window.getComputedStyle(overlay);
-            return style.display !== 'none';
-        """)
+        overlay_visible_after_refresh = wait_for_overlay(
+            driver, budget_ms=OVERLAY_ABSENT_BUDGET_MS
+        ).matched
 
         if overlay_visible_after_refresh:
             pytest.fail(
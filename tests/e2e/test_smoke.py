@@ -12,8 +12,8 @@ Usage:
 """
 import pytest
 import os
-from appium import webdriver
-from appium.options.ios import XCUITestOptions
+
+from ..harness import device
 
 
 class TestSmoke:
@@ -24,45 +24,21 @@ class TestSmoke:
         """Set up iOS driver with minimal config."""
         print("\n🔌 [SMOKE] Creating Appium driver...")
 
-        device_type = os.getenv('IOS_DEVICE_TYPE', 'real').lower()
-
-        options = XCUITestOptions()
-        options.platform_name = "iOS"
-        options.browser_name = "Safari"
-        options.automation_name = "XCUITest"
-        options.no_reset = True
-        options.set_capability("appium:autoAcceptAlerts", True)
-
-        if device_type == 'simulator':
-            options.platform_version = "26.2"
-            options.device_name = "iPhone 17 Pro"
-            options.set_capability("appium:wdaLaunchTimeout", 60000)
-        else:
-            # Real device config
-            options.platform_version = os.getenv("IOS_PLATFORM_VERSION", "18.7.3")
-            options.device_name = os.getenv("IOS_DEVICE_NAME", "Tushar's iPhone")
-            options.udid = os.getenv("IOS_UDID", "00008020-0004695621DA002E")
-            options.set_capability("appium:xcodeOrgId", os.getenv("IOS_XCODE_ORG_ID", "QG9U628JFD"))
-            options.set_capability("appium:xcodeSigningId", os.getenv("IOS_XCODE_SIGNING_ID", "Apple Development"))
-            options.set_capability("appium:updatedWDABundleId", os.getenv("IOS_WDA_BUNDLE_ID", "com.tushru2004.WebDriverAgentRunner"))
-            use_prebuilt = os.getenv("USE_PREBUILT_WDA", "true").lower() == "true"
-            options.set_capability("appium:usePrebuiltWDA", use_prebuilt)
-            # Keep WDA installed even if a session fails
-            options.set_capability("appium:skipUninstall", True)
-            options.set_capability("appium:wdaLaunchTimeout", 600000)  # 10 minutes - real devices can be slow
-            options.set_capability("appium:wdaConnectionTimeout", 240000)  # 4 minutes
-
-        print("🔌 [SMOKE] Connecting to Appium at http://127.0.0.1:4723...")
-
-        # Set longer timeout for session creation (WDA can take a while)
-        options.set_capability("appium:newCommandTimeout", 300)  # 5 min command timeout
-        options.set_capability("appium:commandTimeouts", {"default": int(os.getenv("APPIUM_CMD_TIMEOUT_MS", "60000"))})
-
-        # Configure HTTP client with longer timeout for session creation
-        driver = webdriver.Remote(
-            command_executor="http://127.0.0.1:4723",
-            options=options
+        options = device.xcuitest_options(
+            no_reset=True,
+            auto_accept_alerts=True,
+            # Set longer timeout for session creation (WDA can take a while)
+            capabilities={"newCommandTimeout": 300},  # 5 min command timeout
+            real_device_capabilities={
+                "xcodeOrgId": os.getenv("IOS_XCODE_ORG_ID", "QG9U628JFD"),
+                "xcodeSigningId": os.getenv("IOS_XCODE_SIGNING_ID", "Apple Development"),
+                # Keep WDA installed even if a session fails
+                "skipUninstall": True,
+            },
         )
+
+        print(f"🔌 [SMOKE] Connecting to Appium at {device.appium_url()}...")
+        driver = device.create_driver(options)
         print("✅ [SMOKE] Appium connection successful!")
 
         yield driver
@@ -0,0 +1,171 @@
+"""Persisted video -> channel cache for the related-video tests.
+
+Which channel a related video belongs to decides whether the proxy should
+block it, but that is only known after clicking it and waiting for the
+page. The cache remembers the channels earlier runs confirmed on the watch
+page, so a test can harvest every related-video link in one script call and
+pick a target that is known to be outside the whitelist up front. A block
+doesn't say which channel a video is on, and the related list's channel
+hints are only hints, so neither is stored: such videos stay unknown.
+
+Entries are keyed by video ID:
+
+    {"lwgJhmsQz0U": {"channel_id": "UCzQ...", "channel": "...", "seen": 1760000000.0}}
+
+Whitelist membership is judged when picking, against the whitelist the test
+runs with, so entries stay valid when the seeded channels change.
+"""
+import json
+import logging
+import os
+import time
+
+from ..harness.cache import cache_path
+
+# Entries older than this are ignored and re-learned
+CACHE_MAX_AGE_DAYS = int(os.getenv("E2E_VIDEO_CHANNEL_MAX_AGE_DAYS", "90"))
+
+# Returns every /watch?v= link on the page with the channel hints found in
+# its list item (mobile and desktop renderers), de-duplicated by video ID
+HARVEST_SCRIPT = """
+var exclude = arguments[0];
+var links = document.querySelectorAll('a[href*="/watch?v="]');
+var seen = {};
+var out = [];
+for (var i = 0; i < links.length; i++) {
+    var href = links[i].href || '';
+    var match = href.match(/[?&]v=([^&#]+)/);
+    if (!match || match[1] === exclude || seen[match[1]]) continue;
+    seen[match[1]] = true;
+    var item = links[i].closest(
+        'ytm-video-with-context-renderer, ytm-compact-video-renderer, ' +
+        'ytd-compact-video-renderer, ytm-rich-item-renderer') || links[i].parentElement;
+    var channelId = null, handle = null, name = null;
+    if (item) {
+        var channelLink = item.querySelector('a[href*="/channel/"], a[href*="/@"]');
+        if (channelLink) {
+            var c = (channelLink.getAttribute('href') || '').match(/\\/channel\\/([\\w-]+)/);
+            var h = (channelLink.getAttribute('href') || '').match(/\\/(@[\\w.-]+)/);
+            channelId = c ? c[1] : null;
+            handle = h ? h[1] : null;
+        }
+        var byline = item.querySelector('[class*="byline"], #channel-name, ytd-channel-name');
+        if (byline) name = (byline.textContent || '').trim().split('\\n')[0].trim() || null;
+    }
+    out.push({video_id: match[1], href: href, channel_id: channelId, handle: handle, channel: name});
+}
+return out;
+"""
+
+# Clicks the first link to the given video ID
+CLICK_SCRIPT = """
+var links = document.querySelectorAll('a[href*="/watch?v="]');
+for (var i = 0; i < links.length; i++) {
+    var match = (links[i].href || '').match(/[?&]v=([^&#]+)/);
+    if (match && match[1] === arguments[0]) { links[i].click(); return true; }
+}
+return false;
+"""
+
+# Channel of the video on the current watch page, if the page rendered
+WATCH_CHANNEL_SCRIPT = """
+var details = (window.ytInitialPlayerResponse || {}).videoDetails;
+if (!details) return null;
+return {video_id: details.videoId, channel_id: details.channelId, channel: details.author};
+"""
+
+
+def whitelist_keys(channels) -> set:
+    """Lower-cased IDs, names and @handles of (channel_id, name, url) tuples."""
+    keys = set()
+    for channel_id, name, url in channels:
+        keys.add(channel_id.lower())
+        keys.add(name.lower())
+        if "/@" in url:
+            keys.add("@" + url.rsplit("/@", 1)[1].strip("/").lower())
+    return keys
+
+
+def _identity(entry: dict) -> set:
+    return {
+        entry[key].lower() for key in ("channel_id", "handle", "channel") if entry.get(key)
+    }
+
+
+class VideoChannelCache:
+    """Load, consult and update the persisted video -> channel map."""
+
+    def __init__(self, path: str = None):
+        self.path = path or cache_path("video_channels.json")
+        self._entries = None
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        cutoff = time.time() - CACHE_MAX_AGE_DAYS * 86400
+        return {vid: e for vid, e in entries.items() if e.get("seen", 0) >= cutoff}
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+
+    def record(self, video_id: str, **fields):
+        """Merge what was learned about a video; None values are ignored."""
+        entry = self.entries.setdefault(video_id, {})
+        entry.update({k: v for k, v in fields.items() if v is not None})
+        entry["seen"] = time.time()
+
+    def harvest(self, driver, exclude: str = None) -> list:
+        """All related-video candidates on the page, in one script call.
+
+        Each carries the channel hints found in its list item; they are not
+        stored.
+        """
+        return driver.execute_script(HARVEST_SCRIPT, exclude) or []
+
+    def is_whitelisted(self, video_id: str, whitelist: set):
+        """True/False for a confirmed channel, None when it is unknown."""
+        identity = _identity(self.entries.get(video_id) or {})
+        if not identity:
+            return None
+        return bool(identity & whitelist)
+
+    def pick_target(self, candidates: list, whitelist: set):
+        """Best candidate to exercise a non-whitelisted click.
+
+        Known non-whitelisted videos first, then unknown ones whose channel
+        hints don't point at the whitelist; videos known to be on a
+        whitelisted channel are never picked.
+        """
+        unknown = None
+        for candidate in candidates:
+            known = self.is_whitelisted(candidate["video_id"], whitelist)
+            if known is False:
+                return candidate
+            if known is None and unknown is None and not _identity(candidate) & whitelist:
+                unknown = candidate
+        return unknown
+
+    def learn_from_page(self, driver, video_id: str):
+        """Record the channel the watch page confirms for ``video_id``.
+
+        Only call it on a page that loaded: a block page has no channel to
+        read.
+        """
+        try:
+            details = driver.execute_script(WATCH_CHANNEL_SCRIPT)
+        except Exception as e:
+            logging.debug(f"Could not read channel from watch page: {e}")
+            return
+        if details and details.get("video_id") == video_id and details.get("channel_id"):
+            self.record(video_id, channel_id=details["channel_id"], channel=details.get("channel"))
+            self.save()
@@ -4,50 +4,145 @@ These tests run against the PRODUCTION database - no switching, no seeding.
 Used for quick VPN verification after startup.
 """
 import pytest
-import subprocess
+import shutil
 import os
 import time
-import uuid
 
-from appium import webdriver
-from appium.options.ios import XCUITestOptions
+from ..harness import kube, monitor, policy
+from ..harness.device import appium_url, create_driver, xcuitest_options
+from ..harness.http_tier import HttpTierClient, needs_device, resolve_proxy
+from ..harness.kube import deployment_logs, psql
+from ..harness.latency import DecisionLatency, format_log_timestamp
+from ..harness.location import BLOCKED_LOCATIONS, get_device_location, set_device_location
+from ..harness.monitor import CYCLE_STARTED
+from ..harness.policy_matrix import MatrixCase, MatrixUnavailable, build_matrix, parse_location
+from ..harness.runinfo import RUN_ID
+from ..harness.scheduler import measure_transition
+from ..harness.steps import StepTimer
+
+
+# One row per policy entry: table | key | value
+PROD_POLICY_SQL = """
+SELECT 'allowed_hosts', domain, enabled::text FROM allowed_hosts
+UNION ALL
+SELECT 'youtube_channels', channel_id, enabled::text FROM youtube_channels
+UNION ALL
+SELECT 'blocked_locations', name, concat_ws(',', latitude, longitude, radius_meters, enabled)
+FROM blocked_locations
+UNION ALL
+SELECT 'blocked_location_whitelist', w.domain, concat_ws(',', l.name, w.enabled)
+FROM blocked_location_whitelist w JOIN blocked_locations l ON l.id = w.blocked_location_id;
+"""
+
+
+def prod_policy_snapshot() -> dict:
+    """Policy snapshot of the production tables, for --policy-impact."""
+    result = psql(PROD_POLICY_SQL, tuples=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "psql failed")
+    rows = [line.split("|", 2) for line in result.stdout.splitlines() if line.count("|") >= 2]
+    return policy.snapshot_from_rows(rows)
+
 
+def pytest_configure(config):
+    policy.register_source(os.path.dirname(__file__), "prod", _prod_policy)
 
-K8S_NAMESPACE = "hocuspocus"
 
-# Blocked locations for testing (must match database)
-BLOCKED_LOCATIONS = {
-    "social_hub_vienna": {"lat": 48.22286170, "lng": 16.39000710, "name": "The Social Hub Vienna"},
-    "john_harris": {"lat": 48.20184899, "lng": 16.36450324, "name": "John Harris Fitness"},
-    "test_school_sf": {"lat": 37.77490000, "lng": -122.41940000, "name": "Test School"},
-}
+_prod_snapshot = {}
 
-# iPhone SimpleMDM device ID
-IPHONE_DEVICE_ID = "2154382"
 
+def _prod_policy() -> dict:
+    """Production policy snapshot, read once per run (coverage matrix, baseline)."""
+    if "snapshot" not in _prod_snapshot:
+        _prod_snapshot["snapshot"] = prod_policy_snapshot()
+    return _prod_snapshot["snapshot"]
+
+
+def _matrix_param(case):
+    if case.location is None:
+        return case
+    # Known locations are scheduled together and fake_location keeps the
+    # device there between consecutive cases
+    slug = next(
+        (key for key, loc in BLOCKED_LOCATIONS.items() if loc["name"].lower() == case.location),
+        case.location,
+    )
+    return pytest.param(case, marks=pytest.mark.device_state(location=slug))
 
-def _run_kubectl_command(args: list, timeout: int = 60) -> subprocess.CompletedProcess:
-    """Run a kubectl command."""
-    # Ensure kubectl is in PATH (Homebrew on macOS)
-    env = os.environ.copy()
-    env["PATH"] = "/opt/homebrew/bin:" + env.get("PATH", "")
-    cmd = ["kubectl", "-n", K8S_NAMESPACE] + args
-    return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)
+
+def pytest_generate_tests(metafunc):
+    """Parametrize the policy matrix from the production policy tables.
+
+    ``matrix_case`` gets the HTTP-tier cases and ``device_matrix_case`` the
+    device-tier ones (channels, locations). ``--co`` doesn't read the
+    tables (collection stays cluster-free) and lists each as one unexpanded
+    case. Without E2E_HTTP_PROXY the HTTP cases have nowhere to run, and
+    with --tier=http the device cases are deselected anyway, so the tables
+    aren't read for them either. When the tables can't be read the matrix
+    is one case that fails with the error, so it can't silently drop out of
+    a run.
+    """
+    for argname, tier in (("matrix_case", "http"), ("device_matrix_case", "device")):
+        if argname in metafunc.fixturenames:
+            break
+    else:
+        return
+    if metafunc.config.option.collectonly:
+        metafunc.parametrize(argname, [MatrixUnavailable("not expanded under --co")], ids=["unexpanded"])
+        return
+    if tier == "http" and not os.getenv("E2E_HTTP_PROXY", "").strip():
+        reason = "policy matrix needs a forward proxy: set E2E_HTTP_PROXY=http://host:port"
+        metafunc.parametrize(
+            argname,
+            [pytest.param(MatrixUnavailable(reason), marks=pytest.mark.skip(reason=reason))],
+            ids=["no-proxy"],
+        )
+        return
+    if tier == "device" and metafunc.config.getoption("tier") == "http":
+        metafunc.parametrize(argname, [MatrixUnavailable("device tier not selected")], ids=["unexpanded"])
+        return
+    try:
+        cases = build_matrix(_prod_policy(), seed=os.getenv("E2E_MATRIX_SEED") or RUN_ID)
+    except Exception as e:
+        cases = [MatrixUnavailable(f"could not read the policy tables: {e}")]
+        metafunc.parametrize(argname, cases, ids=["policy-unavailable"])
+        return
+    cases = [case for case in cases if case.tier == tier]
+    metafunc.parametrize(argname, [_matrix_param(case) for case in cases], ids=[case.id for case in cases])
+
+
+@pytest.fixture(scope="session")
+def policy_matrix_results(request):
+    """Run every selected matrix case through the proxy concurrently; {case id: result}."""
+    cases = [
+        item.callspec.params["matrix_case"]
+        for item in request.session.items
+        if isinstance(getattr(getattr(item, "callspec", None), "params", {}).get("matrix_case"), MatrixCase)
+    ]
+    client = HttpTierClient(resolve_proxy())
+    try:
+        started = time.time()
+        results = client.run_all({case.id: (case.url, case.expect) for case in cases})
+        print(f"🌐 [MATRIX] {len(cases)} case(s) in {time.time() - started:.1f}s")
+    finally:
+        client.close()
+    return results
 
 
 @pytest.fixture(scope="session", autouse=True)
-def appium_preflight_check():
-    """Verify Appium server is running."""
+def appium_preflight_check(request):
+    """Start or verify the Appium server (unless no selected test uses the device)."""
+    if not needs_device(request.session):
+        print("\n⏭️  [PROD] No device tests selected - skipping Appium preflight")
+        yield
+        return
+
     print("\n" + "="*60)
     print("🚀 [PROD] Running production verification preflight...")
     print("="*60)
 
-    try:
-        import urllib.request
-        urllib.request.urlopen('http://127.0.0.1:4723/status', timeout=5)
-        print("✅ Appium server is running")
-    except Exception as e:
-        pytest.exit(f"Appium server not running! Start with: appium\nError: {e}")
+    request.getfixturevalue("appium_server")
+    print(f"✅ Appium server is running at {appium_url()}")
 
     yield
 
@@ -57,7 +152,7 @@ def appium_preflight_check():
 @pytest.fixture(scope="session")
 def e2e_run_id() -> str:
     """Unique ID to correlate this test run in logs."""
-    return os.getenv("E2E_RUN_ID") or uuid.uuid4().hex[:12]
+    return RUN_ID
 
 
 @pytest.fixture(scope="session")
@@ -66,33 +161,70 @@ def e2e_start_time() -> float:
     return time.time()
 
 
-def _get_current_device_location(device_id: str = IPHONE_DEVICE_ID) -> dict:
-    """Get current device location from database."""
-    result = _run_kubectl_command([
-        "exec", "postgres-0", "--",
-        "psql", "-U", "mitmproxy", "-d", "mitmproxy", "-t", "-A", "-c",
-        f"SELECT latitude, longitude FROM device_locations WHERE device_id = '{device_id}';"
-    ])
-    if result.returncode == 0 and result.stdout.strip():
-        parts = result.stdout.strip().split("|")
-        if len(parts) == 2:
-            return {"lat": float(parts[0]), "lng": float(parts[1])}
-    return None
+@pytest.fixture
+def decision_latency(request) -> DecisionLatency:
+    """Measure navigation start -> proxy verdict for the current test.
+
+    Usage:
+        decision_latency.navigate(ios_driver, url)
+        logs = mitmproxy_logs(tail=100, timestamps=True)
+        decision_latency.record("blocked_domain", logs, needle="reddit.com")
+    """
+    return DecisionLatency(request.node.nodeid)
+
+
+@pytest.fixture
+def steps(request) -> StepTimer:
+    """Time named steps of a test: ``with steps("navigate"): ...``."""
+    return StepTimer(request.node)
+
 
+# Fake location left in place for the next test when it needs the same one.
+# The scheduler puts such tests next to each other, so the restore + set
+# round-trip in between is skipped.
+_carried_location = {}
 
-def _set_device_location(lat: float, lng: float, device_id: str = IPHONE_DEVICE_ID) -> bool:
-    """Inject fake location into database for testing."""
-    result = _run_kubectl_command([
-        "exec", "postgres-0", "--",
-        "psql", "-U", "mitmproxy", "-d", "mitmproxy", "-c",
-        f"UPDATE device_locations SET latitude = {lat}, longitude = {lng}, "
-        f"fetched_at = NOW() WHERE device_id = '{device_id}';"
-    ])
-    return result.returncode == 0
+
+def _next_test_nodeid(request):
+    items = request.session.items
+    index = items.index(request.node)
+    return items[index + 1].nodeid
+
+
+def _next_test_location(request):
+    """Fake location the next scheduled test asks for, if it uses fake_location."""
+    items = request.session.items
+    try:
+        index = items.index(request.node)
+    except ValueError:
+        return None
+    if index + 1 >= len(items):
+        return None
+    next_item = items[index + 1]
+    marker = next_item.get_closest_marker("device_state")
+    if marker is None or "fake_location" not in next_item.fixturenames:
+        return None
+    return marker.kwargs.get("location")
+
+
+def pytest_runtest_logfinish(nodeid, location):
+    """The test a location was kept for is done without taking it over
+    (skipped, failed setup, never asked): move the device back now."""
+    if _carried_location.get("next_test") == nodeid:
+        _restore_carried_location()
+
+
+def _restore_carried_location():
+    """Restore a carried fake location (also the end-of-run safety net)."""
+    original = _carried_location.pop("original", None)
+    _carried_location.clear()
+    if original:
+        print(f"📍 [TEST] Restoring original location: lat={original['lat']}, lng={original['lng']}")
+        set_device_location(original["lat"], original["lng"])
 
 
 @pytest.fixture
-def fake_location():
+def fake_location(request):
     """Fixture to temporarily set device to a fake location.
     
     Usage:
@@ -103,8 +235,16 @@ def fake_location():
     
     Available locations: social_hub_vienna, john_harris, test_school_sf
     Or pass custom coords: fake_location(lat=48.123, lng=16.456)
+
+    If the next test is marked device_state(location=...) with the same
+    location, the device stays there instead of bouncing back and forth;
+    if that test then doesn't take the location over, it is restored as
+    soon as the test finishes.
     """
-    original_location = _get_current_device_location()
+    carried = dict(_carried_location)
+    _carried_location.clear()
+    original_location = carried.get("original") or get_device_location()
+    current = {"name": carried.get("name")}
     locations_set = []
     
     def _set_location(location_name: str = None, lat: float = None, lng: float = None):
@@ -112,77 +252,91 @@ def fake_location():
             if location_name not in BLOCKED_LOCATIONS:
                 raise ValueError(f"Unknown location: {location_name}. Available: {list(BLOCKED_LOCATIONS.keys())}")
             loc = BLOCKED_LOCATIONS[location_name]
+            if current["name"] == location_name:
+                print(f"📍 [TEST] Already at fake location: {loc['name']}")
+                return True
             lat, lng = loc["lat"], loc["lng"]
             print(f"📍 [TEST] Setting fake location: {loc['name']} (lat={lat}, lng={lng})")
         else:
             print(f"📍 [TEST] Setting fake location: lat={lat}, lng={lng}")
         
-        success = _set_device_location(lat, lng)
+        with measure_transition("location_move"):
+            success = set_device_location(lat, lng)
         if success:
+            current["name"] = location_name
             locations_set.append(True)
             time.sleep(1)  # Give proxy time to pick up new location
         return success
     
     yield _set_location
+
+    moved = bool(locations_set or carried)
+    if moved and current["name"] and _next_test_location(request) == current["name"]:
+        print(f"📍 [TEST] Keeping fake location {current['name']} for the next test")
+        _carried_location.update(
+            original=original_location, name=current["name"], next_test=_next_test_nodeid(request)
+        )
+        request.config.add_cleanup(_restore_carried_location)
+        return
     
     # Restore original location after test
-    if original_location and locations_set:
+    if original_location and moved:
         print(f"📍 [TEST] Restoring original location: lat={original_location['lat']}, lng={original_location['lng']}")
-        _set_device_location(original_location["lat"], original_location["lng"])
+        with measure_transition("location_move"):
+            set_device_location(original_location["lat"], original_location["lng"])
+
+
+@pytest.fixture
+def matrix_location(fake_location):
+    """Move the device to a blocked location of the policy matrix, by table name.
+
+    Locations also listed in BLOCKED_LOCATIONS go through their name (so the
+    device can stay there for the next case); others by their coordinates.
+    """
+
+    def _move(name: str) -> bool:
+        for key, loc in BLOCKED_LOCATIONS.items():
+            if loc["name"].lower() == name:
+                return fake_location(key)
+        lat, lng = parse_location(_prod_policy()["blocked_locations"][name][0])
+        return fake_location(lat=lat, lng=lng)
+
+    return _move
 
 
 @pytest.fixture(scope="session")
-def ios_driver(e2e_run_id: str):
-    """Create iOS Appium driver for production verification."""
+def ios_driver(request, e2e_run_id: str):
+    """Create iOS Appium driver for production verification.
+
+    In --monitor mode the session is kept alive, and replaced if it dies,
+    between cycles.
+    """
     print("\n🔌 [PROD] Creating Appium driver...")
 
-    options = XCUITestOptions()
-    options.platform_name = "iOS"
-    options.browser_name = "Safari"
-    options.automation_name = "XCUITest"
-    options.no_reset = False  # Allow reset to clear Safari data
-    options.set_capability("appium:autoAcceptAlerts", True)
-
-    # Real device config (allow overrides for running from another Mac)
-    options.platform_version = os.getenv("IOS_PLATFORM_VERSION", "18.7.3")
-    options.device_name = os.getenv("IOS_DEVICE_NAME", "Tushar's iPhone")
-    options.udid = os.getenv("IOS_UDID", "00008020-0004695621DA002E")
-    options.set_capability("appium:xcodeOrgId", os.getenv("IOS_XCODE_ORG_ID", "2TF5QH3WTY"))
+    real_device = {
+        "xcodeOrgId": os.getenv("IOS_XCODE_ORG_ID", "2TF5QH3WTY"),
+        # Disabled to avoid rebuild
+        "allowProvisioningUpdates": os.getenv("IOS_ALLOW_PROVISIONING_UPDATES", "false").lower() == "true",
+        "allowProvisioningDeviceRegistration": os.getenv("IOS_ALLOW_DEVICE_REGISTRATION", "true").lower() == "true",
+        # Keep WDA installed on the device so the iPhone can show the trust prompt
+        "skipUninstall": True,
+        "showXcodeLog": True,
+        "newCommandTimeout": 300,  # 5 minutes
+    }
     xcode_signing_id = os.getenv("IOS_XCODE_SIGNING_ID", "").strip()
     if xcode_signing_id:
-        options.set_capability("appium:xcodeSigningId", xcode_signing_id)
-    derived_data_path = os.getenv("IOS_DERIVED_DATA_PATH", "/Users/tushru2004/Library/Developer/Xcode/DerivedData/WebDriverAgent-cxhqcjzswqsqtaasegmlirothnxg")
-    if derived_data_path:
-        options.set_capability("appium:derivedDataPath", derived_data_path)
-    options.set_capability("appium:updatedWDABundleId", os.getenv("IOS_WDA_BUNDLE_ID", "com.tushru2004.WebDriverAgentRunner"))
-    use_prebuilt = os.getenv("USE_PREBUILT_WDA", "false").lower() == "true"  # Disable to use installed WDA
-    options.set_capability("appium:usePrebuiltWDA", use_prebuilt)
-    options.set_capability(
-        "appium:allowProvisioningUpdates",
-        os.getenv("IOS_ALLOW_PROVISIONING_UPDATES", "false").lower() == "true",  # Disabled to avoid rebuild
-    )
-    # Keep WDA installed on the device so the iPhone can show the trust prompt
-    options.set_capability("appium:skipUninstall", True)
-    options.set_capability(
-        "appium:allowProvisioningDeviceRegistration",
-        os.getenv("IOS_ALLOW_DEVICE_REGISTRATION", "true").lower() == "true",
-    )
-    derived_data_path = os.getenv("IOS_DERIVED_DATA_PATH", "").strip()
-    if derived_data_path:
-        options.set_capability("appium:derivedDataPath", derived_data_path)
-    # Keep WDA installed on the device so the iPhone can show the trust prompt
-    options.set_capability("appium:skipUninstall", True)
-    options.set_capability("appium:showXcodeLog", True)
-    options.set_capability("appium:wdaLaunchTimeout", 600000)  # 10 minutes
-    options.set_capability("appium:wdaConnectionTimeout", 240000)  # 4 minutes
-    options.set_capability("appium:newCommandTimeout", 300)  # 5 minutes
-    options.set_capability("appium:commandTimeouts", {"default": int(os.getenv("APPIUM_CMD_TIMEOUT_MS", "60000"))})
-
-    driver = webdriver.Remote(
-        command_executor="http://127.0.0.1:4723",
-        options=options
+        real_device["xcodeSigningId"] = xcode_signing_id
+
+    options = xcuitest_options(
+        no_reset=False,  # Allow reset to clear Safari data
+        simulator=False,
+        real_device_capabilities=real_device,
     )
+    driver = create_driver(options)
     print("✅ [PROD] Connected to device")
+    capabilities = options.to_capabilities()
+    capabilities.pop("appium:webDriverAgentUrl", None)
+    monitor.keep_alive(request.config, driver, capabilities)
 
     # Emit a marker request so logs can be correlated even with noisy background traffic.
     # This is intentionally a benign path on a whitelisted domain.
@@ -203,14 +357,20 @@ def ios_driver(e2e_run_id: str):
 
 
 @pytest.fixture(scope="session")
-def mitmproxy_logs(e2e_start_time: float, e2e_run_id: str):
+def mitmproxy_logs(request, e2e_start_time: float, e2e_run_id: str):
     """Fixture to fetch mitmproxy logs for assertions.
 
     Primary source: kubectl logs (cluster access required).
     Fallback source: Grafana → Loki (useful on machines without kubectl access).
+
+    In monitor mode the log window starts at the current cycle, so lines
+    from earlier cycles can't satisfy an assertion.
     """
 
-    def _logs_via_kubectl(tail: int) -> str:
+    def _window_start() -> float:
+        return request.config.stash.get(CYCLE_STARTED, e2e_start_time)
+
+    def _logs_via_kubectl(tail: int, timestamps: bool = False) -> str:
         # These production verification tests run while the device and other clients
         # (e.g. macOS location sender, background Apple services) may be generating
         # lots of traffic. Small tails can miss the relevant allow/block lines,
@@ -220,17 +380,16 @@ def mitmproxy_logs(e2e_start_time: float, e2e_run_id: str):
         # Prefer a "since" window to cut noise between runs.
         since_seconds = int(os.getenv("MITMPROXY_LOG_SINCE_SECONDS", "0") or "0")
         if since_seconds <= 0:
-            since_seconds = max(60, int(time.time() - e2e_start_time) + 30)
+            since_seconds = max(60, int(time.time() - _window_start()) + 30)
 
-        result = _run_kubectl_command(
-            ["logs", "deployment/mitmproxy", f"--since={since_seconds}s", f"--tail={tail}"],
-            timeout=30,
+        result = deployment_logs(
+            "mitmproxy", since_seconds=since_seconds, tail=tail, timestamps=timestamps
         )
         if result.returncode == 0 and result.stdout.strip():
             return result.stdout
         raise RuntimeError((result.stderr or "").strip() or "kubectl logs returned empty output")
 
-    def _logs_via_grafana_loki() -> str:
+    def _logs_via_grafana_loki(timestamps: bool = False) -> str:
         """Fetch logs from Loki via Grafana proxy.
 
         Requires:
@@ -273,7 +432,7 @@ def mitmproxy_logs(e2e_start_time: float, e2e_run_id: str):
         # Query last N seconds from start time to now
         since_seconds = int(os.getenv("MITMPROXY_LOG_SINCE_SECONDS", "0") or "0")
         if since_seconds <= 0:
-            since_seconds = max(120, int(time.time() - e2e_start_time) + 30)
+            since_seconds = max(120, int(time.time() - _window_start()) + 30)
 
         end_ns = int(time.time() * 1e9)
         start_ns = end_ns - int(since_seconds * 1e9)
@@ -300,6 +459,8 @@ def mitmproxy_logs(e2e_start_time: float, e2e_run_id: str):
         lines: list[str] = []
         for stream in streams:
             for ts, line in stream.get("values", []) or []:
+                if timestamps:
+                    line = f"{format_log_timestamp(int(ts) / 1e9)} {line}"
                 lines.append(line)
 
         # Optional marker filtering (helps reduce noise)
@@ -311,15 +472,17 @@ def mitmproxy_logs(e2e_start_time: float, e2e_run_id: str):
 
         return "\n".join(lines)
 
-    def get_logs(tail: int = 2000) -> str:
-        # Prefer kubectl if available
-        if subprocess.run(["which", "kubectl"], capture_output=True, text=True).returncode == 0:
+    def get_logs(tail: int = 2000, timestamps: bool = False) -> str:
+        """Return recent proxy logs; ``timestamps`` prefixes each line with
+        its RFC3339 log time (used for decision latency)."""
+        # Prefer the cluster (API client or kubectl) if available
+        if kube.api() is not None or shutil.which("kubectl"):
             try:
-                return _logs_via_kubectl(tail=tail)
+                return _logs_via_kubectl(tail=tail, timestamps=timestamps)
             except Exception:
                 # Fall back to Grafana Loki if kubectl is missing/misconfigured
                 pass
-        return _logs_via_grafana_loki()
+        return _logs_via_grafana_loki(timestamps=timestamps)
 
     print(f"🧾 [PROD] Log correlation run_id={e2e_run_id}")
     return get_logs
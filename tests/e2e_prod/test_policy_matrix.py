@@ -0,0 +1,58 @@
+"""
+Policy coverage matrix generated from the PRODUCTION policy tables.
+
+Every allowed host (and its www. subdomain), a look-alike of each and a
+sample of non-allowed hosts is checked through the proxy - no Safari
+involved. Every allowed YouTube channel and every blocked location x
+per-location whitelist combination is checked in Safari, since the proxy
+judges those on the phone's own traffic.
+
+Usage:
+    E2E_HTTP_PROXY=http://host:port pytest tests/e2e_prod/test_policy_matrix.py -v
+    # Only device-free checks across the prod suite:
+    pytest tests/e2e_prod --tier=http
+"""
+import time
+
+import pytest
+
+from ..harness.blockpage import block_marker
+from ..harness.policy_matrix import MatrixUnavailable
+
+PAGE_LOAD_TIMEOUT = 15
+
+
+@pytest.mark.http_tier
+@pytest.mark.timeout(600)
+def test_policy_matrix(matrix_case, request):
+    """The proxy's verdict for one generated case matches the policy tables."""
+    if isinstance(matrix_case, MatrixUnavailable):
+        pytest.fail(f"Policy matrix not generated: {matrix_case}")
+    result = request.getfixturevalue("policy_matrix_results")[matrix_case.id]
+    if result.verdict == "unresolved" and matrix_case.id.startswith("lookalike:"):
+        pytest.skip(f"{matrix_case.url} doesn't resolve; the proxy never judged it ({result.detail})")
+    assert result.ok, result.describe()
+
+
+@pytest.mark.timeout(90)
+def test_policy_matrix_on_device(device_matrix_case, ios_driver, matrix_location):
+    """Safari gets the verdict the policy tables give at the case's location."""
+    case = device_matrix_case
+    if isinstance(case, MatrixUnavailable):
+        pytest.fail(f"Policy matrix not generated: {case}")
+    if case.location:
+        assert matrix_location(case.location), f"Could not move the device to {case.location}"
+
+    ios_driver.get(f"{case.url}{'&' if '?' in case.url else '?'}_cb={int(time.time())}")
+    deadline = time.monotonic() + PAGE_LOAD_TIMEOUT
+    while time.monotonic() < deadline:
+        if ios_driver.execute_script("return document.readyState") == "complete":
+            break
+        time.sleep(0.5)
+
+    marker = block_marker(ios_driver.page_source)
+    verdict = "blocked" if marker else "allowed"
+    assert verdict == case.expect, (
+        f"{case.url} at {case.location or 'real location'}: expected {case.expect}, "
+        f"got {verdict}" + (f" (marker={marker!r})" if marker else "")
+    )
@@ -13,23 +13,32 @@ import pytest
 import time
 
 
+@pytest.mark.monitor
 class TestVPNVerification:
     """Verify VPN filtering is working in production."""
 
+    @pytest.mark.policy(
+        allowed_hosts=["youtube.com"],
+        youtube_channels=["UCzQUP1qoWDoEbmsQxvdjxgQ"],
+    )
     @pytest.mark.timeout(60)
-    def test_jre_video_allowed(self, ios_driver, mitmproxy_logs):
+    @pytest.mark.http_tier(url="https://m.youtube.com/watch?v=lwgJhmsQz0U", expect="allowed")
+    def test_jre_video_allowed(self, ios_driver, mitmproxy_logs, steps, decision_latency):
         """Test that Joe Rogan Experience videos are allowed."""
         print("\n📱 [TEST] Opening JRE video (should be allowed)...")
 
         # JRE test video
         video_url = "https://m.youtube.com/watch?v=lwgJhmsQz0U"
-        ios_driver.get(video_url)
+        with steps("navigate"):
+            decision_latency.navigate(ios_driver, video_url)
 
         # Wait for page to load and requests to flow
         time.sleep(8)
 
         # Check proxy logs
-        logs = mitmproxy_logs(tail=100)
+        with steps("fetch_logs"):
+            logs = mitmproxy_logs(tail=100, timestamps=True)
+        decision_latency.record("youtube_allowed", logs, needle="lwgJhmsQz0U")
 
         # Verify JRE channel was detected and allowed
         assert "Joe Rogan" in logs or "lwgJhmsQz0U" in logs, \
@@ -41,20 +50,25 @@ class TestVPNVerification:
 
         print("✅ [TEST] JRE video ALLOWED (as expected)")
 
+    @pytest.mark.policy(allowed_hosts=["reddit.com"])
     @pytest.mark.timeout(60)
-    def test_reddit_blocked(self, ios_driver, mitmproxy_logs):
+    @pytest.mark.http_tier(url="https://reddit.com/", expect="blocked")
+    def test_reddit_blocked(self, ios_driver, mitmproxy_logs, steps, decision_latency):
         """Test that reddit.com is blocked (non-whitelisted domain)."""
         print("\n📱 [TEST] Opening reddit.com (should be blocked)...")
 
         # Add cache bust to ensure fresh request
         cache_bust = int(time.time())
-        ios_driver.get(f"https://reddit.com/?_cb={cache_bust}")
+        with steps("navigate"):
+            decision_latency.navigate(ios_driver, f"https://reddit.com/?_cb={cache_bust}")
 
         # Wait for request to be processed
         time.sleep(6)
 
         # Check proxy logs
-        logs = mitmproxy_logs(tail=50)
+        with steps("fetch_logs"):
+            logs = mitmproxy_logs(tail=50, timestamps=True)
+        decision_latency.record("blocked_domain", logs, needle="reddit")
 
         # Verify reddit was blocked
         blocked = (
@@ -68,17 +82,22 @@ class TestVPNVerification:
 
         print("✅ [TEST] reddit.com BLOCKED (as expected)")
 
+    @pytest.mark.policy(allowed_hosts=["google.com"])
     @pytest.mark.timeout(30)
-    def test_google_allowed(self, ios_driver, mitmproxy_logs):
+    @pytest.mark.http_tier(url="https://www.google.com/", expect="allowed")
+    def test_google_allowed(self, ios_driver, mitmproxy_logs, steps, decision_latency):
         """Test that google.com is allowed (whitelisted domain)."""
         print("\n📱 [TEST] Opening google.com (should be allowed)...")
 
         cache_bust = int(time.time())
-        ios_driver.get(f"https://www.google.com/?_cb={cache_bust}")
+        with steps("navigate"):
+            decision_latency.navigate(ios_driver, f"https://www.google.com/?_cb={cache_bust}")
 
         time.sleep(5)
 
-        logs = mitmproxy_logs(tail=30)
+        with steps("fetch_logs"):
+            logs = mitmproxy_logs(tail=30, timestamps=True)
+        decision_latency.record("whitelisted_domain", logs, needle="google.com")
 
         # Verify google was allowed
         assert "Allowing whitelisted domain" in logs or "google.com" in logs, \
@@ -102,8 +121,14 @@ class TestLocationWhitelist:
     - Per-location whitelist: cnbc.com (must be configured in admin dashboard)
     """
 
+    @pytest.mark.policy(
+        allowed_hosts=["cnbc.com"],
+        blocked_locations=["The Social Hub Vienna"],
+        blocked_location_whitelist=["cnbc.com"],
+    )
+    @pytest.mark.device_state(location="social_hub_vienna")
     @pytest.mark.timeout(90)
-    def test_location_whitelisted_domain_allowed(self, ios_driver, mitmproxy_logs, fake_location):
+    def test_location_whitelisted_domain_allowed(self, ios_driver, mitmproxy_logs, fake_location, decision_latency):
         """Test that domain in per-location whitelist is allowed at blocked location.
 
         This test injects a fake location to simulate being at Social Hub Vienna,
@@ -117,10 +142,11 @@ class TestLocationWhitelist:
 
         # Visit cnbc.com which should be in the per-location whitelist
         cache_bust = int(time.time())
-        ios_driver.get(f"https://www.cnbc.com/?_cb={cache_bust}")
+        decision_latency.navigate(ios_driver, f"https://www.cnbc.com/?_cb={cache_bust}")
         time.sleep(8)
 
-        logs = mitmproxy_logs(tail=100)
+        logs = mitmproxy_logs(tail=100, timestamps=True)
+        decision_latency.record("location_allowed", logs, needle="cnbc")
 
         # Check if we're being treated as at a blocked location
         at_blocked_location = (
@@ -144,8 +170,14 @@ class TestLocationWhitelist:
 
         print("✅ [TEST] cnbc.com ALLOWED via per-location whitelist (as expected)")
 
+    @pytest.mark.policy(
+        allowed_hosts=["reddit.com"],
+        blocked_locations=["The Social Hub Vienna"],
+        blocked_location_whitelist=["reddit.com"],
+    )
+    @pytest.mark.device_state(location="social_hub_vienna")
     @pytest.mark.timeout(60)
-    def test_non_whitelisted_domain_blocked_at_location(self, ios_driver, mitmproxy_logs, fake_location):
+    def test_non_whitelisted_domain_blocked_at_location(self, ios_driver, mitmproxy_logs, fake_location, decision_latency):
         """Test that non-whitelisted domains are blocked at blocked location."""
         print("\n📱 [TEST] Testing domain blocking at fake location...")
 
@@ -154,10 +186,11 @@ class TestLocationWhitelist:
         time.sleep(2)
 
         cache_bust = int(time.time())
-        ios_driver.get(f"https://reddit.com/?_cb={cache_bust}")
+        decision_latency.navigate(ios_driver, f"https://reddit.com/?_cb={cache_bust}")
         time.sleep(8)
 
-        logs = mitmproxy_logs(tail=100)
+        logs = mitmproxy_logs(tail=100, timestamps=True)
+        decision_latency.record("location_blocked", logs, needle="reddit")
 
         # Check if blocked (either at location or via global whitelist)
         blocked = "BLOCKED" in logs or "BLOCKING" in logs
@@ -200,20 +233,26 @@ class TestLocationWhitelistManual:
         print("✅ [TEST] Confirmed at blocked location via SimpleMDM")
 
 
+@pytest.mark.monitor
 class TestVPNQuickCheck:
     """Quick smoke test for VPN - just verifies blocking works."""
 
+    @pytest.mark.policy(allowed_hosts=["reddit.com"])
     @pytest.mark.timeout(30)
-    def test_domain_blocking_works(self, ios_driver, mitmproxy_logs):
+    @pytest.mark.http_tier(url="https://reddit.com/", expect="blocked")
+    def test_domain_blocking_works(self, ios_driver, mitmproxy_logs, steps, decision_latency):
         """Quick test that domain blocking is working."""
         print("\n📱 [QUICK] Testing domain blocking...")
 
         cache_bust = int(time.time())
-        ios_driver.get(f"https://reddit.com/?_cb={cache_bust}")
+        with steps("navigate"):
+            decision_latency.navigate(ios_driver, f"https://reddit.com/?_cb={cache_bust}")
 
         time.sleep(5)
 
-        logs = mitmproxy_logs(tail=30)
+        with steps("fetch_logs"):
+            logs = mitmproxy_logs(tail=30, timestamps=True)
+        decision_latency.record("blocked_domain", logs, needle="reddit")
 
         assert "BLOCKED" in logs or "BLOCKING" in logs, \
             "No blocking detected in logs - VPN filtering may not be working!"
@@ -0,0 +1 @@
+"""Shared helpers for the hocuspocus E2E harness."""
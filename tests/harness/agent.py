@@ -0,0 +1,423 @@
+"""Resident test agent for the Mac the iPhone is plugged into.
+
+Running from another machine used to mean an ssh one-liner per attempt:
+restart Appium, source the venv, start a cold interpreter, launch WDA. The
+agent keeps all of that resident:
+
+    # on the device host (inside the venv)
+    python -m tests.harness.agent serve [--port 7878]
+
+    # from anywhere that reaches it (ssh -L 7878:127.0.0.1:7878 air, or Tailscale)
+    python -m tests.harness.agent run --agent http://127.0.0.1:7878 -- tests/e2e_prod/test_verify_vpn.py -k reddit
+
+pytest arguments are resolved from the directory the agent was started in.
+
+Each ``POST /run`` runs ``pytest.main`` in the agent process (on its main
+thread, so signal-based timeouts keep working) and streams NDJSON events
+back as they happen: one ``report`` per test phase, ``artifact`` for files
+written during a test (screenshots, HAR archives), then ``done`` with the
+exit code. Artifacts (files in subdirectories of the harness cache, failure
+screenshots) are fetched with ``GET /artifacts/<path>``.
+
+Appium sessions survive between runs: while the agent runs, device fixtures
+get their driver from a pool and ``quit()`` hands it back instead of ending
+the session, so only the first run pays for the WDA launch. The agent owns
+the Appium server (appium_server.py) for the same reason. Test modules
+are re-imported for every run so edits are picked up.
+
+Set E2E_AGENT_TOKEN on both ends to require a bearer token.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AGENT_HOST = os.getenv("E2E_AGENT_HOST", "127.0.0.1")
+AGENT_PORT = int(os.getenv("E2E_AGENT_PORT", "7878"))
+AGENT_TOKEN = os.getenv("E2E_AGENT_TOKEN", "")
+
+TESTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Capabilities that only steer how a session is launched, not the session
+# itself; a pooled driver is reused regardless of them
+LAUNCH_ONLY_CAPS = ("appium:commandTimeouts", "appium:webDriverAgentUrl", "appium:usePrebuiltWDA",
+                    "appium:useXctestrunFile", "appium:bootstrapPath", "appium:derivedDataPath",
+                    "appium:wdaLaunchTimeout", "appium:wdaConnectionTimeout")
+
+# Kept across runs: this module holds the driver pool
+_RESIDENT = ("tests.harness.agent",)
+
+_pool = None
+_supervisor = None
+
+
+def driver_pool():
+    """The agent's driver pool, or None outside the agent."""
+    return _pool
+
+
+def pool_key(options) -> str:
+    caps = {k: v for k, v in options.to_capabilities().items() if k not in LAUNCH_ONLY_CAPS}
+    return json.dumps(caps, sort_keys=True, default=str)
+
+
+def _strip(driver):
+    """Detach the run's instrumentation from a pooled driver.
+
+    Middleware and the ``_hp_*`` markers belong to the harness modules of
+    the run that attached them; the next run imports fresh ones and must
+    attach its own instead of finding the old ones in place.
+    """
+    from .driver_hooks import clear_command_middleware
+
+    watchdog = getattr(driver, "_hp_watchdog", None)
+    if watchdog is not None:
+        watchdog.stop()
+    clear_command_middleware(driver)
+    for name in [name for name in vars(driver) if name.startswith("_hp_") and name != "_hp_quit"]:
+        delattr(driver, name)
+
+
+class DriverPool:
+    """Appium sessions kept alive between test runs, one per capability set."""
+
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, driver) -> bool:
+        try:
+            driver.execute("getCurrentUrl")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, key: str, start, prepare=None):
+        """A live pooled driver for ``key``, or a new one from ``start()``.
+
+        ``prepare(driver)`` re-instruments a reused driver, which comes back
+        stripped (see release).
+        """
+        with self.lock:
+            driver = self.idle.pop(key, None)
+        if driver is not None:
+            if self._alive(driver):
+                logging.info("♻️  Reusing pooled Appium session")
+                return prepare(driver) if prepare is not None else driver
+            self._close(driver)
+        driver = start()
+        driver._hp_quit = driver.quit
+        driver.quit = lambda: self.release(key, driver)
+        return driver
+
+    def release(self, key: str, driver):
+        _strip(driver)
+        with self.lock:
+            previous = self.idle.pop(key, None)
+            self.idle[key] = driver
+        if previous is not None and previous is not driver:
+            self._close(previous)
+
+    def _close(self, driver):
+        try:
+            driver._hp_quit()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            drivers, self.idle = list(self.idle.values()), {}
+        for driver in drivers:
+            self._close(driver)
+
+
+def appium_supervisor():
+    """The agent's resident Appium supervisor, or None."""
+    return _supervisor
+
+
+def _artifact_roots() -> list:
+    from .cache import CACHE_DIR
+
+    return [CACHE_DIR, os.path.join(TESTS_DIR, "e2e", "screenshots")]
+
+
+def _snapshot(roots) -> dict:
+    """{path: mtime} of artifact files; state files at the top of the cache
+    dir (ledger, histories) are not artifacts."""
+    cache_root = roots[0]
+    files = {}
+    for root in roots:
+        for dirpath, _, names in os.walk(root):
+            if dirpath == cache_root:
+                continue
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    files[path] = os.path.getmtime(path)
+                except OSError:
+                    pass
+    return files
+
+
+class StreamPlugin:
+    """Turns test reports and new artifact files into agent events."""
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.roots = _artifact_roots()
+        self.seen = _snapshot(self.roots)
+
+    def pytest_collection_finish(self, session):
+        self.emit({"event": "collected", "count": len(session.items)})
+
+    def pytest_runtest_logreport(self, report):
+        event = {"event": "report", "nodeid": report.nodeid, "when": report.when,
+                 "outcome": report.outcome, "duration": round(report.duration, 3)}
+        if report.failed:
+            event["longrepr"] = str(report.longrepr)[-4000:]
+        if report.when == "call":
+            event["properties"] = dict(report.user_properties)
+        self.emit(event)
+        if report.when == "teardown":
+            self._emit_artifacts(report.nodeid)
+
+    def _emit_artifacts(self, nodeid=None):
+        current = _snapshot(self.roots)
+        for path, mtime in sorted(current.items()):
+            if self.seen.get(path) != mtime:
+                for root in self.roots:
+                    if path.startswith(root + os.sep):
+                        rel = os.path.join(os.path.basename(root), os.path.relpath(path, root))
+                        self.emit({"event": "artifact", "nodeid": nodeid, "path": rel,
+                                   "size": os.path.getsize(path)})
+        self.seen = current
+
+    def pytest_sessionfinish(self, session):
+        self._emit_artifacts()
+
+
+class Job:
+    def __init__(self, args: list, env: dict):
+        self.args = args
+        self.env = env
+        self.events = queue.Queue()
+
+
+def _purge_test_modules():
+    """Drop the suite's modules so the next run imports the current files."""
+    for name in list(sys.modules):
+        if (name == "tests" or name.startswith("tests.")) and name not in _RESIDENT:
+            del sys.modules[name]
+
+
+def run_job(job: Job) -> int:
+    """Run one pytest invocation in this process (main thread)."""
+    import pytest
+
+    saved = {name: os.environ.get(name) for name in job.env}
+    os.environ.update({k: str(v) for k, v in job.env.items()})
+    # A run of its own for the ledger, HAR export and logs
+    os.environ["E2E_RUN_ID"] = uuid.uuid4().hex[:12]
+    _purge_test_modules()
+    try:
+        if _supervisor is not None and not _supervisor.wait_healthy():
+            # Device-free runs (--tier=http, --co) still work
+            job.events.put({"event": "error", "message": f"Appium not answering on {_supervisor.url}"})
+        exit_code = int(pytest.main(list(job.args), plugins=[StreamPlugin(job.events.put)]))
+    except Exception as e:
+        job.events.put({"event": "error", "message": f"{type(e).__name__}: {e}"})
+        exit_code = 3
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    job.events.put({"event": "done", "exit_code": exit_code})
+    return exit_code
+
+
+class AgentServer:
+    """HTTP front end; jobs are executed by serve_forever on the main thread."""
+
+    def __init__(self, host: str = AGENT_HOST, port: int = AGENT_PORT):
+        self.jobs = queue.Queue()
+        self.busy = threading.Lock()
+        agent = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _authorized(self) -> bool:
+                if AGENT_TOKEN and self.headers.get("Authorization") != f"Bearer {AGENT_TOKEN}":
+                    self.send_error(401)
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path == "/status":
+                    body = json.dumps({"busy": agent.busy.locked(),
+                                       "pooled_sessions": len(_pool.idle) if _pool else 0}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif self.path.startswith("/artifacts/"):
+                    self._send_artifact(self.path[len("/artifacts/"):])
+                else:
+                    self.send_error(404)
+
+            def _send_artifact(self, rel: str):
+                top, _, rest = urllib.request.unquote(rel).partition("/")
+                for root in _artifact_roots():
+                    if os.path.basename(root) != top:
+                        continue
+                    path = os.path.realpath(os.path.join(root, rest))
+                    if path.startswith(os.path.realpath(root) + os.sep) and os.path.isfile(path):
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/octet-stream")
+                        self.send_header("Content-Length", str(os.path.getsize(path)))
+                        self.end_headers()
+                        with open(path, "rb") as f:
+                            self.wfile.write(f.read())
+                        return
+                self.send_error(404)
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if self.path != "/run":
+                    self.send_error(404)
+                    return
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                except ValueError:
+                    self.send_error(400, "body must be JSON")
+                    return
+                if not agent.busy.acquire(blocking=False):
+                    self.send_error(409, "a run is already in progress")
+                    return
+                job = Job(request.get("args", []), request.get("env", {}))
+                try:
+                    agent.jobs.put(job)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.end_headers()
+                    while True:
+                        event = job.events.get()
+                        try:
+                            self.wfile.write((json.dumps(event, default=str) + "\n").encode())
+                            self.wfile.flush()
+                        except OSError:
+                            # Client went away; let the run finish anyway
+                            pass
+                        if event["event"] == "done":
+                            break
+                finally:
+                    agent.busy.release()
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def serve_forever(self):
+        global _pool, _supervisor
+        _pool = DriverPool()
+        from .appium_server import MODE, AppiumSupervisor, unmanaged_running
+
+        if MODE == "managed" and not unmanaged_running():
+            try:
+                _supervisor = AppiumSupervisor().start()
+            except Exception as e:
+                logging.warning(f"⚠️  Could not start Appium: {e}")
+        threading.Thread(target=self.httpd.serve_forever, name="agent-http", daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        logging.info(f"🛰️  Test agent listening on http://{host}:{port}")
+        try:
+            while True:
+                run_job(self.jobs.get())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.shutdown()
+            _pool.close()
+            if _supervisor is not None:
+                _supervisor.stop()
+
+
+def run_remote(agent_url: str, args: list, env: dict = None, fetch_dir: str = None) -> int:
+    """Start a run on the agent, print events as they arrive, return its exit code."""
+    headers = {"Content-Type": "application/json"}
+    if AGENT_TOKEN:
+        headers["Authorization"] = f"Bearer {AGENT_TOKEN}"
+    request = urllib.request.Request(
+        f"{agent_url}/run", data=json.dumps({"args": args, "env": env or {}}).encode(),
+        headers=headers, method="POST",
+    )
+    exit_code = 3
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            event = json.loads(line)
+            kind = event["event"]
+            if kind == "report" and (event["when"] == "call" or event["outcome"] != "passed"):
+                print(f"{event['outcome'].upper():<8} {event['nodeid']} ({event['duration']:.1f}s)")
+                if event.get("longrepr"):
+                    print(event["longrepr"])
+            elif kind == "artifact":
+                print(f"  artifact {event['path']}")
+                if fetch_dir:
+                    target = os.path.join(fetch_dir, event["path"])
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    artifact = urllib.request.Request(
+                        f"{agent_url}/artifacts/{urllib.request.quote(event['path'])}", headers=headers
+                    )
+                    with urllib.request.urlopen(artifact) as data, open(target, "wb") as f:
+                        f.write(data.read())
+            elif kind == "collected":
+                print(f"collected {event['count']} items")
+            elif kind == "error":
+                print(f"agent error: {event['message']}")
+            elif kind == "done":
+                exit_code = event["exit_code"]
+    return exit_code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident E2E test agent")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="run the agent on the device host")
+    serve.add_argument("--host", default=AGENT_HOST)
+    serve.add_argument("--port", type=int, default=AGENT_PORT)
+    run = sub.add_parser("run", help="run tests on an agent; pytest args after --")
+    run.add_argument("--agent", default=f"http://127.0.0.1:{AGENT_PORT}")
+    run.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                     help="environment for the run (repeatable)")
+    run.add_argument("--fetch-artifacts", metavar="DIR", help="download artifacts into DIR")
+    run.add_argument("pytest_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve" and __name__ == "__main__":
+        # Serve from the importable module, the one device.py asks for the pool
+        from tests.harness import agent
+
+        return agent.main(argv)
+    if args.command == "serve":
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        AgentServer(args.host, args.port).serve_forever()
+        return 0
+    pytest_args = args.pytest_args[1:] if args.pytest_args[:1] == ["--"] else args.pytest_args
+    env = dict(item.split("=", 1) for item in args.env)
+    return run_remote(args.agent.rstrip("/"), pytest_args, env, args.fetch_artifacts)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
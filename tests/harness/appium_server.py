@@ -0,0 +1,212 @@
+"""Appium server owned by the test run.
+
+The ``appium_server`` session fixture starts Appium on the first free port
+from E2E_APPIUM_BASE_PORT (default 4723), watches it and restarts it when
+it dies or stops answering, so a crash costs the tests that were in flight
+instead of the whole run (and a manual ``pkill -f appium``).
+
+Ports are claimed with a lock file in the harness cache (``appium/<port>.lock``)
+held for the supervisor's lifetime, so parallel workers (pytest-xdist, the
+test agent, a second checkout) each get their own Appium port and WDA port
+(``wdaLocalPort`` = E2E_WDA_PORT + the same offset) without colliding.
+
+An Appium that is already running is used as is when APPIUM_URL is set
+(E2E_APPIUM=external forces that, with the default URL), and also when one
+answers on the base port without a supervisor's lock on it: that is an
+Appium a developer started, and a second one would drive the same phone.
+
+A WDA that already answers on an offset's WDA port doesn't make the offset
+unusable: the session attaches to it (see wda.py's attach strategy).
+"""
+import fcntl
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+import urllib.request
+
+from .cache import cache_path
+
+MODE = os.getenv("E2E_APPIUM", "external" if os.getenv("APPIUM_URL") else "managed").lower()
+
+BASE_PORT = int(os.getenv("E2E_APPIUM_BASE_PORT", "4723"))
+WDA_BASE_PORT = int(os.getenv("E2E_WDA_PORT", "8100"))
+MAX_PORTS = 20
+
+STARTUP_TIMEOUT_S = float(os.getenv("E2E_APPIUM_STARTUP_S", "60"))
+HEALTH_INTERVAL_S = 5.0
+# Consecutive failed /status checks before a live process is restarted
+HEALTH_FAILURES = 3
+
+_active = None
+
+
+def current():
+    """The supervisor of this run, or None (external Appium)."""
+    return _active
+
+
+def current_url() -> str:
+    if _active is not None:
+        return _active.url
+    return os.getenv("APPIUM_URL", f"http://127.0.0.1:{BASE_PORT}")
+
+
+def status_ok(url: str, timeout: float = 2.0) -> bool:
+    try:
+        with urllib.request.urlopen(f"{url}/status", timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+
+def unmanaged_running(port: int = BASE_PORT) -> bool:
+    """Whether an Appium no supervisor owns answers on ``port``."""
+    with open(cache_path("appium", f"{port}.lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # A supervisor of another worker holds it
+            return False
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return status_ok(f"http://127.0.0.1:{port}")
+
+
+def _port_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+        except OSError:
+            return False
+    return True
+
+
+class AppiumSupervisor:
+    """Starts, health-checks and restarts one Appium server process."""
+
+    def __init__(self, base_port: int = BASE_PORT):
+        self.base_port = base_port
+        self.port = None
+        self.wda_port = None
+        self.process = None
+        self.restarts = 0
+        self.lock_file = None
+        self.log_path = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.monitor = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def _claim_port(self):
+        for offset in range(MAX_PORTS):
+            port = self.base_port + offset
+            lock_file = open(cache_path("appium", f"{port}.lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            wda_port = WDA_BASE_PORT + offset
+            wda_usable = _port_free(wda_port) or status_ok(f"http://127.0.0.1:{wda_port}")
+            if not (_port_free(port) and wda_usable):
+                # Taken by something we don't coordinate with (a manual appium)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+                continue
+            lock_file.write(f"{os.getpid()}\n")
+            lock_file.flush()
+            self.lock_file = lock_file
+            self.port, self.wda_port = port, wda_port
+            self.log_path = cache_path("appium", f"appium-{port}.log")
+            return
+        raise RuntimeError(f"No free Appium port in {self.base_port}-{self.base_port + MAX_PORTS - 1}")
+
+    def _spawn(self):
+        env = os.environ.copy()
+        # Homebrew's node/appium aren't on PATH for ssh sessions
+        env["PATH"] = "/opt/homebrew/bin:" + env.get("PATH", "")
+        with open(self.log_path, "ab") as log:
+            self.process = subprocess.Popen(
+                ["appium", "--address", "127.0.0.1", "--port", str(self.port)],
+                stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True,
+            )
+        deadline = time.monotonic() + STARTUP_TIMEOUT_S
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Appium exited with {self.process.returncode}; see {self.log_path}")
+            if status_ok(self.url):
+                return
+            time.sleep(0.5)
+        raise RuntimeError(f"Appium did not answer on {self.url} within {STARTUP_TIMEOUT_S:.0f}s")
+
+    def start(self):
+        self._claim_port()
+        logging.info(f"🚀 Starting Appium on {self.url} (WDA port {self.wda_port}, log {self.log_path})")
+        self._spawn()
+        self.monitor = threading.Thread(target=self._watch, name="appium-supervisor", daemon=True)
+        self.monitor.start()
+        return self
+
+    def _kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def restart(self, reason: str):
+        with self.lock:
+            logging.warning(f"♻️  Restarting Appium on port {self.port}: {reason}")
+            self._kill()
+            self.restarts += 1
+            self._spawn()
+
+    def _watch(self):
+        failures = 0
+        while not self.stopped.wait(HEALTH_INTERVAL_S):
+            if self.process.poll() is not None:
+                reason = f"process exited with {self.process.returncode}"
+            elif status_ok(self.url, timeout=5):
+                failures = 0
+                continue
+            else:
+                failures += 1
+                if failures < HEALTH_FAILURES:
+                    continue
+                reason = f"/status failed {failures} times"
+            failures = 0
+            try:
+                self.restart(reason)
+            except Exception as e:
+                logging.error(f"❌ Appium restart failed: {e}")
+
+    def wait_healthy(self, timeout: float = STARTUP_TIMEOUT_S) -> bool:
+        """Block while a restart is in progress; True once Appium answers."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if status_ok(self.url):
+                    return True
+            time.sleep(0.5)
+        return False
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            self._kill()
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+
+def activate(supervisor):
+    """Make ``supervisor`` the one create_driver talks to (None: external)."""
+    global _active
+    _active = supervisor
@@ -0,0 +1,22 @@
+"""Detection of the proxy's block pages, shared by the device and HTTP tiers."""
+
+# Lower-case phrases that only appear on pages served by the proxy
+BLOCK_MARKERS = (
+    "not whitelisted",
+    "access denied",
+    "channel is not allowed",
+    "channel not whitelisted",
+)
+
+
+def block_marker(text: str):
+    """Return the first block-page marker found in ``text``, or None."""
+    lowered = (text or "").lower()
+    for marker in BLOCK_MARKERS:
+        if marker in lowered:
+            return marker
+    return None
+
+
+def is_block_page(text: str) -> bool:
+    return block_marker(text) is not None
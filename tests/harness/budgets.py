@@ -0,0 +1,243 @@
+"""Adaptive timeout budgets learned from how long things usually take.
+
+The static timeouts (``@pytest.mark.timeout(60)``, Appium's 60s command
+timeout, the mitmproxy restart wait) are sized for the worst day, so a hung
+WDA or proxy burns all of it before anything is reported. Instead, per key
+the last HISTORY_SIZE durations of successful runs are kept in
+``step_budgets.json`` (harness cache) and the budget becomes
+
+    clamp(p99 * E2E_BUDGET_MARGIN, BUDGET_FLOOR_S, static timeout)
+
+once a key has MIN_SAMPLES samples; before that the static timeout applies.
+Keys: ``test:<nodeid>`` (tightens the timeout marker), ``step:<name>``
+(StepTimer steps), ``command:<name>`` (Appium commandTimeouts, per
+command) and named waits such as ``mitmproxy_restart``.
+
+A step, test or command that blows its budget fails with StepBudgetExceeded
+(or the pytest-timeout / Appium timeout error) and its budget is recorded as
+a sample, so a real, lasting slowdown raises the budget over a few runs
+instead of failing forever. Disable with E2E_ADAPTIVE_BUDGETS=0.
+"""
+import json
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pytest
+
+from .cache import cache_path
+from .driver_hooks import add_command_middleware
+from .http_tier import DEVICE_FIXTURES
+from .stats import percentile
+from .steps import step_durations
+
+ENABLED = os.getenv("E2E_ADAPTIVE_BUDGETS", "1").lower() not in ("0", "false", "no")
+
+MARGIN = float(os.getenv("E2E_BUDGET_MARGIN", "2.0"))
+
+# Never budget less than this, whatever the history says
+BUDGET_FLOOR_S = float(os.getenv("E2E_BUDGET_FLOOR_S", "5"))
+
+MIN_SAMPLES = 5
+HISTORY_SIZE = 50
+
+# Commands that wait on purpose (async scripts have their own timeout)
+UNTIMED_COMMANDS = ("executeAsyncScript", "w3cExecuteScriptAsync", "quit")
+
+# Selenium client command -> Appium command name, as commandTimeouts keys
+# them. Commands not listed keep the static default.
+APPIUM_COMMANDS = {
+    "findElement": "findElement",
+    "findElements": "findElements",
+    "findChildElement": "findElementFromElement",
+    "findChildElements": "findElementsFromElement",
+    "clickElement": "click",
+    "getElementText": "getText",
+    "getElementAttribute": "getAttribute",
+    "isElementDisplayed": "elementDisplayed",
+    "w3cExecuteScript": "execute",
+    "get": "setUrl",
+    "getCurrentUrl": "getUrl",
+    "getTitle": "title",
+    "getPageSource": "getPageSource",
+    "screenshot": "getScreenshot",
+    "getAllCookies": "getCookies",
+    "addCookie": "setCookie",
+    "deleteAllCookies": "deleteCookies",
+}
+
+
+class StepBudgetExceeded(Exception):
+    """A step ran far past its usual duration."""
+
+
+class BudgetStore:
+    """Duration history per key, persisted as JSON."""
+
+    def __init__(self, path: str = None):
+        self.path = path or cache_path("step_budgets.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def record(self, key: str, seconds: float):
+        with self.lock:
+            samples = self.data.get(key, []) + [round(seconds, 3)]
+            self.data[key] = samples[-HISTORY_SIZE:]
+
+    def save(self):
+        with self.lock:
+            with open(self.path, "w") as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+
+    def p99(self, key: str):
+        samples = self.data.get(key, [])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return percentile(samples, 99)
+
+    def budget(self, key: str, ceiling: float) -> float:
+        """Learned budget for ``key`` in seconds, never above ``ceiling``."""
+        p99 = self.p99(key)
+        if p99 is None:
+            return ceiling
+        return min(ceiling, max(BUDGET_FLOOR_S, p99 * MARGIN))
+
+    def deadline(self, key: str, ceiling: float) -> float:
+        """time.monotonic() deadline for a polling wait."""
+        return time.monotonic() + self.budget(key, ceiling)
+
+
+@contextmanager
+def enforce(seconds: float, message: str):
+    """Raise StepBudgetExceeded in the block after ``seconds``.
+
+    Uses SIGALRM, so it only works on the main thread; elsewhere the block
+    runs unbounded. An alarm already pending (pytest-timeout's signal
+    method) is kept: when it would fire first nothing is armed, otherwise
+    it is re-armed with its remaining time afterwards.
+    """
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "setitimer"):
+        yield
+        return
+    pending, _ = signal.getitimer(signal.ITIMER_REAL)
+    if pending and pending <= seconds:
+        yield
+        return
+
+    def expired(signum, frame):
+        raise StepBudgetExceeded(message)
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    started = time.monotonic()
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        if pending:
+            remaining = pending - (time.monotonic() - started)
+            signal.setitimer(signal.ITIMER_REAL, max(remaining, 0.001))
+
+
+def command_timeouts(ceiling_ms: int) -> dict:
+    """Appium ``commandTimeouts``: the static default plus a learned budget
+    for every command with enough history of its own."""
+    timeouts = {"default": ceiling_ms}
+    if not ENABLED:
+        return timeouts
+    store = BudgetStore()
+    for command, appium_name in APPIUM_COMMANDS.items():
+        if store.p99(f"command:{command}") is not None:
+            timeouts[appium_name] = int(store.budget(f"command:{command}", ceiling_ms / 1000.0) * 1000)
+    return timeouts
+
+
+class BudgetPlugin:
+    """Applies learned budgets to tests and records what they took."""
+
+    def __init__(self, store: BudgetStore = None):
+        self.store = store or BudgetStore()
+        self.tightened = {}
+
+    def pytest_collection_modifyitems(self, config, items):
+        for item in items:
+            marker = item.get_closest_marker("timeout")
+            if marker is None or not marker.args:
+                continue
+            static = float(marker.args[0])
+            learned = self.store.budget(f"test:{item.nodeid}", static)
+            if learned < static:
+                # Prepended, so pytest-timeout sees it as the closest marker
+                item.add_marker(pytest.mark.timeout(round(learned, 1)), append=False)
+                self.tightened[item.nodeid] = (static, learned)
+
+    def step_guard(self, name: str):
+        """Context manager failing a StepTimer step that runs past its budget."""
+        p99 = self.store.p99(f"step:{name}")
+        if p99 is None:
+            return nullcontext()
+        budget = max(BUDGET_FLOOR_S, p99 * MARGIN)
+        return enforce(budget, f"step '{name}' exceeded its {budget:.1f}s budget (p99 {p99:.1f}s)")
+
+    def _record_command(self, call_next, command, params):
+        started = time.monotonic()
+        try:
+            response = call_next(command, params)
+        except Exception:
+            # A command killed by its learned timeout is recorded too (as a
+            # lower bound), so that budget can grow back
+            elapsed = time.monotonic() - started
+            p99 = self.store.p99(f"command:{command}")
+            if command not in UNTIMED_COMMANDS and p99 is not None and elapsed >= max(BUDGET_FLOOR_S, p99 * MARGIN):
+                self.store.record(f"command:{command}", elapsed)
+            raise
+        if command not in UNTIMED_COMMANDS:
+            self.store.record(f"command:{command}", time.monotonic() - started)
+        return response
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        for name in DEVICE_FIXTURES:
+            driver = getattr(item, "funcargs", {}).get(name)
+            if driver is not None and not getattr(driver, "_hp_budgets", False):
+                add_command_middleware(driver, self._record_command)
+                driver._hp_budgets = True
+        yield
+
+    def pytest_runtest_logreport(self, report):
+        if report.when != "call":
+            return
+        if report.passed:
+            self.store.record(f"test:{report.nodeid}", report.duration)
+            for name, seconds in step_durations(report).items():
+                self.store.record(f"step:{name}", seconds)
+            return
+        if not report.failed:
+            return
+        # A blown budget is only a lower bound of the real duration, but
+        # recording it lets the budget grow if this keeps happening
+        message = str(report.longrepr or "")
+        if report.nodeid in self.tightened and "Timeout" in message:
+            self.store.record(f"test:{report.nodeid}", self.tightened[report.nodeid][1])
+        for name, seconds in step_durations(report).items():
+            if "StepBudgetExceeded" in message and f"step '{name}'" in message:
+                self.store.record(f"step:{name}", seconds)
+
+    def pytest_sessionfinish(self, session):
+        if session.config.option.collectonly:
+            return
+        self.store.save()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.tightened:
+            return
+        terminalreporter.write_line(
+            f"budgets: {len(self.tightened)} test timeouts tightened from history"
+        )
@@ -0,0 +1,17 @@
+"""Local on-disk state for the E2E harness.
+
+Cookie jars, ledgers and timing history live under one directory that is
+kept out of git. Override the location with E2E_CACHE_DIR.
+"""
+import os
+
+CACHE_DIR = os.getenv("E2E_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".e2e_cache"
+)
+
+
+def cache_path(*parts: str) -> str:
+    """Return a path inside the cache dir, creating parent directories."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,169 @@
+"""Appium driver construction with the client imported on first use.
+
+Importing appium (and selenium under it) costs more than collecting the
+whole suite, so nothing at module level here or in the test modules pulls
+it in. The client is imported when a device fixture actually builds a
+driver; ``--co``, ``--tier=http`` and other device-free runs never pay for
+it.
+
+On the real device, how WDA is launched (prebuilt, xctestrun, attach or a
+full build) and its launch timeouts are picked by wda.py, so fixtures don't
+set usePrebuiltWDA/useXctestrunFile/wdaLaunchTimeout themselves.
+"""
+import os
+
+from . import agent, appium_server, budgets, roundtrips, wda, watchdog
+from .scheduler import measure_transition
+
+DEFAULT_UDID = "00008020-0004695621DA002E"
+
+SIMULATOR_PLATFORM_VERSION = "26.2"
+SIMULATOR_DEVICE_NAME = "iPhone 17 Pro"
+
+
+class By:
+    """Locator strategies, same values as AppiumBy, without importing appium."""
+
+    ID = "id"
+    XPATH = "xpath"
+    NAME = "name"
+    CLASS_NAME = "class name"
+    CSS_SELECTOR = "css selector"
+    ACCESSIBILITY_ID = "accessibility id"
+    IOS_PREDICATE = "-ios predicate string"
+    IOS_CLASS_CHAIN = "-ios class chain"
+
+
+def device_type() -> str:
+    """'simulator' or 'real' (IOS_DEVICE_TYPE, default real)."""
+    return os.getenv("IOS_DEVICE_TYPE", "real").lower()
+
+
+def device_udid() -> str:
+    return os.getenv("IOS_UDID", DEFAULT_UDID)
+
+
+def _appium_key(name: str) -> str:
+    return name if ":" in name else f"appium:{name}"
+
+
+def xcuitest_options(no_reset: bool = True, auto_accept_alerts: bool = True,
+                     simulator: bool = None, capabilities: dict = None,
+                     real_device_capabilities: dict = None):
+    """XCUITestOptions for Safari on the test iPhone (or the simulator).
+
+    ``capabilities`` apply to both targets, ``real_device_capabilities``
+    only to the real device (signing, WDA build and launch settings).
+    Capability names without a vendor prefix get ``appium:``.
+    """
+    from appium.options.ios import XCUITestOptions
+
+    if simulator is None:
+        simulator = device_type() == "simulator"
+
+    options = XCUITestOptions()
+    options.platform_name = "iOS"
+    options.browser_name = "Safari"
+    options.automation_name = "XCUITest"
+    options.no_reset = no_reset
+    options.set_capability("appium:autoAcceptAlerts", auto_accept_alerts)
+
+    if simulator:
+        options.platform_version = SIMULATOR_PLATFORM_VERSION
+        options.device_name = SIMULATOR_DEVICE_NAME
+        # UDID is auto-detected for the booted simulator
+        options.set_capability("appium:wdaLaunchTimeout", 60000)
+    else:
+        # Real device config (allow overrides for running from another Mac)
+        options.platform_version = os.getenv("IOS_PLATFORM_VERSION", "18.7.3")
+        options.device_name = os.getenv("IOS_DEVICE_NAME", "Tushar's iPhone")
+        options.udid = device_udid()
+        options.set_capability(
+            "appium:updatedWDABundleId",
+            os.getenv("IOS_WDA_BUNDLE_ID", "com.tushru2004.WebDriverAgentRunner"),
+        )
+        options.set_capability(
+            "appium:commandTimeouts",
+            budgets.command_timeouts(int(os.getenv("APPIUM_CMD_TIMEOUT_MS", "60000"))),
+        )
+        for name, value in (real_device_capabilities or {}).items():
+            options.set_capability(_appium_key(name), value)
+
+    for name, value in (capabilities or {}).items():
+        options.set_capability(_appium_key(name), value)
+    return options
+
+
+def e2e_real_device_capabilities() -> dict:
+    """WDA signing and launch settings the test-DB suite uses on the real device."""
+    return {
+        "showXcodeLog": True,
+        # WebDriverAgent code signing configuration for real device
+        # These settings survive Appium reinstalls (no need to reconfigure Xcode)
+        "xcodeOrgId": os.getenv("IOS_XCODE_ORG_ID", "QG9U628JFD"),  # Apple Team ID
+        "xcodeSigningId": os.getenv("IOS_XCODE_SIGNING_ID", "Apple Development"),
+        # Keep WDA installed so the trust prompt persists if a run fails
+        "skipUninstall": True,
+        # IMPORTANT: Do NOT set clearSystemFiles=True - it causes WDA to be uninstalled on failure,
+        # which removes the trusted developer certificate and requires manual re-trust on iPhone
+        "clearSystemFiles": False,
+    }
+
+
+def appium_url() -> str:
+    """URL of the Appium server drivers are created on (see appium_server.py)."""
+    return appium_server.current_url()
+
+
+def create_driver(options, command_executor: str = None, simulator: bool = None):
+    """Start an Appium session (timed as the scheduler's session_create).
+
+    Real devices go through the WDA launch autotuner; see wda.py. The WDA
+    hang watchdog (watchdog.py) and the round-trip profiler (roundtrips.py)
+    are attached to every driver handed out. Inside the test agent
+    (agent.py) a pooled session with the same capabilities is reused
+    instead, and ``quit()`` returns it to the pool with the run's
+    instrumentation removed.
+    """
+    from appium import webdriver
+
+    if simulator is None:
+        simulator = device_type() == "simulator"
+    if command_executor is None:
+        command_executor = appium_url()
+    server = appium_server.current()
+    wda_port = wda.WDA_LOCAL_PORT
+    if server is not None:
+        # Waits out a crash restart instead of failing against a dead port
+        server.wait_healthy()
+        wda_port = server.wda_port
+        options.set_capability("appium:wdaLocalPort", wda_port)
+
+    def start(opts):
+        return webdriver.Remote(command_executor=command_executor, options=opts)
+
+    def instrument(driver):
+        # A recycled session can't attach to the WDA the watchdog just killed
+        capabilities = options.to_capabilities()
+        capabilities.pop("appium:webDriverAgentUrl", None)
+        watchdog.attach(driver, capabilities, wda_port, command_executor)
+        roundtrips.attach(driver)
+        return driver
+
+    def launch():
+        with measure_transition("session_create"):
+            driver = start(options) if simulator else wda.launch(start, options, wda_port=wda_port)
+        return instrument(driver)
+
+    pool = agent.driver_pool()
+    if pool is not None:
+        # Pooled drivers come back without the previous run's instrumentation
+        return pool.acquire(agent.pool_key(options), launch, instrument)
+    return launch()
+
+
+def is_simulator(driver) -> bool:
+    """Simulator UDIDs are long UUIDs; real device UDIDs are shorter."""
+    caps = driver.capabilities
+    udid = caps.get("udid", "")
+    return "simulator" in caps.get("deviceName", "").lower() or len(udid) > 30
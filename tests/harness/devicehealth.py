@@ -0,0 +1,275 @@
+"""Device health sampling: was the phone the slow part?
+
+A background thread samples the handset every E2E_DEVICE_HEALTH_INTERVAL
+seconds (default 15) while device tests run. Each test's record gets a
+summary of the samples taken during its call phase - battery level and
+temperature, charging state, free storage - as the ``device_health`` user
+property, which also lands in the flakiness ledger's ``extra`` column.
+When the call ends the thread takes one more sample, and the report waits
+for it only after its duration is measured, so sampling never counts
+towards a test's time.
+Samples are appended to ``device_health.jsonl`` so a run can be replayed.
+
+Backends (E2E_DEVICE_HEALTH):
+
+  idevice          libimobiledevice (ideviceinfo, idevicediagnostics); the
+                   default when ideviceinfo is on PATH
+  replay:<path>    cycle through the samples of a recorded
+                   device_health.jsonl, for Linux and harness development
+  off              no sampling
+
+libimobiledevice has no thermal-state or memory-pressure query; the battery
+temperature is the closest proxy for throttling.
+"""
+import json
+import logging
+import os
+import plistlib
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+from .cache import cache_path
+from .device import device_type, device_udid
+from .http_tier import needs_device
+from .runinfo import RUN_ID
+
+BACKEND = os.getenv("E2E_DEVICE_HEALTH", "").strip()
+
+INTERVAL_S = float(os.getenv("E2E_DEVICE_HEALTH_INTERVAL", "15"))
+
+# Flag thresholds; iOS offers Low Power Mode at 20% and starts throttling
+# well before the 45C shutdown warning
+HOT_C = float(os.getenv("E2E_DEVICE_HOT_C", "38"))
+LOW_BATTERY = int(os.getenv("E2E_DEVICE_LOW_BATTERY", "20"))
+LOW_DISK_MB = int(os.getenv("E2E_DEVICE_LOW_DISK_MB", "1024"))
+
+# Seconds a call report waits for the closing sample
+CLOSING_SAMPLE_TIMEOUT_S = 20
+
+_CALL_WINDOW = pytest.StashKey[tuple]()
+
+
+def _run(cmd: list, timeout: int = 10) -> str:
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout.decode(errors="replace") if result.returncode == 0 else ""
+
+
+class IdeviceBackend:
+    """Metrics from libimobiledevice over USB/Wi-Fi pairing."""
+
+    def __init__(self, udid: str):
+        self.udid = udid
+
+    def _info(self, domain: str, key: str) -> str:
+        return _run(["ideviceinfo", "-u", self.udid, "-q", domain, "-k", key]).strip()
+
+    def sample(self) -> dict:
+        metrics = {}
+        level = self._info("com.apple.mobile.battery", "BatteryCurrentCapacity")
+        if level.isdigit():
+            metrics["battery_level"] = int(level)
+        charging = self._info("com.apple.mobile.battery", "BatteryIsCharging")
+        if charging:
+            metrics["charging"] = charging == "true"
+        free = self._info("com.apple.disk_usage", "AmountDataAvailable")
+        if free.isdigit():
+            metrics["disk_free_mb"] = int(free) // (1024 * 1024)
+        ioreg = _run(["idevicediagnostics", "-u", self.udid, "ioregentry", "AppleSmartBattery"])
+        if ioreg:
+            try:
+                battery = plistlib.loads(ioreg.encode())
+            except Exception:
+                battery = {}
+            # Temperature is reported in hundredths of a degree Celsius
+            temperature = battery.get("IORegistry", battery).get("Temperature")
+            if isinstance(temperature, int):
+                metrics["battery_temp_c"] = temperature / 100.0
+        return metrics
+
+
+class ReplayBackend:
+    """Replays recorded samples in order, wrapping around at the end."""
+
+    def __init__(self, path: str):
+        self.samples = []
+        with open(path) as f:
+            for line in f:
+                try:
+                    self.samples.append(json.loads(line)["metrics"])
+                except (ValueError, KeyError):
+                    continue
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def sample(self) -> dict:
+        if not self.samples:
+            return {}
+        with self.lock:
+            metrics = self.samples[self.position % len(self.samples)]
+            self.position += 1
+        return dict(metrics)
+
+
+def make_backend(spec: str = BACKEND):
+    """Backend for an E2E_DEVICE_HEALTH value, or None to disable."""
+    if spec.startswith("replay:"):
+        return ReplayBackend(spec[len("replay:"):])
+    if spec in ("off", "0", "false", "no"):
+        return None
+    if spec == "idevice" or (not spec and shutil.which("ideviceinfo")):
+        return IdeviceBackend(device_udid())
+    if spec:
+        raise ValueError(f"Unknown E2E_DEVICE_HEALTH backend {spec!r}")
+    return None
+
+
+def summarize_samples(samples: list) -> dict:
+    """Worst-case view of a test's samples, plus flags for the bad ones."""
+    summary = {"samples": len(samples)}
+    levels = [s["battery_level"] for s in samples if "battery_level" in s]
+    temps = [s["battery_temp_c"] for s in samples if "battery_temp_c" in s]
+    disk = [s["disk_free_mb"] for s in samples if "disk_free_mb" in s]
+    charging = [s["charging"] for s in samples if "charging" in s]
+    if levels:
+        summary["battery_level"] = min(levels)
+    if temps:
+        summary["battery_temp_c"] = max(temps)
+    if disk:
+        summary["disk_free_mb"] = min(disk)
+    if charging:
+        summary["charging"] = charging[-1]
+    flags = []
+    if temps and max(temps) >= HOT_C:
+        flags.append("hot")
+    if levels and min(levels) <= LOW_BATTERY and not (charging and charging[-1]):
+        flags.append("low_battery")
+    if disk and min(disk) <= LOW_DISK_MB:
+        flags.append("low_disk")
+    if flags:
+        summary["flags"] = flags
+    return summary
+
+
+class HealthSampler(threading.Thread):
+    """Samples the backend on an interval and keeps the samples in memory."""
+
+    def __init__(self, backend, interval: float = INTERVAL_S, path: str = None):
+        super().__init__(name="device-health", daemon=True)
+        self.backend = backend
+        self.interval = interval
+        self.path = path or cache_path("device_health.jsonl")
+        self.samples = []
+        self.lock = threading.Lock()
+        self.sampled = threading.Condition(self.lock)
+        # Start time of the last finished sampling attempt
+        self.last_started = 0.0
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def sample_now(self):
+        started = time.time()
+        try:
+            metrics = self.backend.sample()
+        except Exception as e:
+            logging.debug(f"device health sample failed: {e}")
+            metrics = {}
+        now = time.time()
+        with self.lock:
+            if metrics:
+                self.samples.append((now, metrics))
+            self.last_started = started
+            self.sampled.notify_all()
+        if metrics:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"run_id": RUN_ID, "at": round(now, 3), "metrics": metrics}) + "\n")
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.clear()
+            self.sample_now()
+            self.wake.wait(self.interval)
+
+    def request_sample(self) -> float:
+        """Have the thread sample now instead of at the next interval."""
+        requested = time.time()
+        self.wake.set()
+        return requested
+
+    def wait_for_sample(self, after: float, timeout: float) -> bool:
+        """Wait until a sample started at or after ``after`` is done."""
+        with self.lock:
+            return self.sampled.wait_for(lambda: self.last_started >= after, timeout)
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def window(self, start: float, end: float) -> list:
+        """Samples taken during [start, end], plus the last one before it."""
+        with self.lock:
+            before = [m for t, m in self.samples if t < start][-1:]
+            return before + [m for t, m in self.samples if start <= t <= end]
+
+
+class DeviceHealthPlugin:
+    """Runs the sampler during device tests and tags each test with it."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.sampler = None
+        self.flagged = {}
+
+    def pytest_collection_finish(self, session):
+        if session.config.getoption("collectonly") or not needs_device(session):
+            return
+        if device_type() == "simulator" and isinstance(self.backend, IdeviceBackend):
+            return
+        self.sampler = HealthSampler(self.backend)
+        self.sampler.start()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.sampler is not None:
+                # Sample at the end too, so short tests aren't judged only by
+                # a reading from before they started; the thread takes it
+                item.stash[_CALL_WINDOW] = (start, self.sampler.request_sample())
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        window = item.stash.get(_CALL_WINDOW, None)
+        if report.when != "call" or window is None or self.sampler is None:
+            return
+        # The report's duration is already fixed, so the wait isn't counted
+        start, ended = window
+        self.sampler.wait_for_sample(ended, CLOSING_SAMPLE_TIMEOUT_S)
+        samples = self.sampler.window(start, time.time())
+        if samples:
+            summary = summarize_samples(samples)
+            report.user_properties.append(("device_health", summary))
+            if summary.get("flags"):
+                self.flagged[item.nodeid] = summary
+
+    def pytest_sessionfinish(self, session):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.flagged:
+            return
+        terminalreporter.section("device health")
+        for nodeid, summary in self.flagged.items():
+            details = ", ".join(f"{k}={v}" for k, v in summary.items() if k not in ("flags", "samples"))
+            terminalreporter.write_line(f"{nodeid}: {', '.join(summary['flags'])} ({details})")
@@ -0,0 +1,44 @@
+"""Command middleware for Appium/Selenium drivers.
+
+Every WebDriver call funnels through ``driver.execute(command, params)``.
+add_command_middleware wraps that method once per driver instance so harness
+features (navigation tracking, timing, profiling) can observe or steer the
+traffic without the tests calling anything differently.
+"""
+
+
+def add_command_middleware(driver, middleware):
+    """Insert ``middleware`` into the driver's command chain.
+
+    A middleware is called as ``middleware(call_next, command, params)`` and
+    must return ``call_next(command, params)`` (or an equivalent response).
+    Middleware registered first runs outermost.
+    """
+    chain = getattr(driver, "_hp_middleware", None)
+    if chain is None:
+        chain = []
+        send = driver.execute
+
+        def execute(driver_command, params=None):
+            def call(index, command, command_params):
+                if index == len(chain):
+                    return send(command, command_params)
+                return chain[index](
+                    lambda c, p: call(index + 1, c, p), command, command_params
+                )
+
+            return call(0, driver_command, params)
+
+        driver.execute = execute
+        driver._hp_middleware = chain
+    chain.append(middleware)
+    return middleware
+
+
+def clear_command_middleware(driver):
+    """Remove all middleware; ``driver.execute`` is the driver's own again."""
+    if getattr(driver, "_hp_middleware", None) is None:
+        return
+    # The wrapper is an instance attribute shadowing the class method
+    vars(driver).pop("execute", None)
+    del driver._hp_middleware
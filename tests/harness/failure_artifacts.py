@@ -0,0 +1,239 @@
+"""Failure bundles: what the device, the proxy and Appium saw when a test failed.
+
+When a device test's call phase fails, two things are read from the driver
+right away, while the page is still the one that failed: the screenshot
+and a one-script page probe (URL, title, ready state, visible text, block
+page marker, location overlay). Those are the only round trips on the test
+thread. The screenshot is labeled there too (block page, consent wall, 502,
+..., see screen_classifier.py; a few milliseconds) and the label goes on the
+report as the ``screen_label`` user property. Everything else runs on a
+background pool, concurrently, while the next test starts:
+
+  - the proxy's allow/block decisions from the test's start on (mitmproxy logs)
+  - the Appium server log written during the test (managed Appium only)
+  - one zip per failure: ``artifacts/<run_id>/<test>.zip`` in the harness
+    cache, with manifest.json, probe.json, proxy_decisions.jsonl, appium.log
+    and screenshot.png
+
+Identical screenshots (same bytes, e.g. the same block page failing several
+tests) are stored once per run; later bundles point at the first one in
+their manifest. The PNG also still lands in tests/e2e/screenshots/. Pending
+bundles are finished before the session ends.
+"""
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from . import appium_server, screen_classifier
+from .blockpage import block_marker
+from .cache import cache_path
+from .har import fetch_proxy_logs, parse_decisions, slug
+from .http_tier import DEVICE_FIXTURES
+from .latency import CLOCK_SKEW_TOLERANCE
+from .runinfo import RUN_ID
+
+SCREENSHOTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "e2e", "screenshots")
+
+# Tail of the Appium log kept per failure
+APPIUM_LOG_MAX_BYTES = 2 * 1024 * 1024
+
+# Seconds to wait for pending bundles at the end of the session
+FLUSH_TIMEOUT_S = 120
+
+PROBE_SCRIPT = """
+var body = document.body;
+var text = body ? (body.innerText || '') : '';
+return {
+    url: location.href,
+    title: document.title,
+    ready_state: document.readyState,
+    text: text.slice(0, 4000),
+    text_length: text.length,
+    html_length: document.documentElement ? document.documentElement.outerHTML.length : 0,
+    iframes: document.querySelectorAll('iframe').length,
+    overlay: !!document.getElementById('location-permission-overlay')
+};
+"""
+
+FAILURE_BUNDLE = pytest.StashKey[str]()
+_STARTED = pytest.StashKey[float]()
+_APPIUM_LOG = pytest.StashKey[tuple]()
+
+
+def bundle_dir(run_id: str = RUN_ID) -> str:
+    path = os.path.join(cache_path("artifacts"), run_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def capture_device(driver) -> dict:
+    """Screenshot (PNG bytes) and page probe; the only driver calls made."""
+    captured = {"captured_at": time.time()}
+    try:
+        captured["png"] = base64.b64decode(driver.get_screenshot_as_base64())
+    except Exception as e:
+        captured["screenshot_error"] = str(e)
+    try:
+        probe = driver.execute_script(PROBE_SCRIPT) or {}
+        probe["block_marker"] = block_marker(probe.get("text"))
+        captured["probe"] = probe
+    except Exception as e:
+        captured["probe_error"] = str(e)
+    return captured
+
+
+def _describe(screen: dict) -> str:
+    if screen["reference"] is None:
+        return screen["label"]
+    return f"{screen['label']} ({screen['distance']} bits from {screen['reference']})"
+
+
+def _appium_log_slice(path: str, offset: int) -> str:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        start = max(offset, end - APPIUM_LOG_MAX_BYTES)
+        f.seek(start)
+        return f.read().decode(errors="replace")
+
+
+class FailureArtifactPlugin:
+    """Captures failure state on the test thread and bundles it in the background."""
+
+    def __init__(self, workers: int = 4):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="failure-artifacts")
+        # Separate pool for the fetches a bundle waits on, so waiting
+        # bundles can't starve them
+        self.fetch_pool = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="failure-fetch")
+        self.pending = []
+        self.screenshots = {}
+        self.lock = threading.Lock()
+        self.bundles = []
+        self.labels = {}
+
+    def pytest_runtest_setup(self, item):
+        item.stash[_STARTED] = time.time()
+        server = appium_server.current()
+        if server is not None and server.log_path and os.path.exists(server.log_path):
+            item.stash[_APPIUM_LOG] = (server.log_path, os.path.getsize(server.log_path))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        if report.when != "call" or not report.failed:
+            return
+        funcargs = getattr(item, "funcargs", None) or {}
+        driver = next((funcargs[name] for name in DEVICE_FIXTURES if name in funcargs), None)
+        if driver is None:
+            return
+        captured = capture_device(driver)
+        if captured.get("png"):
+            try:
+                captured["screen"] = screen_classifier.classify(captured["png"])
+            except Exception as e:
+                logging.warning(f"⚠️  Screenshot not classified: {e}")
+        screen = captured.get("screen")
+        if screen:
+            report.user_properties.append(("screen_label", screen["label"]))
+            report.sections.append(("screen", _describe(screen)))
+        path = os.path.join(bundle_dir(), f"{slug(item.nodeid)}.zip")
+        item.stash[FAILURE_BUNDLE] = path
+        report.user_properties.append(("failure_bundle", path))
+        report.sections.append(("failure bundle", path))
+        started = item.stash.get(_STARTED, captured["captured_at"])
+        appium_log = item.stash.get(_APPIUM_LOG, None)
+        self.pending.append(self.pool.submit(
+            self._bundle, path, item.nodeid, item.name, started, captured, appium_log,
+            str(report.longrepr)[-4000:],
+        ))
+        with self.lock:
+            self.labels[item.nodeid] = screen["label"] if screen else None
+
+    def _bundle(self, path, nodeid, name, started, captured, appium_log, longrepr):
+        # Slow parts in parallel
+        decisions = self.fetch_pool.submit(self._decisions, started, captured["captured_at"])
+        appium = self.fetch_pool.submit(_appium_log_slice, *appium_log) if appium_log else None
+
+        manifest = {"test": nodeid, "run_id": RUN_ID, "started_at": started,
+                    "failed_at": captured["captured_at"], "error": longrepr,
+                    "screen": captured.get("screen")}
+        files = {}
+        png = captured.get("png")
+        if png:
+            sha = hashlib.sha256(png).hexdigest()
+            with self.lock:
+                first = self.screenshots.setdefault(sha, path)
+            manifest["screenshot"] = {"sha256": sha}
+            if first == path:
+                files["screenshot.png"] = png
+                os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+                with open(os.path.join(SCREENSHOTS_DIR, f"failure_{name}.png"), "wb") as f:
+                    f.write(png)
+            else:
+                manifest["screenshot"]["same_as"] = os.path.basename(first)
+        else:
+            manifest["screenshot_error"] = captured.get("screenshot_error")
+        if "probe" in captured:
+            files["probe.json"] = json.dumps(captured["probe"], indent=1)
+        else:
+            manifest["probe_error"] = captured.get("probe_error")
+        try:
+            files["proxy_decisions.jsonl"] = "".join(json.dumps(d) + "\n" for d in decisions.result())
+        except Exception as e:
+            manifest["proxy_error"] = str(e)
+        if appium is not None:
+            try:
+                files["appium.log"] = appium.result()
+            except Exception as e:
+                manifest["appium_log_error"] = str(e)
+        files["manifest.json"] = json.dumps(manifest, indent=1)
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as bundle:
+            for filename, content in files.items():
+                # PNGs are compressed already
+                method = zipfile.ZIP_STORED if filename.endswith(".png") else zipfile.ZIP_DEFLATED
+                bundle.writestr(filename, content, compress_type=method)
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+        with self.lock:
+            self.bundles.append((nodeid, path))
+        return path
+
+    def _decisions(self, started: float, failed_at: float) -> list:
+        decisions = parse_decisions(fetch_proxy_logs(started - CLOCK_SKEW_TOLERANCE))
+        until = failed_at + CLOCK_SKEW_TOLERANCE
+        return [d for d in decisions if d["ts"] <= until]
+
+    def pytest_sessionfinish(self, session):
+        deadline = time.monotonic() + FLUSH_TIMEOUT_S
+        for future in self.pending:
+            try:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                logging.warning(f"⚠️  Failure bundle not written: {e}")
+        self.pool.shutdown(wait=False)
+        self.fetch_pool.shutdown(wait=False)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.bundles:
+            return
+        terminalreporter.section("failure bundles")
+        counts = Counter(label for label in self.labels.values() if label)
+        if counts:
+            terminalreporter.write_line(", ".join(f"{label}: {n}" for label, n in counts.most_common()))
+        for nodeid, path in self.bundles:
+            label = self.labels.get(nodeid)
+            terminalreporter.write_line(f"{nodeid}: {f'[{label}] ' if label else ''}{path}")
+
@@ -0,0 +1,382 @@
+"""HAR-like archives of the device's page loads, and a cross-run diff.
+
+At the end of a run every navigation captured by navtiming.py is written as
+a HAR 1.2 file under ``har/<run_id>/`` in the harness cache. Entries come
+from the browser's Resource Timing; each one carries the proxy's verdict for
+its host (``_proxy_decision``) taken from the mitmproxy log lines of the
+page's time window. Requests the proxy blocked before the browser saw a
+response are usually missing from Resource Timing, so those decisions are
+added as entries of their own (``_source: "proxy"``, status 0).
+
+The plugin reads those log lines per device test, in the background while
+the next test runs, and waits for the reads before the last test's
+teardown: switching the VPN database back restarts the proxy, and the new
+pod's logs no longer have the run's decisions.
+
+The diff compares two runs page by page - request count, bytes, blocked
+subresources and slowest hosts - without touching the device.
+
+Usage:
+    python -m tests.harness.har export [--run RUN_ID] [--no-proxy-logs]
+    python -m tests.harness.har diff RUN_A RUN_B [--test SUBSTRING]
+
+Runs can be given as run IDs or as directories of .har files. Disable the
+automatic export with E2E_HAR=0.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+
+from . import kube, navtiming
+from .cache import cache_path
+from .http_tier import DEVICE_FIXTURES
+from .latency import CLOCK_SKEW_TOLERANCE, parse_timestamped_line
+from .runinfo import RUN_ID
+
+ENABLED = os.getenv("E2E_HAR", "1").lower() not in ("0", "false", "no")
+
+# Proxy lines after the page's last resource still belong to it for this long
+PAGE_SLACK_S = 2.0
+
+# Seconds to wait for the per-test decision reads before the last teardown
+FLUSH_TIMEOUT_S = 120
+
+_STARTED = pytest.StashKey[float]()
+
+_URL_RE = re.compile(r"https?://[^\s'\"<>]+", re.IGNORECASE)
+_HOST_RE = re.compile(r"\b((?:[a-z0-9-]+\.)+[a-z]{2,})\b", re.IGNORECASE)
+
+
+def har_dir(run_id: str = RUN_ID) -> str:
+    path = os.path.join(cache_path("har"), run_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def fetch_proxy_logs(since: float) -> str:
+    """mitmproxy log lines with kubectl timestamps, from ``since`` on."""
+    result = kube.deployment_logs("mitmproxy", since_time=since, timestamps=True, timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "kubectl logs failed")
+    return result.stdout
+
+
+def parse_decisions(logs: str) -> list:
+    """Allow/block verdicts as [{"ts", "verdict", "host", "url", "line"}]."""
+    decisions = []
+    for raw in logs.splitlines():
+        ts, text = parse_timestamped_line(raw)
+        if ts is None:
+            continue
+        upper = text.upper()
+        if "BLOCK" in upper:
+            verdict = "blocked"
+        elif "ALLOW" in upper:
+            verdict = "allowed"
+        else:
+            continue
+        url_match = _URL_RE.search(text)
+        url = url_match.group(0) if url_match else None
+        host = navtiming.host_of(url) if url else None
+        if not host:
+            host_match = _HOST_RE.search(text)
+            host = host_match.group(1).lower() if host_match else None
+        if host:
+            decisions.append({"ts": ts, "verdict": verdict, "host": host, "url": url, "line": text[:300]})
+    return decisions
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat(timespec="milliseconds").replace(
+        "+00:00", "Z"
+    )
+
+
+def _har_entry(page_id: str, origin: float, timing: dict, decision: str, initiator: str) -> dict:
+    def phase(name):
+        value = timing.get(name)
+        return value if value and value > 0 else -1
+
+    return {
+        "pageref": page_id,
+        "startedDateTime": _iso(origin + (timing.get("start") or 0) / 1000.0),
+        "time": timing.get("total") or 0,
+        "request": {"method": "GET", "url": timing.get("url"), "httpVersion": timing.get("protocol") or "",
+                    "headers": [], "queryString": [], "cookies": [], "headersSize": -1, "bodySize": 0},
+        "response": {"status": timing.get("status") or 0, "statusText": "", "httpVersion": "",
+                     "headers": [], "cookies": [], "redirectURL": "", "headersSize": -1,
+                     "bodySize": timing.get("body_size") or -1,
+                     "content": {"size": timing.get("body_size") or 0, "mimeType": ""},
+                     "_transferSize": timing.get("transfer_size") or 0},
+        "cache": {},
+        "timings": {"blocked": -1, "dns": phase("dns"), "connect": phase("connect"), "ssl": phase("tls"),
+                    "send": 0, "wait": phase("ttfb"), "receive": phase("transfer")},
+        "_initiator": initiator,
+        "_proxy_decision": decision,
+        "_source": "browser",
+    }
+
+
+def _verdict(host: str, verdicts: dict):
+    """Verdict logged for ``host`` or, failing that, its closest parent domain."""
+    labels = (host or "").split(".")
+    for i in range(len(labels) - 1):
+        verdict = verdicts.get(".".join(labels[i:]))
+        if verdict:
+            return verdict
+    return None
+
+
+def build_har(nav: dict, decisions: list, index: int = 0) -> dict:
+    """One HAR document for a navigation captured by navtiming.py."""
+    origin = (nav.get("time_origin") or 0) / 1000.0 or nav.get("captured_at", 0)
+    resources = nav.get("resources", [])
+    end = origin + max(
+        [nav.get("load") or 0] + [(r.get("start") or 0) + (r.get("total") or 0) for r in resources]
+    ) / 1000.0 + PAGE_SLACK_S
+    window = [d for d in decisions if origin - CLOCK_SKEW_TOLERANCE <= d["ts"] <= end]
+
+    verdicts = {}
+    for d in window:
+        # A block anywhere in the window wins over allows for the same host
+        if verdicts.get(d["host"]) != "blocked":
+            verdicts[d["host"]] = d["verdict"]
+
+    page_id = f"page_{index}"
+    entries = [_har_entry(page_id, origin, nav, _verdict(nav.get("host"), verdicts), "navigation")]
+    seen_hosts = {nav.get("host")}
+    for resource in resources:
+        host = navtiming.host_of(resource.get("url"))
+        seen_hosts.add(host)
+        entries.append(_har_entry(page_id, origin, resource, _verdict(host, verdicts), resource.get("initiator")))
+
+    for d in window:
+        if d["verdict"] == "blocked" and d["host"] not in seen_hosts:
+            seen_hosts.add(d["host"])
+            entries.append({
+                **_har_entry(page_id, d["ts"], {"url": d["url"] or f"https://{d['host']}/"}, "blocked", "proxy"),
+                "_source": "proxy",
+                "comment": d["line"],
+            })
+
+    return {
+        "log": {
+            "version": "1.2",
+            "creator": {"name": "hocuspocus-e2e", "version": RUN_ID},
+            "pages": [{
+                "startedDateTime": _iso(origin),
+                "id": page_id,
+                "title": nav.get("url"),
+                "pageTimings": {"onContentLoad": nav.get("dom_content_loaded") or -1,
+                                "onLoad": nav.get("load") or -1},
+                "_test": nav.get("test"),
+                "_run_id": nav.get("run_id"),
+            }],
+            "entries": entries,
+        }
+    }
+
+
+def slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", text or "").strip("_")[:120]
+
+
+def export_run(run_id: str = RUN_ID, with_proxy_logs: bool = True, decisions: list = None) -> list:
+    """Write one .har per navigation of ``run_id``; returns the paths.
+
+    ``decisions`` already read (as parse_decisions() returns them) are used
+    as they are; otherwise they are read from the current proxy pod.
+    """
+    navs = [n for n in navtiming.load_entries() if n.get("run_id") == run_id]
+    if not navs:
+        return []
+    if decisions is not None:
+        with_proxy_logs = False
+    decisions = decisions or []
+    if with_proxy_logs:
+        since = min((n.get("time_origin") or 0) / 1000.0 or n["captured_at"] for n in navs)
+        try:
+            decisions = parse_decisions(fetch_proxy_logs(since - CLOCK_SKEW_TOLERANCE))
+        except Exception as e:
+            logging.warning(f"⚠️  HAR export without proxy decisions: {e}")
+
+    out = har_dir(run_id)
+    paths = []
+    for index, nav in enumerate(navs):
+        path = os.path.join(out, f"{index:03d}_{slug(nav.get('test'))}_{slug(nav.get('host'))}.har")
+        with open(path, "w") as f:
+            json.dump(build_har(nav, decisions, index), f, indent=1)
+        paths.append(path)
+    return paths
+
+
+def _decisions_between(started: float, ended: float) -> list:
+    decisions = parse_decisions(fetch_proxy_logs(started - CLOCK_SKEW_TOLERANCE))
+    until = ended + PAGE_SLACK_S + CLOCK_SKEW_TOLERANCE
+    return [d for d in decisions if d["ts"] <= until]
+
+
+class HarExportPlugin:
+    """Writes the HAR files of this run's navigations when the session ends."""
+
+    def __init__(self, workers: int = 2):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="har-decisions")
+        self.pending = []
+        self.decisions = []
+
+    def pytest_runtest_setup(self, item):
+        item.stash[_STARTED] = time.time()
+
+    # Before the runner's own teardown, i.e. before session fixtures (and
+    # the proxy restart they trigger) are torn down after the last test
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_teardown(self, item, nextitem):
+        started = item.stash.get(_STARTED, None)
+        if started is not None and any(name in item.fixturenames for name in DEVICE_FIXTURES):
+            self.pending.append(self.pool.submit(_decisions_between, started, time.time()))
+        if nextitem is None:
+            self._flush()
+
+    def _flush(self):
+        deadline = time.monotonic() + FLUSH_TIMEOUT_S
+        seen = {(d["ts"], d["line"]) for d in self.decisions}
+        for future in self.pending:
+            try:
+                decisions = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                logging.warning(f"⚠️  Proxy decisions of a test not read for the HAR files: {e}")
+                continue
+            for d in decisions:
+                if (d["ts"], d["line"]) not in seen:
+                    seen.add((d["ts"], d["line"]))
+                    self.decisions.append(d)
+        self.pending = []
+
+    def pytest_sessionfinish(self, session):
+        # Interrupted runs never reach the last teardown
+        self._flush()
+        self.pool.shutdown(wait=False)
+        started = time.monotonic()
+        paths = export_run(RUN_ID, decisions=sorted(self.decisions, key=lambda d: d["ts"]))
+        if paths:
+            logging.info(
+                f"🗂️  {len(paths)} HAR file(s) in {har_dir(RUN_ID)} "
+                f"({time.monotonic() - started:.1f}s)"
+            )
+
+
+def _load_run(run: str) -> list:
+    directory = run if os.path.isdir(run) else os.path.join(cache_path("har"), run)
+    hars = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.har"))):
+        try:
+            with open(path) as f:
+                hars.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    if not hars:
+        raise SystemExit(f"No .har files for run {run!r} ({directory})")
+    return hars
+
+
+def page_stats(har: dict) -> dict:
+    entries = har["log"]["entries"]
+    host_time = {}
+    for entry in entries:
+        host = navtiming.host_of(entry["request"]["url"])
+        host_time[host] = host_time.get(host, 0.0) + (entry.get("time") or 0.0)
+    return {
+        "requests": len(entries),
+        "bytes": sum(entry["response"].get("_transferSize") or 0 for entry in entries),
+        "blocked": sorted({
+            navtiming.host_of(entry["request"]["url"])
+            for entry in entries if entry.get("_proxy_decision") == "blocked"
+        }),
+        "host_time": host_time,
+    }
+
+
+def _pages(run: str, test_filter: str = None) -> dict:
+    """{(test, page host): merged stats} - repeat visits in a run are summed."""
+    pages = {}
+    for har in _load_run(run):
+        page = har["log"]["pages"][0]
+        test = page.get("_test") or ""
+        if test_filter and test_filter not in test:
+            continue
+        key = (test, navtiming.host_of(page.get("title")))
+        stats = page_stats(har)
+        merged = pages.setdefault(key, {"requests": 0, "bytes": 0, "blocked": set(), "host_time": {}})
+        merged["requests"] += stats["requests"]
+        merged["bytes"] += stats["bytes"]
+        merged["blocked"].update(stats["blocked"])
+        for host, ms in stats["host_time"].items():
+            merged["host_time"][host] = merged["host_time"].get(host, 0.0) + ms
+    return pages
+
+
+def diff(run_a: str, run_b: str, test_filter: str = None, top: int = 5) -> str:
+    a, b = _pages(run_a, test_filter), _pages(run_b, test_filter)
+    lines = []
+    for key in sorted(set(a) | set(b)):
+        test, host = key
+        lines.append(f"\n{test} -> {host}")
+        if key not in a or key not in b:
+            lines.append(f"  only in {run_a if key in a else run_b}")
+            continue
+        pa, pb = a[key], b[key]
+        lines.append(f"  requests {pa['requests']:>6} -> {pb['requests']:<6} ({pb['requests'] - pa['requests']:+d})")
+        lines.append(f"  bytes    {pa['bytes']:>6} -> {pb['bytes']:<6} ({pb['bytes'] - pa['bytes']:+d})")
+        newly, no_longer = pb["blocked"] - pa["blocked"], pa["blocked"] - pb["blocked"]
+        if newly:
+            lines.append(f"  newly blocked:     {', '.join(sorted(newly))}")
+        if no_longer:
+            lines.append(f"  no longer blocked: {', '.join(sorted(no_longer))}")
+        hosts = set(pa["host_time"]) | set(pb["host_time"])
+        deltas = sorted(
+            ((pb["host_time"].get(h, 0.0) - pa["host_time"].get(h, 0.0), h) for h in hosts),
+            reverse=True,
+        )
+        slowest = sorted(pb["host_time"].items(), key=lambda kv: -kv[1])[:top]
+        lines.append("  slowest hosts: " + ", ".join(f"{h} {ms:.0f}ms" for h, ms in slowest))
+        lines.append("  biggest slowdowns: " + ", ".join(
+            f"{h} {delta:+.0f}ms" for delta, h in deltas[:top] if delta > 0
+        ))
+    return "\n".join(lines).lstrip("\n") or "No pages to compare."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HAR archives of device page loads")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    export = sub.add_parser("export", help="Write .har files for a run's navigations")
+    export.add_argument("--run", default=None, help="Run ID (default: the latest recorded run)")
+    export.add_argument("--no-proxy-logs", action="store_true", help="Skip kubectl logs")
+    compare = sub.add_parser("diff", help="Compare two runs page by page")
+    compare.add_argument("run_a")
+    compare.add_argument("run_b")
+    compare.add_argument("--test", default=None, help="Only tests whose node ID contains this")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "export":
+        run = args.run
+        if run is None:
+            entries = navtiming.load_entries()
+            if not entries:
+                raise SystemExit("No navigation timing recorded yet.")
+            run = entries[-1]["run_id"]
+        paths = export_run(run, with_proxy_logs=not args.no_proxy_logs)
+        print(f"{len(paths)} HAR file(s) in {har_dir(run)}")
+    else:
+        print(diff(args.run_a, args.run_b, args.test))
+
+
+if __name__ == "__main__":
+    main()
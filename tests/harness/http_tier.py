@@ -0,0 +1,236 @@
+"""Device-free HTTP tier.
+
+Policy checks that only need the proxy's verdict can declare themselves
+eligible:
+
+    @pytest.mark.http_tier(url="https://twitter.com", expect="blocked")
+
+With --tier=http those tests are replaced by plain HTTP requests sent
+through the proxy (trusting profiles/mitmproxy-ca.pem) from a pooled
+client, run concurrently and judged with the same block-page detection as
+the device tests. Tests without the marker are deselected, so the device
+is not touched at all.
+
+The proxy deployed for the phone is transparent (IKEv2 VPN), so there is no
+default forward-proxy address to send these requests to: E2E_HTTP_PROXY
+(``http://host:port`` of a forward proxy applying the same policy) is required.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import pytest
+
+from .blockpage import block_marker
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CA_BUNDLE = os.getenv("E2E_HTTP_CA", os.path.join(REPO_ROOT, "profiles", "mitmproxy-ca.pem"))
+WORKERS = int(os.getenv("E2E_HTTP_WORKERS", "16"))
+REQUEST_TIMEOUT = float(os.getenv("E2E_HTTP_TIMEOUT", "20"))
+
+# Mobile Safari, so the proxy and sites serve the same pages as on the phone
+USER_AGENT = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 18_7 like Mac OS X) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/18.0 Mobile/15E148 Safari/604.1"
+)
+
+DEVICE_FIXTURES = ("ios_driver", "driver")
+
+# Lower-case fragments of resolver errors, as raised locally or relayed in a
+# proxy's 502 page
+DNS_FAILURE_MARKERS = (
+    "name or service not known",
+    "nodename nor servname",
+    "name does not resolve",
+    "temporary failure in name resolution",
+    "no address associated",
+    "failed to resolve",
+    "getaddrinfo",
+)
+
+
+def _dns_failure(text: str) -> bool:
+    lowered = (text or "").lower()
+    return any(marker in lowered for marker in DNS_FAILURE_MARKERS)
+
+
+def needs_device(session) -> bool:
+    """Whether any selected test uses an Appium driver."""
+    return any(
+        name in item.fixturenames for item in session.items for name in DEVICE_FIXTURES
+    )
+
+
+def resolve_proxy() -> str:
+    """E2E_HTTP_PROXY; there is no default."""
+    proxy = os.getenv("E2E_HTTP_PROXY", "").strip()
+    if not proxy:
+        raise RuntimeError(
+            "The HTTP tier needs a forward proxy: set E2E_HTTP_PROXY=http://host:port "
+            "(the VPN proxy is transparent and can't be used directly)"
+        )
+    return proxy
+
+
+@dataclass
+class HttpCheckResult:
+    url: str
+    expect: str
+    verdict: str  # "allowed", "blocked", "unresolved" (DNS) or "error"
+    status: int = None
+    elapsed: float = 0.0
+    detail: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.verdict == self.expect
+
+    def describe(self) -> str:
+        return (
+            f"{self.url}: expected {self.expect}, got {self.verdict}"
+            f" (status={self.status}, {self.elapsed * 1000:.0f} ms) {self.detail}".rstrip()
+        )
+
+
+class HttpTierClient:
+    """Pooled HTTP client that talks to sites through the proxy."""
+
+    def __init__(self, proxy: str, ca_bundle: str = CA_BUNDLE, workers: int = WORKERS):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.proxies = {"http": proxy, "https": proxy}
+        self.session.verify = ca_bundle
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def check(self, url: str, expect: str) -> HttpCheckResult:
+        import requests
+
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
+        except requests.exceptions.ProxyError as e:
+            # A CONNECT refused by the proxy is a block as well
+            verdict = "blocked" if "403" in str(e) else "unresolved" if _dns_failure(str(e)) else "error"
+            return HttpCheckResult(url, expect, verdict, None, time.monotonic() - started, str(e)[:200])
+        except requests.RequestException as e:
+            verdict = "unresolved" if _dns_failure(str(e)) else "error"
+            return HttpCheckResult(url, expect, verdict, None, time.monotonic() - started, str(e)[:200])
+
+        marker = block_marker(response.text)
+        if marker:
+            verdict, detail = "blocked", f"marker={marker!r}"
+        elif response.status_code < 400:
+            verdict, detail = "allowed", ""
+        elif _dns_failure(response.text):
+            verdict, detail = "unresolved", response.reason or ""
+        else:
+            # A 502 from the proxy or a site's 5xx is not evidence of "allowed"
+            verdict, detail = "error", response.reason or ""
+        return HttpCheckResult(
+            url, expect, verdict, response.status_code, time.monotonic() - started, detail,
+        )
+
+    def run_all(self, checks: dict) -> dict:
+        """Run {key: (url, expect)} concurrently; returns {key: result}."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {key: pool.submit(self.check, url, expect) for key, (url, expect) in checks.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    def close(self):
+        self.session.close()
+
+
+def _db_group(item) -> str:
+    # Tests that seed the test DB must be checked while the proxy points at
+    # it; everything else runs against prod.
+    return "test" if "seed_test_database" in item.fixturenames else "prod"
+
+
+class HttpTierResults:
+    """Runs the HTTP checks of a DB group in one concurrent batch, on first use."""
+
+    def __init__(self, session, client: HttpTierClient):
+        self.session = session
+        self.client = client
+        self.results = {}
+
+    def __getitem__(self, item) -> HttpCheckResult:
+        if item.nodeid not in self.results:
+            group = _db_group(item)
+            batch = {
+                other.nodeid: other.http_check
+                for other in self.session.items
+                if isinstance(getattr(other, "http_check", None), tuple)
+                and _db_group(other) == group
+                and other.nodeid not in self.results
+            }
+            started = time.monotonic()
+            self.results.update(self.client.run_all(batch))
+            logging.info(
+                f"🌐 HTTP tier: {len(batch)} check(s) against {group} in "
+                f"{time.monotonic() - started:.1f}s"
+            )
+        return self.results[item.nodeid]
+
+
+def _http_check(request, http_tier_results):
+    result = http_tier_results[request.node]
+    logging.info(f"🌐 {result.describe()}")
+    assert result.ok, result.describe()
+
+
+class HttpTierPlugin:
+    """Replaces http_tier-eligible tests with HTTP checks; drops the rest."""
+
+    def __init__(self, config):
+        self.config = config
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, config, items):
+        selected, deselected = [], []
+        for item in items:
+            marker = item.get_closest_marker("http_tier")
+            if marker is None:
+                deselected.append(item)
+                continue
+            selected.append(self._make_item(item, marker))
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+    def _make_item(self, item, marker):
+        if "url" not in marker.kwargs:
+            # Native HTTP-tier test (e.g. the policy matrix): runs as is
+            return item
+        url = marker.kwargs["url"]
+        expect = marker.kwargs.get("expect", "allowed")
+        if expect not in ("allowed", "blocked"):
+            raise pytest.UsageError(f"{item.nodeid}: http_tier expect must be 'allowed' or 'blocked'")
+
+        # Session fixtures such as seed_test_database still apply
+        usefixtures = [name for mark in item.iter_markers("usefixtures") for name in mark.args]
+
+        def check(request, http_tier_results):
+            _http_check(request, http_tier_results)
+
+        check.__doc__ = item.obj.__doc__
+        check = pytest.mark.usefixtures(*usefixtures)(check)
+        new = pytest.Function.from_parent(
+            item.getparent(pytest.Module),
+            name=f"{item.name}[http]",
+            callobj=check,
+            originalname=item.originalname,
+        )
+        for mark in item.iter_markers():
+            if mark.name not in ("usefixtures", "timeout"):
+                new.add_marker(getattr(pytest.mark, mark.name)(*mark.args, **mark.kwargs))
+        new.http_check = (url, expect)
+        return new
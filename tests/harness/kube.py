@@ -0,0 +1,236 @@
+"""Cluster access shared by both suites and the harness modules.
+
+Every operation goes through one in-process Kubernetes API client when the
+``kubernetes`` package is installed: the kubeconfig is read and the
+credentials are resolved once per run, and the HTTP connection pool is
+reused across calls (exec still opens one websocket per command). Without
+the package, or with E2E_KUBE_CLIENT=kubectl, each call forks kubectl as
+before.
+
+All helpers return a ``subprocess.CompletedProcess`` either way, so callers
+check ``returncode``/``stdout``/``stderr`` without caring which path ran.
+"""
+import functools
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+
+K8S_NAMESPACE = "hocuspocus"
+POSTGRES_POD = "postgres-0"
+POSTGRES_USER = "mitmproxy"
+
+CLIENT = os.getenv("E2E_KUBE_CLIENT", "api").lower()
+
+
+@functools.lru_cache(maxsize=1)
+def _kubectl_env() -> dict:
+    # Ensure kubectl is in PATH (Homebrew on macOS)
+    env = os.environ.copy()
+    env["PATH"] = "/opt/homebrew/bin:" + env.get("PATH", "")
+    return env
+
+
+def run_kubectl(args: list, timeout: int = 60) -> subprocess.CompletedProcess:
+    """Run a kubectl command in the hocuspocus namespace."""
+    cmd = ["kubectl", "-n", K8S_NAMESPACE] + args
+    return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=_kubectl_env())
+
+
+class _Api:
+    """Core/apps API handles sharing one ApiClient (and its connections)."""
+
+    def __init__(self):
+        from kubernetes import client, config
+
+        try:
+            config.load_kube_config()
+        except config.ConfigException:
+            config.load_incluster_config()
+        api_client = client.ApiClient()
+        self.core = client.CoreV1Api(api_client)
+        self.apps = client.AppsV1Api(api_client)
+
+
+@functools.lru_cache(maxsize=1)
+def api():
+    """The shared API client, or None when kubectl has to be used."""
+    if CLIENT == "kubectl":
+        return None
+    try:
+        return _Api()
+    except ImportError:
+        logging.warning(
+            "⚠️  kubernetes package not installed (pip install -r tests/e2e/requirements.txt), "
+            "forking kubectl for every cluster call"
+        )
+        return None
+    except Exception as e:
+        logging.warning(f"⚠️  Kubernetes API client unavailable, using kubectl: {e}")
+        return None
+
+
+def _completed(args, stdout: str = "", returncode: int = 0, stderr: str = "") -> subprocess.CompletedProcess:
+    return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
+
+def _api_call(args, fn) -> subprocess.CompletedProcess:
+    """Run ``fn`` (stdout when it returns a str) and turn API errors into a failed result."""
+    try:
+        out = fn()
+    except Exception as e:
+        return _completed(args, returncode=1, stderr=str(getattr(e, "body", None) or e))
+    return _completed(args, out if isinstance(out, str) else "")
+
+
+def _deployment_selector(deployment: str) -> str:
+    labels = api().apps.read_namespaced_deployment(deployment, K8S_NAMESPACE).spec.selector.match_labels
+    return ",".join(f"{k}={v}" for k, v in labels.items())
+
+
+def _newest_pod(selector: str):
+    pods = api().core.list_namespaced_pod(K8S_NAMESPACE, label_selector=selector).items
+    if not pods:
+        return None
+    return max(pods, key=lambda pod: pod.metadata.creation_timestamp)
+
+
+def exec_in_pod(pod: str, command: list, timeout: int = 60) -> subprocess.CompletedProcess:
+    """``kubectl exec <pod> -- <command>``."""
+    if api() is None:
+        return run_kubectl(["exec", pod, "--"] + command, timeout=timeout)
+    from kubernetes.stream import stream
+
+    try:
+        resp = stream(
+            api().core.connect_get_namespaced_pod_exec, pod, K8S_NAMESPACE,
+            command=command, stderr=True, stdin=False, stdout=True, tty=False,
+            _preload_content=False,
+        )
+        resp.run_forever(timeout=timeout)
+        stdout, stderr = resp.read_stdout() or "", resp.read_stderr() or ""
+        returncode = resp.returncode
+        resp.close()
+    except Exception as e:
+        return _completed(command, returncode=1, stderr=str(e))
+    if returncode is None:
+        return _completed(command, stdout, 1, stderr or f"exec timed out after {timeout}s")
+    return _completed(command, stdout, returncode, stderr)
+
+
+def psql(sql: str, database: str = "mitmproxy", tuples: bool = False,
+         timeout: int = 60) -> subprocess.CompletedProcess:
+    """Run SQL in the postgres pod; ``tuples`` gives unaligned rows only (-t -A)."""
+    command = ["psql", "-U", POSTGRES_USER, "-d", database]
+    if tuples:
+        command += ["-t", "-A"]
+    return exec_in_pod(POSTGRES_POD, command + ["-c", sql], timeout=timeout)
+
+
+def vpn_service_ip() -> str:
+    """External IP of the VPN LoadBalancer service ('' if not assigned)."""
+    if api() is None:
+        result = run_kubectl([
+            "get", "svc", "vpn-service",
+            "-o", "jsonpath={.status.loadBalancer.ingress[0].ip}",
+        ], timeout=30)
+        return result.stdout.strip()
+    try:
+        ingress = api().core.read_namespaced_service("vpn-service", K8S_NAMESPACE).status.load_balancer.ingress
+    except Exception:
+        return ""
+    return (ingress[0].ip or "") if ingress else ""
+
+
+def pod_status(selector: str, field: str = "phase") -> str:
+    """``status.<field>`` (phase, podIP) of the first pod matching ``selector``."""
+    if api() is None:
+        result = run_kubectl(["get", "pod", "-l", selector, "-o", f"jsonpath={{.items[0].status.{field}}}"])
+        return result.stdout.strip()
+    try:
+        pods = api().core.list_namespaced_pod(K8S_NAMESPACE, label_selector=selector).items
+    except Exception:
+        return ""
+    if not pods:
+        return ""
+    attribute = {"podIP": "pod_ip"}.get(field, field)
+    return getattr(pods[0].status, attribute, None) or ""
+
+
+def patch_configmap(name: str, data: dict, timeout: int = 30) -> subprocess.CompletedProcess:
+    """Merge ``data`` into a ConfigMap."""
+    if api() is None:
+        return run_kubectl(
+            ["patch", "configmap", name, "--type", "merge", "-p", json.dumps({"data": data})],
+            timeout=timeout,
+        )
+    return _api_call(
+        ["patch", "configmap", name],
+        lambda: api().core.patch_namespaced_config_map(name, K8S_NAMESPACE, {"data": data},
+                                                      _request_timeout=timeout),
+    )
+
+
+def rollout_restart(deployment: str, timeout: int = 30) -> subprocess.CompletedProcess:
+    """``kubectl rollout restart``: bump the pod template's restartedAt annotation."""
+    if api() is None:
+        return run_kubectl(["rollout", "restart", f"deployment/{deployment}"], timeout=timeout)
+    patch = {"spec": {"template": {"metadata": {"annotations": {
+        "kubectl.kubernetes.io/restartedAt": datetime.now(timezone.utc).isoformat(),
+    }}}}}
+    return _api_call(
+        ["rollout", "restart", deployment],
+        lambda: api().apps.patch_namespaced_deployment(deployment, K8S_NAMESPACE, patch,
+                                                     _request_timeout=timeout),
+    )
+
+
+def delete_pods(selector: str, force: bool = False, timeout: int = 30) -> subprocess.CompletedProcess:
+    """Delete the pods matching ``selector`` (``force``: no grace period)."""
+    if api() is None:
+        args = ["delete", "pod", "-l", selector]
+        if force:
+            args += ["--force", "--grace-period=0"]
+        return run_kubectl(args, timeout=timeout)
+    return _api_call(
+        ["delete", "pod", "-l", selector],
+        lambda: api().core.delete_collection_namespaced_pod(
+            K8S_NAMESPACE, label_selector=selector, grace_period_seconds=0 if force else None,
+            _request_timeout=timeout,
+        ),
+    )
+
+
+def deployment_logs(deployment: str, since_seconds: int = None, since_time: float = None,
+                    tail: int = None, timestamps: bool = False,
+                    timeout: int = 30) -> subprocess.CompletedProcess:
+    """``kubectl logs deployment/<name>``; ``since_time`` is a Unix timestamp."""
+    if api() is None:
+        args = ["logs", f"deployment/{deployment}"]
+        if since_time is not None:
+            stamp = datetime.fromtimestamp(since_time, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            args.append(f"--since-time={stamp}")
+        elif since_seconds is not None:
+            args.append(f"--since={since_seconds}s")
+        if tail is not None:
+            args.append(f"--tail={tail}")
+        if timestamps:
+            args.append("--timestamps")
+        return run_kubectl(args, timeout=timeout)
+
+    def fetch():
+        pod = _newest_pod(_deployment_selector(deployment))
+        if pod is None:
+            raise RuntimeError(f"no pods for deployment/{deployment}")
+        seconds = since_seconds
+        if since_time is not None:
+            # The client only takes sinceSeconds; a second early is harmless
+            seconds = max(1, int(time.time() - since_time) + 1)
+        return api().core.read_namespaced_pod_log(
+            pod.metadata.name, K8S_NAMESPACE, since_seconds=seconds, tail_lines=tail,
+            timestamps=timestamps, _request_timeout=timeout,
+        )
+
+    return _api_call(["logs", deployment], fetch)
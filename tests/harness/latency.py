@@ -0,0 +1,207 @@
+"""Block-decision latency: client navigation start -> proxy verdict.
+
+The harness notes when a navigation starts, then finds the proxy's
+allow/block log line for that request (kubectl logs --timestamps, or the
+Loki timestamp) and records the difference per category in
+``decision_latency.jsonl``. Device, laptop and cluster clocks are all
+NTP-synced; the residual skew (usually tens of ms) is not corrected, and
+a verdict that lands before the navigation start is dropped rather than
+stored as a negative latency.
+
+Report:
+    python -m tests.harness.latency [--since-days N]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+from .cache import cache_path
+from .runinfo import RUN_ID
+from .stats import ascii_histogram, summarize
+
+CATEGORIES = (
+    "whitelisted_domain",
+    "blocked_domain",
+    "youtube_allowed",
+    "youtube_blocked",
+    "location_allowed",
+    "location_blocked",
+)
+
+# A proxy log line counts as the verdict when it mentions the request and
+# one of these words
+DECISION_WORDS = ("BLOCK", "ALLOW")
+
+# Log lines up to this many seconds before navigation start still match, to
+# absorb clock skew between the device and the cluster
+CLOCK_SKEW_TOLERANCE = float(os.getenv("E2E_CLOCK_SKEW_S", "0.5"))
+
+HISTOGRAM_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+# kubectl logs --timestamps prefix, RFC3339 with up to nanoseconds
+_TS_RE = re.compile(
+    r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)\s(.*)$"
+)
+
+# The document's start, read from the device after navigation
+NAV_START_SCRIPT = "return (performance.timeOrigin || performance.timing.navigationStart) || null;"
+
+
+def _latency_path() -> str:
+    return cache_path("decision_latency.jsonl")
+
+
+def format_log_timestamp(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def parse_timestamped_line(line: str):
+    """Split a timestamp-prefixed log line into (epoch seconds, text)."""
+    match = _TS_RE.match(line)
+    if not match:
+        return None, line
+    base, fraction, tz, text = match.groups()
+    tz = "+00:00" if tz == "Z" else tz
+    stamp = datetime.fromisoformat(f"{base}.{(fraction or '0')[:6].ljust(6, '0')}{tz}")
+    return stamp.timestamp(), text
+
+
+def find_decision(logs: str, needle: str, not_before: float):
+    """First verdict line for ``needle`` logged at/after ``not_before``.
+
+    Returns (epoch, line) or (None, None).
+    """
+    needle = needle.lower()
+    best = (None, None)
+    for raw in logs.splitlines():
+        ts, text = parse_timestamped_line(raw)
+        if ts is None or ts < not_before - CLOCK_SKEW_TOLERANCE:
+            continue
+        upper = text.upper()
+        if needle in text.lower() and any(word in upper for word in DECISION_WORDS):
+            # Loki streams are not merged in time order, so keep the earliest
+            if best[0] is None or ts < best[0]:
+                best = (ts, text)
+    return best
+
+
+class DecisionLatency:
+    """Per-test recorder used by the ``decision_latency`` fixture.
+
+    Usage:
+        decision_latency.navigate(ios_driver, url)
+        logs = mitmproxy_logs(tail=100, timestamps=True)
+        decision_latency.record("blocked_domain", logs, needle="reddit.com")
+    """
+
+    def __init__(self, nodeid: str, path: str = None):
+        self.nodeid = nodeid
+        self.path = path or _latency_path()
+        self.nav_start = None
+
+    def navigate(self, driver, url: str):
+        sent_at = time.time()
+        driver.get(url)
+        self.nav_start = sent_at
+        try:
+            origin_ms = driver.execute_script(NAV_START_SCRIPT)
+        except Exception:
+            origin_ms = None
+        # Prefer the device's own navigation start; fall back to when the
+        # command was sent if the page reports something implausible.
+        if origin_ms and abs(origin_ms / 1000.0 - sent_at) < 5:
+            self.nav_start = origin_ms / 1000.0
+
+    def record(self, category: str, logs: str, needle: str):
+        """Match the verdict for ``needle`` and store the latency (seconds).
+
+        Best effort: returns None without failing the test when no verdict
+        line is found.
+        """
+        if category not in CATEGORIES:
+            raise ValueError(f"Unknown category: {category}. Available: {list(CATEGORIES)}")
+        if self.nav_start is None:
+            return None
+        ts, line = find_decision(logs, needle, self.nav_start)
+        if ts is None:
+            logging.info(f"⏱️  No proxy verdict for '{needle}' found - latency not recorded")
+            return None
+        latency = ts - self.nav_start
+        if latency < 0:
+            logging.info(
+                f"⏱️  Verdict for '{needle}' logged {-latency * 1000:.0f} ms before navigation "
+                f"(clock skew) - latency not recorded"
+            )
+            return None
+        entry = {
+            "run_id": RUN_ID,
+            "test": self.nodeid,
+            "category": category,
+            "needle": needle,
+            "nav_start": round(self.nav_start, 3),
+            "decided_at": round(ts, 3),
+            "latency": round(latency, 4),
+            "line": line[:300],
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        logging.info(f"⏱️  {category} verdict after {latency * 1000:.0f} ms")
+        return latency
+
+
+def load_entries(path: str = None, since: float = 0.0) -> list:
+    entries = []
+    try:
+        with open(path or _latency_path()) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("nav_start", 0) >= since:
+                    entries.append(entry)
+    except OSError:
+        pass
+    return entries
+
+
+def report(entries: list) -> str:
+    by_category = {}
+    for entry in entries:
+        # Older files may still hold negative (skewed) samples
+        if entry["latency"] >= 0:
+            by_category.setdefault(entry["category"], []).append(entry["latency"])
+    if not by_category:
+        return "No decision latency samples recorded yet."
+
+    lines = [f"{'category':<20} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"]
+    for category in CATEGORIES:
+        values = by_category.get(category)
+        if not values:
+            continue
+        s = summarize(values)
+        lines.append(
+            f"{category:<20} {s['count']:>5} "
+            + " ".join(f"{s[k] * 1000:>6.0f}ms" for k in ("p50", "p95", "p99", "max"))
+        )
+    for category in CATEGORIES:
+        values = by_category.get(category)
+        if values:
+            lines.append(f"\n{category}")
+            lines.append(ascii_histogram(values, HISTOGRAM_BOUNDS))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Proxy block-decision latency report")
+    parser.add_argument("--since-days", type=float, default=30.0)
+    args = parser.parse_args(argv)
+    print(report(load_entries(since=time.time() - args.since_days * 86400)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Flakiness ledger and warm-session reruns.
+
+Every test outcome is appended to a local SQLite ledger together with a
+normalised failure signature, so flaky tests can be told apart from broken
+ones across runs. Two ways to recover from a flaky failure without paying
+for a full suite run:
+
+  --reruns-warm=N   retry a failing test up to N times right away. Only
+                    the test's own fixtures are torn down between attempts;
+                    class, module and session fixtures (the seeded DB, the
+                    prod Appium session) stay alive until the final attempt.
+  --ledger-failed   run only the tests that failed in the previous run
+                    (collect-only runs and runs without results don't count).
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+import pytest
+from _pytest.runner import call_and_report
+
+from .cache import cache_path
+from .runinfo import RUN_ID
+
+# A test is flagged when at least this share of its recent runs failed or
+# needed a rerun, provided it also passed at least once in that window.
+FLAKE_RATE_THRESHOLD = float(os.getenv("E2E_FLAKE_THRESHOLD", "0.2"))
+FLAKE_WINDOW_RUNS = 20
+FLAKE_MIN_RUNS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    args TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    nodeid TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    duration REAL,
+    signature TEXT,
+    message TEXT,
+    recorded_at REAL NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_nodeid ON results(nodeid, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_results_run ON results(run_id);
+"""
+
+_VOLATILE = [
+    (re.compile(r"0x[0-9a-fA-F]+"), "0xH"),
+    (re.compile(r"[0-9a-f]{8,}"), "H"),
+    (re.compile(r"\d+(\.\d+)?"), "N"),
+    (re.compile(r"(https?://[^\s?'\"]+)\?[^\s'\"]*"), r"\1?Q"),
+]
+
+
+def failure_message(report) -> str:
+    crash = getattr(report.longrepr, "reprcrash", None)
+    if crash is not None:
+        return crash.message
+    return str(report.longrepr or "")
+
+
+def failure_signature(message: str) -> str:
+    """Stable hash of a failure message with run-specific noise removed.
+
+    Only the first line counts; numbers, hex IDs and query strings (cache
+    busters, session IDs, timings) are normalised away.
+    """
+    lines = (message or "").strip().splitlines()
+    first_line = lines[0] if lines else ""
+    for pattern, replacement in _VOLATILE:
+        first_line = pattern.sub(replacement, first_line)
+    return hashlib.sha1(first_line.encode()).hexdigest()[:12]
+
+
+class Ledger:
+    """Thin wrapper around the SQLite ledger file."""
+
+    def __init__(self, path: str = None):
+        self.path = path or cache_path("ledger.sqlite3")
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def start_run(self, run_id: str, args: list):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO runs (run_id, started_at, args) VALUES (?, ?, ?)",
+            (run_id, time.time(), json.dumps(args)),
+        )
+        self.conn.commit()
+
+    def record(self, run_id: str, nodeid: str, phase: str, outcome: str,
+               duration: float = None, message: str = None, extra: dict = None):
+        signature = failure_signature(message) if message else None
+        self.conn.execute(
+            "INSERT INTO results (run_id, nodeid, phase, outcome, duration, signature,"
+            " message, recorded_at, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, nodeid, phase, outcome, duration, signature,
+             (message or "")[:2000] or None, time.time(),
+             json.dumps(extra, default=str) if extra else None),
+        )
+        self.conn.commit()
+
+    def run_outcomes(self, nodeid: str, limit: int = FLAKE_WINDOW_RUNS) -> list:
+        """Per-run outcome for a test, newest first: passed, flaky or failed."""
+        rows = self.conn.execute(
+            "SELECT run_id, outcome FROM results WHERE nodeid = ? ORDER BY id",
+            (nodeid,),
+        ).fetchall()
+        runs = {}
+        for run_id, outcome in rows:
+            runs.setdefault(run_id, []).append(outcome)
+        outcomes = []
+        for run_id, attempts in runs.items():
+            final = attempts[-1]
+            if final in ("failed", "error"):
+                outcomes.append("failed")
+            elif final == "passed":
+                outcomes.append("flaky" if "rerun" in attempts else "passed")
+        return list(reversed(outcomes))[:limit]
+
+    def flake_rate(self, nodeid: str):
+        """Share of recent runs that failed or needed a rerun.
+
+        Returns None when there is too little history, and 0.0 for tests
+        that never passed in the window (broken, not flaky).
+        """
+        outcomes = self.run_outcomes(nodeid)
+        if len(outcomes) < FLAKE_MIN_RUNS:
+            return None
+        if not any(o in ("passed", "flaky") for o in outcomes):
+            return 0.0
+        return sum(1 for o in outcomes if o != "passed") / len(outcomes)
+
+    def failed_in_last_run(self, exclude_run: str = None) -> set:
+        """Tests whose final outcome was a failure in the newest run with results."""
+        row = self.conn.execute(
+            "SELECT run_id FROM runs WHERE run_id != ?"
+            " AND EXISTS (SELECT 1 FROM results WHERE results.run_id = runs.run_id)"
+            " ORDER BY started_at DESC LIMIT 1",
+            (exclude_run or "",),
+        ).fetchone()
+        if row is None:
+            return set()
+        rows = self.conn.execute(
+            "SELECT nodeid, outcome FROM results WHERE run_id = ? ORDER BY id", (row[0],)
+        ).fetchall()
+        final = {}
+        for nodeid, outcome in rows:
+            final[nodeid] = outcome
+        return {nodeid for nodeid, outcome in final.items() if outcome in ("failed", "error")}
+
+
+class FlakinessPlugin:
+    """Records outcomes, flags flaky tests and performs warm reruns."""
+
+    def __init__(self, config):
+        self.config = config
+        self.ledger = Ledger()
+        self.reruns = config.getoption("reruns_warm")
+        self.flagged = {}
+
+    def pytest_sessionstart(self, session):
+        if not self.config.option.collectonly:
+            self.ledger.start_run(RUN_ID, list(self.config.invocation_params.args))
+
+    def pytest_collection_modifyitems(self, config, items):
+        if config.getoption("ledger_failed"):
+            failed = self.ledger.failed_in_last_run(exclude_run=RUN_ID)
+            selected = [item for item in items if item.nodeid in failed]
+            deselected = [item for item in items if item.nodeid not in failed]
+            if deselected:
+                config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+
+    def pytest_collection_finish(self, session):
+        for item in session.items:
+            rate = self.ledger.flake_rate(item.nodeid)
+            if rate is not None and rate >= FLAKE_RATE_THRESHOLD:
+                self.flagged[item.nodeid] = rate
+                item.user_properties.append(("flake_rate", round(rate, 2)))
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        if not self.reruns:
+            return None
+
+        item.ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+        for attempt in range(self.reruns + 1):
+            reports, retry = self._attempt(item, nextitem, final=attempt == self.reruns)
+            call = next((report for report in reports if report.when == "call"), None)
+
+            if retry:
+                call.outcome = "rerun"
+                for report in reports:
+                    if report.when != "teardown":
+                        item.ihook.pytest_runtest_logreport(report=report)
+                item._report_sections = []
+                continue
+
+            for report in reports:
+                item.ihook.pytest_runtest_logreport(report=report)
+            break
+        item.ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+        return True
+
+    def _attempt(self, item, nextitem, final: bool):
+        """runtestprotocol, deciding on a retry before the teardown.
+
+        A failed call that will be retried only tears down up to the test's
+        parent: passing the item itself would keep its own fixtures on the
+        setup stack and the retry would run without them. Returns (reports,
+        retry).
+        """
+        if hasattr(item, "_request") and not item._request:
+            item._initrequest()
+        try:
+            reports = [call_and_report(item, "setup", False)]
+            if reports[0].passed and not item.config.getoption("setuponly", False):
+                reports.append(call_and_report(item, "call", False))
+            retry = not final and reports[-1].when == "call" and reports[-1].failed
+            if item.session.shouldfail or item.session.shouldstop:
+                retry, nextitem = False, None
+            reports.append(call_and_report(item, "teardown", False, nextitem=item.parent if retry else nextitem))
+        finally:
+            if hasattr(item, "_request"):
+                item._request = False
+                item.funcargs = None
+        return reports, retry
+
+    def pytest_report_teststatus(self, report):
+        if report.outcome == "rerun":
+            return "rerun", "R", ("RERUN", {"yellow": True})
+        return None
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == "call":
+            outcome = report.outcome
+        elif report.failed:
+            outcome = "error"
+        else:
+            return
+        message = failure_message(report) if outcome in ("failed", "error", "rerun") else None
+        # Tags other plugins put on the test (device health, overlay timing)
+        extra = dict(report.user_properties) if report.when == "call" else None
+        self.ledger.record(RUN_ID, report.nodeid, report.when, outcome, report.duration, message, extra)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.flagged:
+            return
+        terminalreporter.section("historically flaky tests")
+        for nodeid, rate in sorted(self.flagged.items(), key=lambda kv: -kv[1]):
+            terminalreporter.write_line(f"{rate:5.0%}  {nodeid}")
+
+    def pytest_unconfigure(self, config):
+        self.ledger.close()
@@ -0,0 +1,66 @@
+"""Device location helpers.
+
+The proxy decides location-based blocking from the device_locations table,
+so tests move the device by writing that row (set_device_location). The
+phone's own GPS (used by the injected location overlay) can only be set on
+real devices through idevicesetlocation, which iOS 17+ ignores for Safari.
+"""
+import logging
+import subprocess
+import time
+
+from . import kube
+
+# Blocked locations for testing (must match the production database)
+BLOCKED_LOCATIONS = {
+    "social_hub_vienna": {"lat": 48.22286170, "lng": 16.39000710, "name": "The Social Hub Vienna"},
+    "john_harris": {"lat": 48.20184899, "lng": 16.36450324, "name": "John Harris Fitness"},
+    "test_school_sf": {"lat": 37.77490000, "lng": -122.41940000, "name": "Test School"},
+}
+
+# San Francisco - outside every blocked zone of the production policy
+SAFE_LOCATION = (37.7749, -122.4194)
+
+# iPhone SimpleMDM device ID
+IPHONE_DEVICE_ID = "2154382"
+
+
+def get_device_location(device_id: str = IPHONE_DEVICE_ID) -> dict:
+    """Current device location from the database, or None."""
+    result = kube.psql(
+        f"SELECT latitude, longitude FROM device_locations WHERE device_id = '{device_id}';",
+        tuples=True,
+    )
+    if result.returncode == 0 and result.stdout.strip():
+        parts = result.stdout.strip().split("|")
+        if len(parts) == 2:
+            return {"lat": float(parts[0]), "lng": float(parts[1])}
+    return None
+
+
+def set_device_location(lat: float, lng: float, device_id: str = IPHONE_DEVICE_ID) -> bool:
+    """Inject a fake location into the database for testing."""
+    result = kube.psql(
+        f"UPDATE device_locations SET latitude = {lat}, longitude = {lng}, "
+        f"fetched_at = NOW() WHERE device_id = '{device_id}';"
+    )
+    return result.returncode == 0
+
+
+def set_device_gps(udid: str, lat: float, lng: float, settle: float = 3.0) -> bool:
+    """Set GPS on a real iOS device using idevicesetlocation."""
+    try:
+        subprocess.run(
+            ["idevicesetlocation", "-u", udid, str(lat), str(lng)],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        logging.error(f"⚠️  Failed to set device location: {e.stderr.decode()}")
+        return False
+    except FileNotFoundError:
+        logging.warning("⚠️  idevicesetlocation not found - device GPS unchanged")
+        return False
+    logging.info(f"✅ Set device GPS to ({lat}, {lng})")
+    time.sleep(settle)  # Give device time to update location
+    return True
@@ -0,0 +1,271 @@
+"""Continuous synthetic monitor mode.
+
+    pytest e2e_prod/test_verify_vpn.py --monitor --monitor-interval=300
+
+Runs the tests marked ``monitor`` in a loop, keeping session-scoped fixtures
+(the Appium driver) warm between cycles, and serves pass/fail, durations and
+step latencies in Prometheus text format on E2E_MONITOR_PORT (default 9464;
+a free port is used if that one is taken).
+
+The interval is as long as Appium's newCommandTimeout, so drivers handed to
+keep_alive() get a cheap command every KEEPALIVE_S while the loop sleeps.
+A driver whose session is gone anyway (a failed cycle, an Appium restart)
+gets a new session with the same capabilities before the next cycle.
+"""
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from .steps import clear_steps, step_durations
+
+MONITOR_HOST = os.getenv("E2E_MONITOR_HOST", "127.0.0.1")
+MONITOR_PORT = int(os.getenv("E2E_MONITOR_PORT", "9464"))
+
+# Seconds between keepalive commands while waiting for the next cycle
+KEEPALIVE_S = 60
+
+# Upper bounds (seconds) of the step latency histogram buckets
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Wall-clock start of the current cycle; log lookups use it as their window
+CYCLE_STARTED = pytest.StashKey[float]()
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _check_name(nodeid: str) -> str:
+    return nodeid.split("::", 1)[-1]
+
+
+class Metrics:
+    """Thread-safe store rendered in Prometheus text exposition format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.up = {}
+        self.runs = {}
+        self.durations = {}
+        self.last_run = {}
+        self.steps = {}
+        self.cycles = 0
+        self.last_cycle = 0.0
+
+    def observe(self, check: str, passed: bool, duration: float, steps: dict):
+        with self.lock:
+            outcome = "passed" if passed else "failed"
+            self.up[check] = 1 if passed else 0
+            self.runs[(check, outcome)] = self.runs.get((check, outcome), 0) + 1
+            self.durations[check] = duration
+            self.last_run[check] = time.time()
+            for step, seconds in steps.items():
+                hist = self.steps.setdefault(
+                    (check, step), {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+                )
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if seconds <= bound:
+                        hist["buckets"][i] += 1
+                hist["sum"] += seconds
+                hist["count"] += 1
+
+    def cycle_done(self):
+        with self.lock:
+            self.cycles += 1
+            self.last_cycle = time.time()
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [
+                "# HELP hocuspocus_check_up 1 if the last run of the check passed.",
+                "# TYPE hocuspocus_check_up gauge",
+            ]
+            lines += [f'hocuspocus_check_up{{check="{_label(c)}"}} {v}' for c, v in sorted(self.up.items())]
+            lines += [
+                "# HELP hocuspocus_check_runs_total Check runs by outcome.",
+                "# TYPE hocuspocus_check_runs_total counter",
+            ]
+            lines += [
+                f'hocuspocus_check_runs_total{{check="{_label(c)}",outcome="{o}"}} {n}'
+                for (c, o), n in sorted(self.runs.items())
+            ]
+            lines += [
+                "# HELP hocuspocus_check_duration_seconds Duration of the last run of the check.",
+                "# TYPE hocuspocus_check_duration_seconds gauge",
+            ]
+            lines += [
+                f'hocuspocus_check_duration_seconds{{check="{_label(c)}"}} {v:.3f}'
+                for c, v in sorted(self.durations.items())
+            ]
+            lines += [
+                "# HELP hocuspocus_check_last_run_timestamp_seconds When the check last ran.",
+                "# TYPE hocuspocus_check_last_run_timestamp_seconds gauge",
+            ]
+            lines += [
+                f'hocuspocus_check_last_run_timestamp_seconds{{check="{_label(c)}"}} {v:.0f}'
+                for c, v in sorted(self.last_run.items())
+            ]
+            lines += [
+                "# HELP hocuspocus_check_step_seconds Latency of named steps inside a check.",
+                "# TYPE hocuspocus_check_step_seconds histogram",
+            ]
+            for (check, step), hist in sorted(self.steps.items()):
+                labels = f'check="{_label(check)}",step="{_label(step)}"'
+                for bound, count in zip(LATENCY_BUCKETS, hist["buckets"]):
+                    lines.append(f'hocuspocus_check_step_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'hocuspocus_check_step_seconds_bucket{{{labels},le="+Inf"}} {hist["count"]}')
+                lines.append(f'hocuspocus_check_step_seconds_sum{{{labels}}} {hist["sum"]:.3f}')
+                lines.append(f'hocuspocus_check_step_seconds_count{{{labels}}} {hist["count"]}')
+            lines += [
+                "# HELP hocuspocus_monitor_cycles_total Completed monitor cycles.",
+                "# TYPE hocuspocus_monitor_cycles_total counter",
+                f"hocuspocus_monitor_cycles_total {self.cycles}",
+                "# HELP hocuspocus_monitor_last_cycle_timestamp_seconds When the last cycle finished.",
+                "# TYPE hocuspocus_monitor_last_cycle_timestamp_seconds gauge",
+                f"hocuspocus_monitor_last_cycle_timestamp_seconds {self.last_cycle:.0f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def keep_alive(config, driver, capabilities: dict):
+    """Keep ``driver``'s session alive between monitor cycles (no-op outside --monitor)."""
+    plugin = config.pluginmanager.get_plugin("hocuspocus-monitor")
+    if plugin is not None:
+        plugin.drivers.append((driver, capabilities))
+
+
+def _ping(driver) -> bool:
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+
+def serve_metrics(metrics: Metrics, host: str = MONITOR_HOST, port: int = MONITOR_PORT):
+    """Serve /metrics from a daemon thread; returns the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="hocuspocus-metrics", daemon=True).start()
+    return server
+
+
+class MonitorPlugin:
+    """Loops the monitor checks and exports their results."""
+
+    def __init__(self, config):
+        self.config = config
+        self.interval = config.getoption("monitor_interval")
+        self.cycles = config.getoption("monitor_cycles")
+        self.metrics = Metrics()
+        self.server = None
+        self.pending = {}
+        # (driver, capabilities) registered through keep_alive()
+        self.drivers = []
+
+    def pytest_collection_modifyitems(self, config, items):
+        selected = [item for item in items if item.get_closest_marker("monitor")]
+        deselected = [item for item in items if not item.get_closest_marker("monitor")]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+
+    def pytest_sessionstart(self, session):
+        try:
+            self.server = serve_metrics(self.metrics)
+        except OSError as e:
+            logging.warning(f"⚠️  Metrics port {MONITOR_PORT} unavailable ({e}), using a free port")
+            self.server = serve_metrics(self.metrics, port=0)
+        host, port = self.server.server_address[:2]
+        logging.info(f"📈 Monitor metrics on http://{host}:{port}/metrics")
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if session.testsfailed and not session.config.option.continue_on_collection_errors:
+            raise session.Interrupted(f"{session.testsfailed} errors during collection")
+        if session.config.option.collectonly or not session.items:
+            return True
+
+        items = session.items
+        cycle = 0
+        while True:
+            cycle += 1
+            last_cycle = bool(self.cycles) and cycle >= self.cycles
+            started = time.time()
+            session.config.stash[CYCLE_STARTED] = started
+            logging.info(f"🔁 Monitor cycle {cycle}")
+            for i, item in enumerate(items):
+                # Wrapping around to the first item keeps session- and
+                # module-scoped fixtures (the warm driver) alive.
+                if i + 1 < len(items):
+                    nextitem = items[i + 1]
+                else:
+                    nextitem = None if last_cycle else items[0]
+                clear_steps(item)
+                item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+                if session.shouldfail:
+                    raise session.Failed(session.shouldfail)
+                if session.shouldstop:
+                    raise session.Interrupted(session.shouldstop)
+            self.metrics.cycle_done()
+            if last_cycle:
+                return True
+            self._wait(started + self.interval)
+            self._revive()
+
+    def _wait(self, until: float):
+        """Sleep until ``until``, keeping the registered sessions busy."""
+        while True:
+            remaining = until - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(KEEPALIVE_S, remaining))
+            for driver, _ in self.drivers:
+                _ping(driver)
+
+    def _revive(self):
+        for driver, capabilities in self.drivers:
+            if _ping(driver):
+                continue
+            logging.warning("🔌 Monitor driver session is gone - starting a new one")
+            try:
+                driver.start_session(capabilities)
+            except Exception as e:
+                logging.error(f"❌ Could not start a new session: {e}")
+
+    def pytest_runtest_logreport(self, report):
+        # A check's duration covers setup, call and teardown; it is down if
+        # any phase failed (skips count as up).
+        check = _check_name(report.nodeid)
+        entry = self.pending.setdefault(check, {"duration": 0.0, "passed": True, "steps": {}})
+        entry["duration"] += report.duration
+        if report.failed:
+            entry["passed"] = False
+        if report.when == "call":
+            entry["steps"] = step_durations(report)
+        if report.when == "teardown":
+            self.pending.pop(check)
+            self.metrics.observe(check, entry["passed"], entry["duration"], entry["steps"])
+
+    def pytest_unconfigure(self, config):
+        if self.server is not None:
+            self.server.shutdown()
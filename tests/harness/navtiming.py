@@ -0,0 +1,211 @@
+"""Navigation Timing capture: what page loads cost as seen by Safari.
+
+After every ``get`` the driver middleware reads the navigation entry and all
+resource entries of the new document in one script call and appends them to
+``nav_timing.jsonl`` with the test that navigated. Per phase (DNS, connect,
+TLS, TTFB, transfer) the report aggregates them by host across runs, which
+puts numbers on the proxy's TLS interception and filtering overhead.
+
+Cross-origin resources only expose their phase timings when the server sends
+Timing-Allow-Origin; without it the phases read 0 and only the total
+duration is used.
+
+Disable with E2E_NAV_TIMING=0.
+
+Report:
+    python -m tests.harness.navtiming [--since-days N] [--host SUBSTRING]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+from .cache import cache_path
+from .driver_hooks import add_command_middleware
+from .http_tier import DEVICE_FIXTURES
+from .runinfo import RUN_ID
+from .stats import summarize
+
+ENABLED = os.getenv("E2E_NAV_TIMING", "1").lower() not in ("0", "false", "no")
+
+PHASES = ("dns", "connect", "tls", "ttfb", "transfer", "total")
+
+# Phases (ms) of the navigation entry and every resource entry, computed in
+# the page so only numbers cross the wire
+CAPTURE_SCRIPT = """
+function phases(e) {
+    return {
+        dns: e.domainLookupEnd - e.domainLookupStart,
+        connect: e.connectEnd - e.connectStart,
+        tls: e.secureConnectionStart > 0 ? e.connectEnd - e.secureConnectionStart : 0,
+        ttfb: e.requestStart > 0 ? e.responseStart - e.requestStart : 0,
+        transfer: e.responseStart > 0 ? e.responseEnd - e.responseStart : 0,
+        total: e.duration,
+        start: e.startTime,
+        transfer_size: e.transferSize || 0,
+        body_size: e.encodedBodySize || 0,
+        status: e.responseStatus || null,
+        protocol: e.nextHopProtocol || null
+    };
+}
+var nav = performance.getEntriesByType('navigation')[0];
+if (!nav) return null;
+var result = phases(nav);
+result.url = nav.name;
+result.time_origin = performance.timeOrigin;
+result.dom_content_loaded = nav.domContentLoadedEventEnd;
+result.load = nav.loadEventEnd;
+result.resources = performance.getEntriesByType('resource').map(function (e) {
+    var r = phases(e);
+    r.url = e.name;
+    r.initiator = e.initiatorType;
+    return r;
+});
+return result;
+"""
+
+
+def _nav_timing_path() -> str:
+    return cache_path("nav_timing.jsonl")
+
+
+def host_of(url: str) -> str:
+    return (urlsplit(url or "").hostname or "").lower()
+
+
+def _round(entry: dict) -> dict:
+    return {k: round(v, 1) if isinstance(v, float) else v for k, v in entry.items()}
+
+
+class NavTimingRecorder:
+    """Driver middleware that captures Navigation/Resource Timing after ``get``."""
+
+    def __init__(self, path: str = None):
+        self.path = path or _nav_timing_path()
+        self.nodeid = None
+
+    def attach(self, driver):
+        if not getattr(driver, "_hp_nav_timing", None):
+            add_command_middleware(driver, lambda *args: self._after_get(driver, *args))
+            driver._hp_nav_timing = self
+        return driver._hp_nav_timing
+
+    def _after_get(self, driver, call_next, command, params):
+        response = call_next(command, params)
+        if command == "get" and params and self.nodeid:
+            try:
+                timing = driver.execute_script(CAPTURE_SCRIPT)
+            except Exception as e:
+                logging.debug(f"Navigation timing not captured: {e}")
+            else:
+                if timing:
+                    self.store(params.get("url"), timing)
+        return response
+
+    def store(self, requested_url: str, timing: dict):
+        resources = [_round(r) for r in timing.pop("resources", None) or []]
+        entry = {
+            "run_id": RUN_ID,
+            "test": self.nodeid,
+            "requested_url": requested_url,
+            "host": host_of(timing.get("url")),
+            "captured_at": round(time.time(), 3),
+            **_round(timing),
+            "resources": resources,
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        logging.info(
+            f"📶 {entry['host']}: ttfb {entry['ttfb']:.0f} ms, tls {entry['tls']:.0f} ms, "
+            f"load {entry.get('load') or 0:.0f} ms, {len(resources)} resource(s)"
+        )
+
+
+class NavTimingPlugin:
+    """Points the recorder of each test's driver at the running test."""
+
+    def __init__(self, path: str = None):
+        self.recorder = NavTimingRecorder(path)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        funcargs = getattr(item, "funcargs", {})
+        for name in DEVICE_FIXTURES:
+            if name in funcargs:
+                self.recorder.attach(funcargs[name])
+        self.recorder.nodeid = item.nodeid
+        try:
+            yield
+        finally:
+            self.recorder.nodeid = None
+
+
+def load_entries(path: str = None, since: float = 0.0) -> list:
+    entries = []
+    try:
+        with open(path or _nav_timing_path()) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("captured_at", 0) >= since:
+                    entries.append(entry)
+    except OSError:
+        pass
+    return entries
+
+
+def _samples(entries: list, host_filter: str = None) -> dict:
+    """{(kind, host): {phase: [ms, ...]}} for navigations and resources."""
+    samples = {}
+
+    def add(kind, host, timing):
+        if host_filter and host_filter not in host:
+            return
+        phases = samples.setdefault((kind, host), {phase: [] for phase in PHASES})
+        # Zero phases without Timing-Allow-Origin are unknown, not fast
+        exposed = timing.get("ttfb", 0) > 0
+        for phase in PHASES:
+            if phase == "total" or exposed:
+                phases[phase].append(timing.get(phase) or 0.0)
+
+    for entry in entries:
+        add("navigation", entry.get("host", ""), entry)
+        for resource in entry.get("resources", []):
+            add("resource", host_of(resource.get("url")), resource)
+    return samples
+
+
+def report(entries: list, host_filter: str = None) -> str:
+    samples = _samples(entries, host_filter)
+    if not samples:
+        return "No navigation timing samples recorded yet."
+
+    header = f"{'kind':<10} {'host':<36} {'n':>5} " + " ".join(f"{phase:>11}" for phase in PHASES)
+    lines = ["p50/p95 in ms per phase", header]
+    ordered = sorted(samples.items(), key=lambda kv: (kv[0][0], -len(kv[1]["total"]), kv[0][1]))
+    for (kind, host), phases in ordered:
+        cells = []
+        for phase in PHASES:
+            s = summarize(phases[phase])
+            cell = f"{s['p50']:.0f}/{s['p95']:.0f}" if s["count"] else "-"
+            cells.append(f"{cell:>11}")
+        lines.append(f"{kind:<10} {host[:36]:<36} {len(phases['total']):>5} " + " ".join(cells))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Navigation/resource timing per host")
+    parser.add_argument("--since-days", type=float, default=30.0)
+    parser.add_argument("--host", default=None, help="Only hosts containing this string")
+    args = parser.parse_args(argv)
+    print(report(load_entries(since=time.time() - args.since_days * 86400), args.host))
+
+
+if __name__ == "__main__":
+    main()
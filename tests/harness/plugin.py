@@ -0,0 +1,175 @@
+"""The hocuspocus pytest plugin: options, markers and hooks shared by the
+E2E (test DB) and production verification suites.
+
+Loaded from tests/conftest.py via ``pytest_plugins``. Imports stay light -
+the Appium client is only imported by harness/device.py when a driver is
+created.
+"""
+import logging
+import os
+
+import pytest
+
+from . import agent, budgets, devicehealth, failure_artifacts, har, navtiming, roundtrips, scheduler, watchdog
+from . import appium_server as appium
+from .http_tier import HttpTierClient, HttpTierPlugin, HttpTierResults, resolve_proxy
+from .ledger import FlakinessPlugin
+from .monitor import MonitorPlugin
+from .policy import PolicyImpactPlugin
+
+SCHEDULE_SUMMARY = pytest.StashKey[str]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("hocuspocus", "hocuspocus E2E harness")
+    group.addoption(
+        "--no-schedule",
+        action="store_true",
+        default=False,
+        help="Run tests in file order instead of the cost-model schedule.",
+    )
+    group.addoption(
+        "--reruns-warm",
+        type=int,
+        default=int(os.getenv("E2E_RERUNS_WARM", "0")),
+        help="Retry a failing test up to N times inside the same Appium session.",
+    )
+    group.addoption(
+        "--ledger-failed",
+        action="store_true",
+        default=False,
+        help="Run only the tests that failed in the previous run (from the ledger).",
+    )
+    group.addoption(
+        "--no-ledger",
+        action="store_true",
+        default=False,
+        help="Don't record outcomes in the flakiness ledger.",
+    )
+    group.addoption(
+        "--policy-impact",
+        action="store_true",
+        default=False,
+        help="Run only tests whose policy dependencies changed since the last passing run.",
+    )
+    group.addoption(
+        "--tier",
+        choices=("device", "http"),
+        default="device",
+        help="'http' runs only http_tier-eligible checks, through the proxy without the device.",
+    )
+    group.addoption(
+        "--monitor",
+        action="store_true",
+        default=False,
+        help="Loop the tests marked 'monitor' and serve Prometheus metrics (E2E_MONITOR_PORT).",
+    )
+    group.addoption(
+        "--monitor-interval",
+        type=float,
+        default=float(os.getenv("E2E_MONITOR_INTERVAL", "300")),
+        help="Seconds between the starts of two monitor cycles.",
+    )
+    group.addoption(
+        "--monitor-cycles",
+        type=int,
+        default=0,
+        help="Stop after N monitor cycles (0 = run until interrupted).",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "device_state(location=None, consent=False): setup state a test needs "
+        "(fake location name, primed YouTube consent); used by the scheduler",
+    )
+    config.addinivalue_line(
+        "markers",
+        "policy(allowed_hosts=..., youtube_channels=..., blocked_locations=..., "
+        "blocked_location_whitelist=...): policy entities a test depends on "
+        "(list, or True for the whole table); used by --policy-impact",
+    )
+    config.addinivalue_line(
+        "markers",
+        "monitor: quick check that --monitor runs on a schedule",
+    )
+    config.addinivalue_line(
+        "markers",
+        "http_tier(url=None, expect='allowed'|'blocked'): check can run device-free with "
+        "--tier=http (without url: the test itself is device-free)",
+    )
+    if config.getoption("tier") == "http":
+        config.pluginmanager.register(HttpTierPlugin(config), "hocuspocus-http-tier")
+    if config.getoption("monitor"):
+        config.pluginmanager.register(MonitorPlugin(config), "hocuspocus-monitor")
+    config.pluginmanager.register(
+        PolicyImpactPlugin(config, select=config.getoption("policy_impact")), "hocuspocus-policy-impact"
+    )
+    if not config.getoption("no_ledger"):
+        config.pluginmanager.register(FlakinessPlugin(config), "hocuspocus-ledger")
+    config.pluginmanager.register(failure_artifacts.FailureArtifactPlugin(), "hocuspocus-failure-artifacts")
+    config.pluginmanager.register(roundtrips.RoundTripPlugin(), "hocuspocus-round-trips")
+    if watchdog.ENABLED:
+        config.pluginmanager.register(watchdog.WatchdogPlugin(), "hocuspocus-wda-watchdog")
+    if budgets.ENABLED:
+        config.pluginmanager.register(budgets.BudgetPlugin(), "hocuspocus-budgets")
+    health_backend = devicehealth.make_backend()
+    if health_backend is not None:
+        config.pluginmanager.register(
+            devicehealth.DeviceHealthPlugin(health_backend), "hocuspocus-device-health"
+        )
+    if navtiming.ENABLED:
+        config.pluginmanager.register(navtiming.NavTimingPlugin(), "hocuspocus-nav-timing")
+        if har.ENABLED:
+            config.pluginmanager.register(har.HarExportPlugin(), "hocuspocus-har")
+
+
+@pytest.fixture(scope="session")
+def appium_server():
+    """The Appium server of this run (None when an external one is used).
+
+    Started on a free port and restarted if it crashes; see appium_server.py.
+    Inside the test agent the agent's resident server is used.
+    """
+    supervisor = agent.appium_supervisor()
+    owned = supervisor is None and appium.MODE == "managed"
+    if owned and appium.unmanaged_running():
+        logging.info(f"🔌 Using the Appium already running at {appium.current_url()}")
+        owned = False
+    if owned:
+        try:
+            supervisor = appium.AppiumSupervisor().start()
+        except Exception as e:
+            pytest.exit(f"Could not start Appium: {e}")
+    elif supervisor is None and not appium.status_ok(appium.current_url(), timeout=5):
+        pytest.exit(f"Appium server is not running at {appium.current_url()}! Start it with: appium")
+    appium.activate(supervisor)
+    yield supervisor
+    appium.activate(None)
+    if owned:
+        supervisor.stop()
+
+
+@pytest.fixture(scope="session")
+def http_tier_results(request):
+    """Lazily computed results of the --tier=http checks."""
+    client = HttpTierClient(resolve_proxy())
+    yield HttpTierResults(request.session, client)
+    client.close()
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(session, config, items):
+    """Reorder the suite to minimise expensive setup transitions."""
+    if config.getoption("no_schedule") or len(items) < 2:
+        return
+    ordered, planned, baseline = scheduler.schedule(items)
+    items[:] = ordered
+    config.stash[SCHEDULE_SUMMARY] = (
+        f"scheduler: estimated setup cost {planned:.0f}s (file order: {baseline:.0f}s)"
+    )
+
+
+def pytest_report_collectionfinish(config, items):
+    return config.stash.get(SCHEDULE_SUMMARY, None)
@@ -0,0 +1,223 @@
+"""Policy-aware test impact selection.
+
+Tests declare which policy tables and entities they depend on:
+
+    @pytest.mark.policy(allowed_hosts=["youtube.com"],
+                        youtube_channels=["UCzQUP1qoWDoEbmsQxvdjxgQ"])
+
+Values are lists of entities (domains, channel IDs, blocked location names)
+or True for "any row in this table". Each suite registers a snapshot source
+for its policy (the seed spec for e2e, the production tables for e2e_prod).
+With --policy-impact the current snapshot is diffed against the stored one,
+and only tests touching a changed entity run. Tests without a policy marker
+always run. The stored snapshot advances after any run, with or without
+--policy-impact, in which every policy-dependent test of that suite (every
+impacted one with --policy-impact) ran and passed - not after -k/-m subsets,
+failures or --co - so a change is never dropped from the diff untested.
+"""
+import json
+import logging
+import os
+
+import pytest
+
+from .cache import cache_path
+
+POLICY_TABLES = (
+    "allowed_hosts",
+    "youtube_channels",
+    "blocked_locations",
+    "blocked_location_whitelist",
+)
+
+# Tables keyed by domain; entities match by host suffix in either direction
+# (an allowed_hosts change to google.com affects a test on accounts.google.com
+# and vice versa).
+HOST_TABLES = ("allowed_hosts", "blocked_location_whitelist")
+
+POLICY_SUMMARY = pytest.StashKey[list]()
+
+# directory -> (source name, loader returning a snapshot)
+_SOURCES = {}
+
+
+def register_source(directory: str, name: str, loader):
+    """Register the policy snapshot loader for tests under ``directory``."""
+    _SOURCES[os.path.abspath(directory)] = (name, loader)
+
+
+def source_for(item):
+    """Return (name, loader) for the suite an item belongs to, or None."""
+    path = os.path.abspath(str(item.path))
+    best = None
+    for directory, source in _SOURCES.items():
+        if path.startswith(directory + os.sep) and (best is None or len(directory) > len(best[0])):
+            best = (directory, source)
+    return best[1] if best else None
+
+
+def snapshot_from_rows(rows) -> dict:
+    """Build a snapshot from (table, key, value) rows.
+
+    A key may appear more than once (a domain whitelisted at several
+    locations); its values are kept as a sorted list. Keys are lower-cased,
+    except channel IDs, which are case-sensitive.
+    """
+    snapshot = {table: {} for table in POLICY_TABLES}
+    for table, key, value in rows:
+        key = str(key) if table == "youtube_channels" else str(key).lower()
+        snapshot.setdefault(table, {}).setdefault(key, []).append(str(value))
+    for entries in snapshot.values():
+        for values in entries.values():
+            values.sort()
+    return snapshot
+
+
+def _snapshot_path(name: str) -> str:
+    return cache_path(f"policy_snapshot_{name}.json")
+
+
+def load_snapshot(name: str):
+    try:
+        with open(_snapshot_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_snapshot(name: str, snapshot: dict):
+    with open(_snapshot_path(name), "w") as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True)
+
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    """Return {table: {changed keys}} for added, removed or modified rows."""
+    changed = {}
+    for table in set(old) | set(new):
+        before, after = old.get(table, {}), new.get(table, {})
+        keys = {k for k in set(before) | set(after) if before.get(k) != after.get(k)}
+        if keys:
+            changed[table] = keys
+    return changed
+
+
+def _host_match(a: str, b: str) -> bool:
+    a, b = a.lower(), b.lower()
+    return a == b or a.endswith("." + b) or b.endswith("." + a)
+
+
+def is_affected(item, changed: dict) -> bool:
+    """Whether a test's declared policy dependencies intersect ``changed``."""
+    marker = item.get_closest_marker("policy")
+    if marker is None:
+        return True
+    for table, deps in marker.kwargs.items():
+        keys = changed.get(table)
+        if not keys:
+            continue
+        if deps is True:
+            return True
+        match = _host_match if table in HOST_TABLES else (lambda a, b: a.lower() == b.lower())
+        if any(match(dep, key) for dep in deps for key in keys):
+            return True
+    return False
+
+
+class PolicyImpactPlugin:
+    """Advances the stored snapshots; with ``select``, deselects the tests
+    whose policy dependencies did not change."""
+
+    def __init__(self, config, select: bool = True):
+        self.config = config
+        self.select = select
+        self.pending = {}
+        # source name -> (loader, nodeids of the tests that must pass)
+        self.required = {}
+        self.passed = set()
+        self.failed = set()
+
+    def _current(self, name, loader):
+        try:
+            return loader()
+        except Exception as e:
+            logging.warning(f"Could not load {name} policy snapshot, running all its tests: {e}")
+            return None
+
+    # Before -k/-m/--deselect, so the impacted set is the full one
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, config, items):
+        changes = {}
+        selected, deselected = [], []
+        for item in items:
+            source = source_for(item)
+            if source is None or item.get_closest_marker("policy") is None:
+                selected.append(item)
+                continue
+            name, loader = source
+            if not self.select:
+                self.required.setdefault(name, (loader, set()))[1].add(item.nodeid)
+                selected.append(item)
+                continue
+            if name not in changes:
+                current = self._current(name, loader)
+                previous = load_snapshot(name)
+                if current is not None:
+                    self.pending[name] = current
+                changes[name] = (
+                    diff_snapshots(previous, current)
+                    if current is not None and previous is not None else None
+                )
+            changed = changes[name]
+            if changed is None or is_affected(item, changed):
+                selected.append(item)
+                self.required.setdefault(name, (loader, set()))[1].add(item.nodeid)
+            else:
+                deselected.append(item)
+
+        for name, changed in changes.items():
+            if changed is None:
+                self.config.stash.setdefault(POLICY_SUMMARY, []).append(
+                    f"policy-impact: no {name} baseline to diff against, running all {name} tests")
+            else:
+                summary = ", ".join(f"{t} ({len(k)})" for t, k in sorted(changed.items())) or "nothing"
+                self.config.stash.setdefault(POLICY_SUMMARY, []).append(
+                    f"policy-impact: {name} changed: {summary}")
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+
+    def pytest_collection_finish(self, session):
+        if self.select or session.config.option.collectonly:
+            return
+        # Only a run of the whole suite can become its baseline, so the
+        # snapshot isn't read for subsets
+        selected = {item.nodeid for item in session.items}
+        for name, (loader, nodeids) in self.required.items():
+            if nodeids <= selected:
+                current = self._current(name, loader)
+                if current is not None:
+                    self.pending[name] = current
+
+    def pytest_report_collectionfinish(self, config, items):
+        return config.stash.get(POLICY_SUMMARY, None)
+
+    def pytest_runtest_logreport(self, report):
+        if report.failed:
+            self.failed.add(report.nodeid)
+        elif report.when == "call" and report.passed:
+            self.passed.add(report.nodeid)
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        if session.config.option.collectonly:
+            return
+        # After a failure (or a skip) the same changes must be tested again
+        verified = self.passed - self.failed
+        for name, snapshot in self.pending.items():
+            missing = self.required.get(name, (None, set()))[1] - verified
+            if missing:
+                logging.info(
+                    f"policy-impact: {len(missing)} {name} policy test(s) didn't run or pass, "
+                    f"keeping the old baseline"
+                )
+                continue
+            save_snapshot(name, snapshot)
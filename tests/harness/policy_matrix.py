@@ -0,0 +1,127 @@
+"""Policy coverage matrix generated from the policy tables.
+
+build_matrix() turns a policy snapshot (see harness/policy.py) into
+checks:
+
+  - every enabled allowed host, and its www. subdomain, is allowed
+  - a look-alike of every allowed host (prefix without a dot) is blocked;
+    these hosts usually don't exist, so when the proxy only gets as far as
+    a failed DNS lookup the case is skipped rather than judged
+  - a sample of well-known non-allowed hosts is blocked
+  - every enabled YouTube channel page is allowed
+  - at every blocked location, each per-location whitelist domain is
+    allowed where it is whitelisted and blocked elsewhere
+
+Host checks run on the device-free HTTP tier. Channel and location checks
+are device-tier cases: the proxy judges channels from the page the phone
+loads and gates locations on the phone's own position, so they run in
+Safari with the device moved to the location.
+"""
+import os
+import random
+from dataclasses import dataclass
+
+# Candidates for the "not allowed" sample; any that an allowed host covers
+# are dropped.
+NON_ALLOWED_POOL = (
+    "reddit.com",
+    "twitter.com",
+    "facebook.com",
+    "instagram.com",
+    "tiktok.com",
+    "netflix.com",
+    "twitch.tv",
+    "cnn.com",
+    "espn.com",
+    "pinterest.com",
+    "tumblr.com",
+    "9gag.com",
+    "imgur.com",
+    "discord.com",
+    "snapchat.com",
+    "linkedin.com",
+)
+
+SAMPLE_SIZE = int(os.getenv("E2E_MATRIX_SAMPLE", "8"))
+
+LOOKALIKE_PREFIX = "hpmatrix"
+
+
+@dataclass(frozen=True)
+class MatrixCase:
+    id: str
+    url: str
+    expect: str  # "allowed" or "blocked"
+    tier: str = "http"  # "http" or "device"
+    location: str = None  # blocked location name, None = device's real location
+
+
+class MatrixUnavailable(str):
+    """Stand-in case when the matrix couldn't be generated; the text says why."""
+
+
+def _enabled(value: str) -> bool:
+    return value.rsplit(",", 1)[-1].strip().lower() in ("true", "t")
+
+
+def _covered(host: str, allowed: list) -> bool:
+    return any(host == a or host.endswith("." + a) for a in allowed)
+
+
+def parse_location(value: str):
+    """(lat, lng) from a blocked_locations snapshot value."""
+    lat, lng = value.split(",")[:2]
+    return float(lat), float(lng)
+
+
+def build_matrix(snapshot: dict, sample: int = SAMPLE_SIZE, seed=None) -> list:
+    allowed = sorted(
+        host for host, values in snapshot.get("allowed_hosts", {}).items()
+        if any(_enabled(v) for v in values)
+    )
+    cases = []
+    for host in allowed:
+        cases.append(MatrixCase(f"allowed:{host}", f"https://{host}/", "allowed"))
+        if not host.startswith("www."):
+            cases.append(MatrixCase(f"allowed:www.{host}", f"https://www.{host}/", "allowed"))
+        lookalike = f"{LOOKALIKE_PREFIX}{host}"
+        cases.append(MatrixCase(f"lookalike:{lookalike}", f"https://{lookalike}/", "blocked"))
+
+    pool = [host for host in NON_ALLOWED_POOL if not _covered(host, allowed)]
+    rng = random.Random(seed)
+    for host in sorted(rng.sample(pool, min(sample, len(pool)))):
+        cases.append(MatrixCase(f"blocked:{host}", f"https://{host}/", "blocked"))
+
+    channels = sorted(
+        channel for channel, values in snapshot.get("youtube_channels", {}).items()
+        if any(_enabled(v) for v in values)
+    )
+    for channel in channels:
+        cases.append(MatrixCase(
+            f"channel:{channel}", f"https://m.youtube.com/channel/{channel}", "allowed", "device",
+        ))
+
+    locations = sorted(
+        name for name, values in snapshot.get("blocked_locations", {}).items()
+        if any(_enabled(v) for v in values)
+    )
+    whitelist = {}
+    for domain, values in snapshot.get("blocked_location_whitelist", {}).items():
+        for value in values:
+            if _enabled(value):
+                whitelist.setdefault(domain, set()).add(value.rsplit(",", 1)[0].lower())
+    for location in locations:
+        for domain in sorted(whitelist):
+            listed = location in whitelist[domain]
+            if not listed and _covered(domain, allowed):
+                # Global whitelist vs location rules is proxy policy, not
+                # something this matrix should guess.
+                continue
+            cases.append(MatrixCase(
+                f"{location}:{domain}",
+                f"https://{domain}/",
+                "allowed" if listed else "blocked",
+                "device",
+                location,
+            ))
+    return cases
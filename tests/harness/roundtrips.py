@@ -0,0 +1,173 @@
+"""Appium round-trip profiling and command coalescing.
+
+On a real device every WebDriver command is an HTTP round trip to Appium
+and from there to WDA, so a helper's cost is mostly the number of commands
+it sends, not what they do.
+
+The profiler is driver middleware (attached in device.create_driver) that
+counts and times every command per test, fixture setup and teardown
+included. Each test's totals go on its report as the ``round_trips`` user
+property, and the tests sending the most commands are listed under
+"Appium round trips" in the summary.
+
+find_visible() is the coalescing side: find_element, is_displayed, .text and
+click folded into one executeScript. The click is a DOM ``el.click()`` on
+the element scrolled into view, which is what the helpers' buttons need;
+locators that only exist in the native hierarchy (accessibility id,
+XCUIElementType XPaths) can't be evaluated in the page and fall back to the
+separate commands.
+"""
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from .driver_hooks import add_command_middleware
+
+# Tests listed in the summary
+SUMMARY_TESTS = 10
+
+# Locators the page script can evaluate (device.By values)
+WEB_LOCATORS = ("id", "xpath", "css selector", "name", "tag name", "class name")
+
+FIND_VISIBLE_SCRIPT = """
+var by = arguments[0], value = arguments[1], click = arguments[2];
+var el = null;
+if (by === 'id') {
+    el = document.getElementById(value);
+} else if (by === 'xpath') {
+    el = document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+} else if (by === 'css selector') {
+    el = document.querySelector(value);
+} else if (by === 'name') {
+    el = document.getElementsByName(value)[0] || null;
+} else if (by === 'tag name') {
+    el = document.getElementsByTagName(value)[0] || null;
+} else if (by === 'class name') {
+    el = document.getElementsByClassName(value)[0] || null;
+}
+if (!el) return {found: false};
+var rect = el.getBoundingClientRect();
+var style = window.getComputedStyle(el);
+var displayed = rect.width > 0 && rect.height > 0 &&
+    style.visibility !== 'hidden' && style.display !== 'none' && style.opacity !== '0';
+var result = {found: true, displayed: displayed, text: displayed ? (el.innerText || '').trim() : ''};
+if (click && displayed) {
+    el.scrollIntoView({block: 'center'});
+    el.click();
+    result.clicked = true;
+}
+return result;
+"""
+
+
+@dataclass
+class ElementState:
+    found: bool
+    displayed: bool = False
+    text: str = ""
+    clicked: bool = False
+
+
+def _native(by: str, value: str) -> bool:
+    return by not in WEB_LOCATORS or (by == "xpath" and "XCUIElementType" in value)
+
+
+def find_visible(driver, by: str, value: str, click: bool = False) -> ElementState:
+    """First element matching the locator: displayed? its text; clicked if ``click``.
+
+    One round trip for web locators. Unlike find_element, a missing element
+    is a ``found=False`` state rather than an exception.
+    """
+    if _native(by, value):
+        elements = driver.find_elements(by, value)
+        if not elements:
+            return ElementState(found=False)
+        element = elements[0]
+        if not element.is_displayed():
+            return ElementState(found=True)
+        if click:
+            element.click()
+            return ElementState(found=True, displayed=True, clicked=True)
+        return ElementState(found=True, displayed=True, text=element.text)
+    result = driver.execute_script(FIND_VISIBLE_SCRIPT, by, value, click) or {}
+    return ElementState(
+        found=bool(result.get("found")),
+        displayed=bool(result.get("displayed")),
+        text=result.get("text") or "",
+        clicked=bool(result.get("clicked")),
+    )
+
+
+class RoundTripProfiler:
+    """Counts and times driver commands per test."""
+
+    current_nodeid = None
+
+    def __init__(self):
+        # nodeid -> command -> [count, seconds]
+        self.per_test = {}
+
+    def __call__(self, call_next, command, params):
+        started = time.perf_counter()
+        try:
+            return call_next(command, params)
+        finally:
+            self.record(command, time.perf_counter() - started)
+
+    def record(self, command: str, seconds: float):
+        commands = self.per_test.setdefault(RoundTripProfiler.current_nodeid, {})
+        entry = commands.setdefault(command, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def totals(self, nodeid) -> dict:
+        commands = self.per_test.get(nodeid, {})
+        return {
+            "count": sum(count for count, _ in commands.values()),
+            "ms": round(sum(seconds for _, seconds in commands.values()) * 1000, 1),
+        }
+
+
+PROFILER = RoundTripProfiler()
+
+
+def attach(driver):
+    """Install the profiler on ``driver`` (once)."""
+    if not getattr(driver, "_hp_round_trips", False):
+        add_command_middleware(driver, PROFILER)
+        driver._hp_round_trips = True
+    return driver
+
+
+class RoundTripPlugin:
+    """Attributes commands to the running test and reports the counts."""
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item):
+        RoundTripProfiler.current_nodeid = item.nodeid
+        try:
+            yield
+        finally:
+            RoundTripProfiler.current_nodeid = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        if report.when == "call" and item.nodeid in PROFILER.per_test:
+            report.user_properties.append(("round_trips", PROFILER.totals(item.nodeid)))
+
+    def pytest_terminal_summary(self, terminalreporter):
+        tests = [nodeid for nodeid in PROFILER.per_test if nodeid is not None]
+        if not tests:
+            return
+        terminalreporter.section("Appium round trips")
+        tests.sort(key=lambda nodeid: PROFILER.totals(nodeid)["count"], reverse=True)
+        for nodeid in tests[:SUMMARY_TESTS]:
+            totals = PROFILER.totals(nodeid)
+            commands = sorted(PROFILER.per_test[nodeid].items(), key=lambda kv: kv[1][0], reverse=True)
+            top = ", ".join(f"{command} {count}" for command, (count, _) in commands[:3])
+            terminalreporter.write_line(
+                f"{totals['count']:5d} commands {totals['ms'] / 1000:6.1f}s  {nodeid} ({top})"
+            )
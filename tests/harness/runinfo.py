@@ -0,0 +1,9 @@
+"""Identity of the current test run.
+
+One ID per pytest process, shared by the log marker, the flakiness ledger
+and any artifacts written during the run. Set E2E_RUN_ID to pin it.
+"""
+import os
+import uuid
+
+RUN_ID = os.getenv("E2E_RUN_ID") or uuid.uuid4().hex[:12]
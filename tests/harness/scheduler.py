@@ -0,0 +1,300 @@
+"""Collection-time test scheduler driven by measured setup-transition costs.
+
+Each test needs some expensive prerequisites: which Appium session
+(autoAcceptAlerts on/off) it runs in, where the device is "located", and
+whether YouTube consent cookies are primed.
+The scheduler gives every test a state vector over those dimensions and
+orders the suite so the total cost of moving between states is minimal,
+using costs measured on previous runs.
+
+The database is not one of those dimensions: seed_test_database is
+session-scoped, so once a test-DB test has run the proxy stays on the test
+database until the session ends. The database splits the suite into two
+fixed partitions instead, everything else first and the test-DB tests
+last, and each partition is ordered on its own.
+
+Tests that share a class-scoped driver are kept together: pytest tears the
+driver down as soon as the next test lives in another class.
+"""
+import itertools
+import json
+import time
+from collections import namedtuple
+
+import pytest
+
+from .cache import cache_path
+
+# Dimensions of the state vector, in order. None means "doesn't care";
+# tests without a location need the device's real location.
+DIMENSIONS = ("session", "location", "consent")
+
+# Which cost applies when a dimension changes
+DIMENSION_COSTS = {
+    "session": "session_create",
+    "location": "location_move",
+    "consent": "consent_prime",
+}
+
+# Seconds, used until a transition has been measured
+DEFAULT_COSTS = {
+    "session_create": 45.0,
+    "location_move": 3.0,
+    "consent_prime": 4.0,
+}
+
+# No session yet, the device at its real location
+START_STATE = {"session": None, "location": "real", "consent": False}
+
+# Weight of the newest measurement in the running average
+EWMA_ALPHA = 0.3
+
+# Exact ordering (Held-Karp) up to this many blocks, greedy beyond
+EXACT_LIMIT = 10
+
+DRIVER_FIXTURES = ("ios_driver", "driver")
+
+# "db" is the partition ("test" or None/"prod"), not a cost dimension
+State = namedtuple("State", ("db",) + DIMENSIONS)
+
+
+def _costs_path() -> str:
+    return cache_path("transition_costs.json")
+
+
+def load_costs() -> dict:
+    costs = dict(DEFAULT_COSTS)
+    try:
+        with open(_costs_path()) as f:
+            measured = json.load(f)
+    except (OSError, ValueError):
+        return costs
+    for kind, entry in measured.items():
+        costs[kind] = float(entry["ewma"])
+    return costs
+
+
+def record_cost(kind: str, seconds: float):
+    """Fold a measured transition duration into the persisted average."""
+    path = _costs_path()
+    try:
+        with open(path) as f:
+            measured = json.load(f)
+    except (OSError, ValueError):
+        measured = {}
+    entry = measured.get(kind)
+    if entry:
+        entry["ewma"] = EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * entry["ewma"]
+        entry["n"] += 1
+    else:
+        entry = {"ewma": seconds, "n": 1}
+    entry["last"] = seconds
+    measured[kind] = entry
+    with open(path, "w") as f:
+        json.dump(measured, f, indent=2)
+
+
+class measure_transition:
+    """Context manager that records how long a transition took.
+
+    Usage:
+        with measure_transition("db_switch"):
+            _switch_vpn_database(TEST_DATABASE)
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                record_cost(self.kind, time.monotonic() - self.started)
+            except OSError:
+                pass
+        return False
+
+
+def _session_key(item):
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    if fixtureinfo is None:
+        return None
+    for name in DRIVER_FIXTURES:
+        fixturedefs = fixtureinfo.name2fixturedefs.get(name)
+        if not fixturedefs:
+            continue
+        fixturedef = fixturedefs[-1]
+        if fixturedef.scope == "session":
+            return f"session:{fixturedef.baseid}::{name}"
+        owner = item.getparent(pytest.Class if fixturedef.scope == "class" else pytest.Module)
+        return f"{fixturedef.scope}:{owner.nodeid if owner else item.nodeid}::{name}"
+    return None
+
+
+def state_for(item) -> State:
+    """Derive the setup-state vector for a collected test."""
+    if "seed_test_database" in item.fixturenames:
+        db = "test"
+    elif "e2e_prod" in item.nodeid.split("/"):
+        db = "prod"
+    else:
+        db = None
+
+    marker = item.get_closest_marker("device_state")
+    kwargs = marker.kwargs if marker else {}
+    return State(
+        db=db,
+        session=_session_key(item),
+        location=kwargs.get("location") or "real",
+        consent=bool(kwargs.get("consent", False)) or None,
+    )
+
+
+def _advance(current: dict, state: State) -> dict:
+    """State after running a test that needs ``state``."""
+    nxt = dict(current)
+    for dim in DIMENSIONS:
+        value = getattr(state, dim)
+        if value is not None:
+            nxt[dim] = value
+    return nxt
+
+
+def _step_cost(current: dict, state: State, costs: dict) -> float:
+    total = 0.0
+    for dim in DIMENSIONS:
+        value = getattr(state, dim)
+        if value is not None and value != current[dim]:
+            total += costs[DIMENSION_COSTS[dim]]
+    return total
+
+
+def sequence_cost(states, costs: dict, start: dict = None) -> float:
+    current = dict(start or START_STATE)
+    total = 0.0
+    for state in states:
+        total += _step_cost(current, state, costs)
+        current = _advance(current, state)
+    return total
+
+
+def _block_key(item):
+    cls = item.getparent(pytest.Class)
+    return cls.nodeid if cls is not None else item.nodeid
+
+
+def _order_within(block: list, costs: dict, start: dict) -> list:
+    """Greedy nearest-neighbour ordering of the tests inside one block."""
+    remaining = list(block)
+    ordered = []
+    current = dict(start)
+    while remaining:
+        best = min(
+            range(len(remaining)),
+            key=lambda i: (_step_cost(current, remaining[i][1], costs), i),
+        )
+        item, state = remaining.pop(best)
+        ordered.append((item, state))
+        current = _advance(current, state)
+    return ordered
+
+
+def _block_cost(prev_state: dict, block: list, costs: dict):
+    return sequence_cost([s for _, s in block], costs, prev_state)
+
+
+def _end_state(start: dict, block: list) -> dict:
+    current = dict(start)
+    for _, state in block:
+        current = _advance(current, state)
+    return current
+
+
+def _order_blocks(blocks: list, costs: dict, start: dict) -> list:
+    n = len(blocks)
+    if n <= 1:
+        return blocks
+
+    if n > EXACT_LIMIT:
+        remaining = list(blocks)
+        ordered = []
+        current = dict(start)
+        while remaining:
+            best = min(
+                range(len(remaining)),
+                key=lambda i: (_block_cost(current, remaining[i], costs), i),
+            )
+            block = remaining.pop(best)
+            ordered.append(block)
+            current = _end_state(current, block)
+        return ordered
+
+    # Held-Karp over blocks. The state after a block only depends on the
+    # block itself and the dimensions it leaves untouched, which is close
+    # enough to treat each block's end state as fixed.
+    ends = [_end_state(start, b) for b in blocks]
+    best = {}
+    for i in range(n):
+        best[(1 << i, i)] = (_block_cost(start, blocks[i], costs), None)
+    for size in range(2, n + 1):
+        for subset in itertools.combinations(range(n), size):
+            mask = sum(1 << i for i in subset)
+            for last in subset:
+                prev_mask = mask & ~(1 << last)
+                candidates = []
+                for prev in subset:
+                    if prev == last or (prev_mask, prev) not in best:
+                        continue
+                    cost = best[(prev_mask, prev)][0] + _block_cost(ends[prev], blocks[last], costs)
+                    candidates.append((cost, prev))
+                if candidates:
+                    best[(mask, last)] = min(candidates)
+    full = (1 << n) - 1
+    last = min(range(n), key=lambda i: (best[(full, i)][0], i))
+    order = []
+    mask = full
+    while last is not None:
+        order.append(last)
+        _, prev = best[(mask, last)]
+        mask &= ~(1 << last)
+        last = prev
+    return [blocks[i] for i in reversed(order)]
+
+
+def _on_test_db(block: list) -> bool:
+    return any(state.db == "test" for _, state in block)
+
+
+def schedule(items: list, costs: dict = None):
+    """Return (ordered_items, planned_cost, file_order_cost).
+
+    Test-DB blocks always come last, also when the file order is kept.
+    """
+    costs = costs or load_costs()
+    states = [state_for(item) for item in items]
+    baseline = sequence_cost(states, costs)
+
+    grouped = {}
+    for item, state in zip(items, states):
+        grouped.setdefault(_block_key(item), []).append((item, state))
+    partitions = ([], [])
+    for block in grouped.values():
+        partitions[_on_test_db(block)].append(block)
+
+    ordered = []
+    current = dict(START_STATE)
+    for blocks in partitions:
+        blocks = [_order_within(block, costs, _advance(current, block[0][1])) for block in blocks]
+        for block in _order_blocks(blocks, costs, current):
+            ordered.extend(block)
+            current = _end_state(current, block)
+    planned = sequence_cost([s for _, s in ordered], costs)
+
+    file_order = [pair for blocks in partitions for block in blocks for pair in block]
+    file_cost = sequence_cost([s for _, s in file_order], costs)
+    if planned > file_cost:
+        ordered, planned = file_order, file_cost
+    return [item for item, _ in ordered], planned, baseline
@@ -0,0 +1,183 @@
+"""Failure screenshot classifier.
+
+Labels a failure screenshot (block page, consent wall, 502, location
+overlay, ...) by its nearest labeled reference, so a bad run can be triaged
+from the summary instead of by opening every PNG.
+
+Screenshots are compared by perceptual hash: the web content area (Safari's
+status bar and toolbar look the same on every page and are cut off) is
+scaled to 32x32 greyscale, and the signs of the lowest 8x8 DCT coefficients
+against their median give 64 bits. Similar pages differ in a few bits,
+different ones in 20+. Pages with (nearly) no content are labeled ``blank``
+before hashing, since their hash is noise.
+
+References live in ``e2e/screenshots/reference/<label>/*.png`` (reduced
+copies; add more with ``python -m tests.harness.screen_classifier add``).
+A capture further than E2E_SCREEN_MAX_DISTANCE bits from every reference is
+``unknown``. Needs numpy and Pillow; without them nothing is classified.
+"""
+import argparse
+import functools
+import glob
+import io
+import logging
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = Image = None
+
+REFERENCE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "e2e", "screenshots", "reference"
+)
+
+DCT_SIZE = 32
+HASH_SIZE = 8
+# Web content area as fractions of the screen (left, top, right, bottom)
+CONTENT_BOX = (0.0, 0.06, 1.0, 0.85)
+# Greyscale std-dev (0-255) below which the content area counts as blank
+BLANK_STD = 1.5
+MAX_DISTANCE = int(os.getenv("E2E_SCREEN_MAX_DISTANCE", "12"))
+# Width reference copies are stored at
+REFERENCE_WIDTH = 276
+
+
+def available() -> bool:
+    return np is not None
+
+
+@functools.lru_cache(maxsize=1)
+def _dct_matrix():
+    n = DCT_SIZE
+    k = np.arange(n)
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def _content(image):
+    width, height = image.size
+    left, top, right, bottom = CONTENT_BOX
+    return image.convert("L").crop((int(width * left), int(height * top), int(width * right), int(height * bottom)))
+
+
+def is_blank(content) -> bool:
+    pixels = np.asarray(content.resize((64, 128), Image.BOX), dtype=np.float64)
+    return float(pixels.std()) < BLANK_STD
+
+
+def phash(content) -> int:
+    pixels = np.asarray(content.resize((DCT_SIZE, DCT_SIZE), Image.BOX), dtype=np.float64)
+    dct = _dct_matrix()
+    coefficients = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term is overall brightness; leave it out of the median
+    bits = coefficients > np.median(coefficients[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _popcount(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(len(values), 64).sum(axis=1)
+
+
+class ScreenIndex:
+    """Labeled reference hashes; nearest match by Hamming distance."""
+
+    def __init__(self, references: list):
+        # references: [(label, hash, source)]
+        self.labels = [label for label, _, _ in references]
+        self.sources = [source for _, _, source in references]
+        self.hashes = np.array([value for _, value, _ in references], dtype=np.uint64)
+
+    @classmethod
+    def load(cls, directory: str = REFERENCE_DIR) -> "ScreenIndex":
+        references = []
+        for path in sorted(glob.glob(os.path.join(directory, "*", "*.png"))):
+            try:
+                with Image.open(path) as image:
+                    value = phash(_content(image))
+            except Exception as e:
+                logging.warning(f"⚠️  Skipping reference screenshot {path}: {e}")
+                continue
+            references.append((os.path.basename(os.path.dirname(path)), value, os.path.relpath(path, directory)))
+        return cls(references)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def classify(self, png: bytes) -> dict:
+        """``{"label", "distance", "reference", "ms"}`` for a PNG screenshot."""
+        started = time.perf_counter()
+        with Image.open(io.BytesIO(png)) as image:
+            content = _content(image)
+        if is_blank(content):
+            result = {"label": "blank", "distance": 0, "reference": None}
+        elif not len(self):
+            result = {"label": "unknown", "distance": None, "reference": None}
+        else:
+            distances = _popcount(self.hashes ^ np.uint64(phash(content)))
+            nearest = int(np.argmin(distances))
+            distance = int(distances[nearest])
+            label = self.labels[nearest] if distance <= MAX_DISTANCE else "unknown"
+            result = {"label": label, "distance": distance, "reference": self.sources[nearest]}
+        result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+
+@functools.lru_cache(maxsize=1)
+def default_index():
+    return ScreenIndex.load()
+
+
+def classify(png: bytes):
+    """Classify against the reference set; None without numpy/Pillow."""
+    if not available():
+        return None
+    return default_index().classify(png)
+
+
+def add_reference(label: str, path: str, directory: str = REFERENCE_DIR) -> str:
+    """Store a reduced copy of ``path`` as a reference for ``label``."""
+    target_dir = os.path.join(directory, label)
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, os.path.basename(path))
+    with Image.open(path) as image:
+        height = round(image.height * REFERENCE_WIDTH / image.width)
+        image.convert("RGB").resize((REFERENCE_WIDTH, height), Image.LANCZOS).save(target, optimize=True)
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Label failure screenshots by nearest reference")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="Add screenshots as references for a label")
+    add.add_argument("label")
+    add.add_argument("paths", nargs="+")
+    check = sub.add_parser("classify", help="Label screenshots (default: e2e/screenshots/*.png)")
+    check.add_argument("paths", nargs="*")
+    args = parser.parse_args(argv)
+
+    if not available():
+        print("numpy and Pillow are required: pip install numpy Pillow", file=sys.stderr)
+        return 1
+    if args.command == "add":
+        for path in args.paths:
+            print(add_reference(args.label, path))
+        return 0
+    paths = args.paths or sorted(glob.glob(os.path.join(os.path.dirname(REFERENCE_DIR), "*.png")))
+    index = default_index()
+    for path in paths:
+        with open(path, "rb") as f:
+            result = index.classify(f.read())
+        distance = "" if result["distance"] is None else f" ({result['distance']} bits, {result['reference']})"
+        print(f"{result['label']:<18} {os.path.basename(path)}{distance} {result['ms']}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
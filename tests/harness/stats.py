@@ -0,0 +1,50 @@
+"""Small statistics helpers for harness reports (no numpy needed)."""
+import math
+
+
+def percentile(values, q: float):
+    """Linear-interpolated percentile, ``q`` in [0, 100]. None for no data."""
+    data = sorted(values)
+    if not data:
+        return None
+    if len(data) == 1:
+        return data[0]
+    rank = (len(data) - 1) * q / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return data[low] + (data[high] - data[low]) * (rank - low)
+
+
+def summarize(values) -> dict:
+    data = list(values)
+    return {
+        "count": len(data),
+        "min": min(data) if data else None,
+        "p50": percentile(data, 50),
+        "p95": percentile(data, 95),
+        "p99": percentile(data, 99),
+        "max": max(data) if data else None,
+    }
+
+
+def histogram(values, bounds) -> list:
+    """Counts per bucket: [(upper_bound, count), ..., (inf, overflow)]."""
+    counts = [0] * (len(bounds) + 1)
+    for value in values:
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return list(zip(list(bounds) + [math.inf], counts))
+
+
+def ascii_histogram(values, bounds, width: int = 40, unit: str = "s") -> str:
+    rows = histogram(values, bounds)
+    peak = max((count for _, count in rows), default=0) or 1
+    lines = []
+    for bound, count in rows:
+        label = f"≤{bound:g}{unit}" if bound != math.inf else f">{bounds[-1]:g}{unit}"
+        lines.append(f"  {label:>8} {'█' * round(width * count / peak):<{width}} {count}")
+    return "\n".join(lines)
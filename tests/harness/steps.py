@@ -0,0 +1,52 @@
+"""Named step timings inside a test.
+
+    def test_reddit_blocked(ios_driver, steps):
+        with steps("navigate"):
+            ios_driver.get("https://reddit.com")
+
+Each step is attached to the test report as a ``step:<name>`` user property
+(seconds), so it shows up in junit XML and feeds the monitor metrics. With
+adaptive budgets on (harness/budgets.py) a step that runs far past its usual
+duration fails right away with StepBudgetExceeded.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+STEP_PREFIX = "step:"
+
+
+class StepTimer:
+    """Callable context manager that times named steps of one test."""
+
+    def __init__(self, node):
+        self.node = node
+        self.budgets = node.config.pluginmanager.get_plugin("hocuspocus-budgets")
+
+    @contextmanager
+    def __call__(self, name: str):
+        guard = self.budgets.step_guard(name) if self.budgets else nullcontext()
+        started = time.monotonic()
+        try:
+            with guard:
+                yield
+        finally:
+            self.node.user_properties.append(
+                (STEP_PREFIX + name, round(time.monotonic() - started, 3))
+            )
+
+
+def step_durations(report) -> dict:
+    """Step name -> seconds, from a test report's user properties."""
+    return {
+        key[len(STEP_PREFIX):]: value
+        for key, value in report.user_properties
+        if isinstance(key, str) and key.startswith(STEP_PREFIX)
+    }
+
+
+def clear_steps(item):
+    """Drop step timings of a previous run of the same item."""
+    item.user_properties[:] = [
+        prop for prop in item.user_properties
+        if not (isinstance(prop[0], str) and prop[0].startswith(STEP_PREFIX))
+    ]
@@ -0,0 +1,298 @@
+"""WDA hang watchdog.
+
+A hung WebDriverAgent doesn't fail commands, it makes each of them wait the
+full Appium command timeout - and then the next test's commands do the same.
+The watchdog is driver middleware plus a monitor thread:
+
+  - every command's round trip is timed, per command name
+  - WDA serves /status on the same queue as the command it is running, so
+    a failed /status probe alone says nothing about a slow command. Once a
+    command has run E2E_WDA_PROBE_AFTER_S the monitor checks what doesn't
+    queue behind it: that the forwarded WDA port still accepts connections
+    and the WDA xcodebuild process is still there. A port that stops
+    accepting is a dead WDA and counts as a hang straight away
+  - past the hang floor two failed /status probes in a row count as a
+    hang as well. The floor is the command's usual duration (p99 x 3, from
+    this session or the persisted command budgets; half its timeout
+    without history), and always leaves room for the probes before
+    Appium's own per-command timeout (commandTimeouts) would end the
+    command - after that there is nothing left to recycle
+  - on a hang the WDA xcodebuild process is killed, which aborts the
+    command (Appium queues DELETE /session behind it, so that only cleans
+    up afterwards). The driver then gets a fresh session (same
+    capabilities) and the interrupted command is retried once, after
+    re-opening the last page. Commands on element references from the old
+    session can't be retried and raise WdaRecycled instead
+  - with no WDA process to kill (attach strategy, WDA started elsewhere)
+    nothing is recycled: the hang is reported and Appium's command
+    timeout ends the command
+
+Disable with E2E_WDA_WATCHDOG=0.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+import urllib.request
+from collections import deque
+
+import pytest
+
+from .budgets import APPIUM_COMMANDS, MIN_SAMPLES, BudgetStore
+from .driver_hooks import add_command_middleware
+from .stats import percentile
+
+ENABLED = os.getenv("E2E_WDA_WATCHDOG", "1").lower() not in ("0", "false", "no")
+
+# Check the WDA port and process once a command has run this long
+PROBE_AFTER_S = float(os.getenv("E2E_WDA_PROBE_AFTER_S", "5"))
+# /status failures only count once a command has run p99 x HANG_MARGIN
+# (before that they are usually just the queue), or without history this
+# share of its Appium timeout
+HANG_MARGIN = 3.0
+NO_HISTORY_SHARE = 0.5
+# The hang must be decided by this share of the command's Appium timeout
+DECIDE_BY_SHARE = 0.8
+# Appium's per-command timeout when the capabilities don't set one
+DEFAULT_COMMAND_TIMEOUT_S = int(os.getenv("APPIUM_CMD_TIMEOUT_MS", "60000")) / 1000.0
+PROBE_TIMEOUT_S = 3.0
+CONNECT_TIMEOUT_S = 1.0
+# Failed checks in a row before WDA counts as hung
+HUNG_PROBES = 2
+POLL_S = 0.5
+
+HISTORY_SIZE = 50
+
+# Commands that legitimately block, or that the recovery itself issues
+UNWATCHED = ("newSession", "quit", "executeAsyncScript", "w3cExecuteScriptAsync")
+
+# W3C element reference key; params carrying it belong to the old session
+ELEMENT_KEY = "element-6066-11e4-a52e-4f735466cecf"
+
+# Hangs of this run: (nodeid, command, seconds stalled, recycled)
+RECYCLES = []
+
+
+class WdaRecycled(Exception):
+    """WDA hung and was recycled; the command can't be replayed on the new session."""
+
+
+def wda_processes() -> list:
+    """PIDs of the xcodebuild processes running WebDriverAgent."""
+    result = subprocess.run(
+        ["pgrep", "-f", "xcodebuild.*WebDriverAgent"], capture_output=True, text=True
+    )
+    return [pid for pid in result.stdout.split() if pid.isdigit()]
+
+
+def kill_wda_processes() -> list:
+    """SIGTERM the xcodebuild processes running WebDriverAgent; returns the PIDs."""
+    pids = wda_processes()
+    for pid in pids:
+        try:
+            os.kill(int(pid), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    return pids
+
+
+def port_open(port: int, timeout: float = CONNECT_TIMEOUT_S) -> bool:
+    """Whether the forwarded WDA port accepts connections (not queued behind commands)."""
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def wda_alive(port: int, timeout: float = PROBE_TIMEOUT_S) -> bool:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+
+def _uses_elements(command: str, params) -> bool:
+    if not params:
+        return False
+    if "id" in params or "elementId" in params:
+        return True
+    return ELEMENT_KEY in json.dumps(params, default=str)
+
+
+class WdaWatchdog:
+    """Watches one driver's commands and recycles WDA when it stops answering."""
+
+    current_nodeid = None
+
+    def __init__(self, driver, capabilities: dict, wda_port: int, appium_url: str):
+        self.driver = driver
+        self.capabilities = capabilities
+        self.wda_port = wda_port
+        self.appium_url = appium_url
+        self.history = {}
+        # Durations from earlier runs (the command budgets) until this
+        # session has history of its own
+        self.store = BudgetStore()
+        self.timeouts = capabilities.get("appium:commandTimeouts") or {}
+        if isinstance(self.timeouts, str):
+            self.timeouts = json.loads(self.timeouts)
+        self.in_flight = None
+        self.last_url = None
+        self.hung = threading.Event()
+        self.recovering = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._monitor, name="wda-watchdog", daemon=True)
+        self.thread.start()
+
+    def command_timeout(self, command: str) -> float:
+        """Seconds until Appium itself gives up on ``command``."""
+        ms = self.timeouts.get(APPIUM_COMMANDS.get(command), self.timeouts.get("default"))
+        return ms / 1000.0 if ms else DEFAULT_COMMAND_TIMEOUT_S
+
+    def probe_timeout(self, command: str) -> float:
+        return min(PROBE_TIMEOUT_S, self.command_timeout(command) / (4 * HUNG_PROBES))
+
+    def hang_after(self, command: str) -> float:
+        """Seconds after which failed /status probes count for ``command``."""
+        timeout = self.command_timeout(command)
+        samples = self.history.get(command)
+        if samples and len(samples) >= MIN_SAMPLES:
+            p99 = percentile(samples, 99)
+        else:
+            p99 = self.store.p99(f"command:{command}")
+        usual = p99 * HANG_MARGIN if p99 is not None else timeout * NO_HISTORY_SHARE
+        latest = timeout * DECIDE_BY_SHARE - HUNG_PROBES * (self.probe_timeout(command) + POLL_S)
+        return max(POLL_S, min(usual, latest))
+
+    def _monitor(self):
+        refused = failures = 0
+        watched, reported = None, False
+        while not self.stopped.wait(POLL_S):
+            in_flight = self.in_flight
+            if in_flight is not watched:
+                refused = failures = 0
+                watched, reported = in_flight, False
+            if in_flight is None or reported or self.hung.is_set():
+                continue
+            command, started = in_flight
+            elapsed = time.monotonic() - started
+            hang_after = self.hang_after(command)
+            if elapsed < min(PROBE_AFTER_S, hang_after):
+                continue
+            refused = 0 if port_open(self.wda_port) else refused + 1
+            if refused < HUNG_PROBES:
+                if elapsed < hang_after:
+                    continue
+                failures = 0 if wda_alive(self.wda_port, self.probe_timeout(command)) else failures + 1
+                if failures < HUNG_PROBES:
+                    continue
+            stalled = time.monotonic() - started
+            reason = "stopped accepting connections" if refused >= HUNG_PROBES else "stopped answering"
+            if not wda_processes():
+                logging.warning(
+                    f"🧊 WDA {reason} during '{command}' ({stalled:.0f}s), but there is no WDA "
+                    f"process to kill (attach strategy?) - leaving it to Appium's command timeout"
+                )
+                RECYCLES.append((WdaWatchdog.current_nodeid, command, round(stalled, 1), False))
+                reported = True
+                continue
+            logging.warning(f"🧊 WDA {reason} during '{command}' ({stalled:.0f}s) - recycling")
+            RECYCLES.append((WdaWatchdog.current_nodeid, command, round(stalled, 1), True))
+            self.hung.set()
+            self._abort()
+
+    def _abort(self):
+        pids = kill_wda_processes()
+        logging.info(f"🧹 Killed WDA processes: {pids or 'none found'}")
+        # Queued behind the aborted command in Appium; only cleans up
+        session_id = getattr(self.driver, "session_id", None)
+        if session_id:
+            request = urllib.request.Request(f"{self.appium_url}/session/{session_id}", method="DELETE")
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+            except Exception:
+                pass
+
+    def _recover(self, call_next, command, params):
+        self.recovering = True
+        try:
+            try:
+                self.driver.start_session(self.capabilities)
+            except Exception as e:
+                raise WdaRecycled(f"WDA hung during '{command}' and no new session could be started: {e}")
+            logging.info("✅ New session after WDA recycle")
+        finally:
+            self.recovering = False
+            self.hung.clear()
+        if _uses_elements(command, params):
+            raise WdaRecycled(f"WDA hung during '{command}'; element references of the old session are gone")
+        if self.last_url and command != "get":
+            call_next("get", {"url": self.last_url})
+        params = dict(params or {})
+        params.pop("sessionId", None)
+        # Watched again, but a second hang is not recovered from
+        self.in_flight = (command, time.monotonic())
+        try:
+            return call_next(command, params)
+        finally:
+            self.in_flight = None
+
+    def __call__(self, call_next, command, params):
+        if command == "quit":
+            self.stop()
+        if command in UNWATCHED or self.recovering:
+            return call_next(command, params)
+        started = time.monotonic()
+        self.in_flight = (command, started)
+        try:
+            response = call_next(command, params)
+        except Exception:
+            if not self.hung.is_set():
+                raise
+            self.in_flight = None
+            return self._recover(call_next, command, params)
+        finally:
+            self.in_flight = None
+        self.history.setdefault(command, deque(maxlen=HISTORY_SIZE)).append(time.monotonic() - started)
+        if command == "get" and params:
+            self.last_url = params.get("url")
+        return response
+
+    def stop(self):
+        self.stopped.set()
+
+
+def attach(driver, capabilities: dict, wda_port: int, appium_url: str):
+    """Install the watchdog on ``driver`` (once)."""
+    if not ENABLED or getattr(driver, "_hp_watchdog", None) is not None:
+        return None
+    watchdog = WdaWatchdog(driver, capabilities, wda_port, appium_url)
+    add_command_middleware(driver, watchdog)
+    driver._hp_watchdog = watchdog
+    return watchdog
+
+
+class WatchdogPlugin:
+    """Tells the watchdog which test is running and reports recycles."""
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        WdaWatchdog.current_nodeid = item.nodeid
+        try:
+            yield
+        finally:
+            WdaWatchdog.current_nodeid = None
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not RECYCLES:
+            return
+        terminalreporter.section("WDA watchdog")
+        for nodeid, command, stalled, recycled in RECYCLES:
+            action = "recycled WDA" if recycled else "WDA hung (no process to kill, not recycled)"
+            terminalreporter.write_line(f"{action} after {stalled:.0f}s in '{command}' ({nodeid or 'setup'})")
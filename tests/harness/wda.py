@@ -0,0 +1,221 @@
+"""WebDriverAgent launch strategy autotuner.
+
+How fast a session starts depends mostly on how Appium gets WDA running on
+the phone. Instead of hard-coding usePrebuiltWDA/useXctestrunFile and
+timeouts per fixture (and re-running with USE_PREBUILT_WDA=false after every
+Appium reinstall), the launcher:
+
+  - detects which strategies are viable on this Mac: an already running WDA
+    to attach to, a prebuilt WebDriverAgentRunner in DerivedData, a
+    .xctestrun file next to it, or a full xcodebuild
+  - tries them fastest first, ranked by the median launch time recorded in
+    ``wda_launch.json`` (harness cache); untried strategies are ranked by a
+    rough prior
+  - falls back to the next strategy when one fails, and skips a strategy
+    that failed recently until its cooldown expires
+
+Force a strategy with E2E_WDA_STRATEGY=attach|prebuilt|xctestrun|build.
+USE_PREBUILT_WDA=true/false is still honoured (prebuilt/build).
+"""
+import glob
+import json
+import logging
+import os
+import time
+import urllib.request
+
+from .cache import cache_path
+from .stats import percentile
+
+STRATEGIES = ("attach", "prebuilt", "xctestrun", "build")
+
+DERIVED_DATA_ROOT = os.path.expanduser("~/Library/Developer/Xcode/DerivedData")
+
+WDA_LOCAL_PORT = int(os.getenv("E2E_WDA_PORT", "8100"))
+
+# Launch durations kept per strategy
+HISTORY_SIZE = 20
+
+# A strategy that failed is not tried first again for this long
+FAILURE_COOLDOWN_S = float(os.getenv("E2E_WDA_FAILURE_COOLDOWN_S", "3600"))
+
+# Typical launch seconds, used until a strategy has history of its own
+PRIOR_S = {"attach": 5.0, "prebuilt": 30.0, "xctestrun": 40.0, "build": 300.0}
+
+# Capabilities the strategies set; cleared before every attempt
+STRATEGY_CAPS = ("webDriverAgentUrl", "usePrebuiltWDA", "useXctestrunFile", "bootstrapPath",
+                 "derivedDataPath", "wdaLaunchTimeout", "wdaConnectionTimeout")
+
+# Per-strategy launch/connection timeouts (ms)
+TIMEOUTS = {
+    "attach": (30000, 30000),
+    "prebuilt": (120000, 120000),
+    "xctestrun": (120000, 120000),
+    "build": (600000, 240000),
+}
+
+
+def _products_dir(derived: str, simulator: bool) -> str:
+    sdk = "iphonesimulator" if simulator else "iphoneos"
+    return os.path.join(derived, "Build", "Products", f"Debug-{sdk}")
+
+
+def find_derived_data(simulator: bool = False):
+    """DerivedData dir with a built WebDriverAgentRunner, newest first.
+
+    IOS_DERIVED_DATA_PATH wins when set (even if nothing is built there
+    yet, so a build strategy can populate it).
+    """
+    configured = os.getenv("IOS_DERIVED_DATA_PATH", "").strip()
+    if configured:
+        return configured
+    candidates = [
+        path for path in glob.glob(os.path.join(DERIVED_DATA_ROOT, "WebDriverAgent-*"))
+        if os.path.isdir(os.path.join(_products_dir(path, simulator), "WebDriverAgentRunner-Runner.app"))
+    ]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def _wda_running(port: int = WDA_LOCAL_PORT) -> bool:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=2) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+
+def viable_strategies(simulator: bool = False, wda_port: int = WDA_LOCAL_PORT) -> dict:
+    """{strategy: capabilities} for every strategy this machine can use."""
+    derived = find_derived_data(simulator)
+    viable = {}
+    if _wda_running(wda_port):
+        viable["attach"] = {"webDriverAgentUrl": f"http://127.0.0.1:{wda_port}"}
+    if derived:
+        products = _products_dir(derived, simulator)
+        if os.path.isdir(os.path.join(products, "WebDriverAgentRunner-Runner.app")):
+            viable["prebuilt"] = {"usePrebuiltWDA": True, "derivedDataPath": derived,
+                                  "useXctestrunFile": False}
+        sdk = "iphonesimulator" if simulator else "iphoneos"
+        xctestrun = glob.glob(os.path.join(derived, "Build", "Products", f"*{sdk}*.xctestrun"))
+        if xctestrun:
+            viable["xctestrun"] = {"useXctestrunFile": True,
+                                   "bootstrapPath": os.path.dirname(xctestrun[0])}
+    build = {"usePrebuiltWDA": False, "useXctestrunFile": False}
+    if derived:
+        # Incremental build into the same DerivedData
+        build["derivedDataPath"] = derived
+    viable["build"] = build
+    for name, caps in viable.items():
+        launch, connect = TIMEOUTS[name]
+        caps.update(wdaLaunchTimeout=launch, wdaConnectionTimeout=connect)
+    return viable
+
+
+def _forced_strategy():
+    forced = os.getenv("E2E_WDA_STRATEGY", "").strip().lower()
+    if forced:
+        if forced not in STRATEGIES:
+            raise ValueError(f"E2E_WDA_STRATEGY must be one of {STRATEGIES}, got {forced!r}")
+        return forced
+    prebuilt = os.getenv("USE_PREBUILT_WDA", "").strip().lower()
+    if prebuilt:
+        return "prebuilt" if prebuilt == "true" else "build"
+    return None
+
+
+class LaunchHistory:
+    """Launch durations and failures per strategy, persisted as JSON."""
+
+    def __init__(self, path: str = None):
+        self.path = path or cache_path("wda_launch.json")
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def _entry(self, strategy: str) -> dict:
+        return self.data.setdefault(strategy, {"durations": [], "failures": 0, "last_failure": 0})
+
+    def record_success(self, strategy: str, seconds: float):
+        entry = self._entry(strategy)
+        entry["durations"] = (entry["durations"] + [round(seconds, 2)])[-HISTORY_SIZE:]
+        self.save()
+
+    def record_failure(self, strategy: str, error: str):
+        entry = self._entry(strategy)
+        entry["failures"] += 1
+        entry["last_failure"] = time.time()
+        entry["last_error"] = error[:300]
+        self.save()
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+
+    def order(self, strategies) -> list:
+        """Fastest known first; recently failed ones last."""
+        now = time.time()
+
+        def key(name):
+            entry = self.data.get(name, {})
+            cooling = now - entry.get("last_failure", 0) < FAILURE_COOLDOWN_S
+            median = percentile(entry.get("durations", []), 50)
+            return (cooling, median if median is not None else PRIOR_S[name], STRATEGIES.index(name))
+
+        return sorted(strategies, key=key)
+
+
+def launch(start, options, simulator: bool = False, history: LaunchHistory = None,
+           wda_port: int = WDA_LOCAL_PORT):
+    """Start a session with the best viable WDA strategy.
+
+    ``start(options)`` creates the driver. Strategy capabilities are set on
+    ``options`` before each attempt; the first failure falls through to the
+    next strategy, and the last error is raised if all of them fail.
+
+    A forced strategy that wasn't detected fails right away, except
+    ``prebuilt``: without our DerivedData Appium looks in its own.
+    """
+    history = history or LaunchHistory()
+    viable = viable_strategies(simulator, wda_port)
+    forced = _forced_strategy()
+    if forced:
+        order = [forced]
+        if forced not in viable:
+            if forced != "prebuilt":
+                needs = {"attach": f"a WDA answering on port {wda_port}",
+                         "xctestrun": "a .xctestrun file in WebDriverAgent's DerivedData"}
+                raise RuntimeError(f"WDA strategy '{forced}' is forced but not available: "
+                                   f"it needs {needs[forced]}")
+            launch_ms, connect_ms = TIMEOUTS[forced]
+            viable[forced] = {"usePrebuiltWDA": True, "useXctestrunFile": False,
+                              "wdaLaunchTimeout": launch_ms, "wdaConnectionTimeout": connect_ms}
+    else:
+        order = history.order(viable)
+
+    error = None
+    for strategy in order:
+        for name in STRATEGY_CAPS:
+            # Setting None removes the capability
+            options.set_capability(f"appium:{name}", None)
+        for name, value in viable[strategy].items():
+            options.set_capability(f"appium:{name}", value)
+        logging.info(f"🚀 Starting WDA via '{strategy}' (order: {', '.join(order)})")
+        started = time.monotonic()
+        try:
+            driver = start(options)
+        except Exception as e:
+            if isinstance(e, ConnectionError) or "Connection refused" in str(e):
+                # Appium itself is down; no strategy would do better
+                raise
+            error = e
+            history.record_failure(strategy, str(e))
+            logging.warning(f"⚠️  WDA strategy '{strategy}' failed after "
+                            f"{time.monotonic() - started:.0f}s: {str(e)[:200]}")
+            continue
+        elapsed = time.monotonic() - started
+        history.record_success(strategy, elapsed)
+        logging.info(f"✅ WDA up via '{strategy}' in {elapsed:.1f}s")
+        return driver
+    raise error
@@ -0,0 +1,11 @@
+"""Unit tests for the harness: pure logic, no device, cluster or Appium."""
+import pytest
+
+from ..harness import cache
+
+
+@pytest.fixture(autouse=True)
+def harness_cache(monkeypatch, tmp_path):
+    """Keep ledgers, budgets and snapshots out of the real harness cache."""
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
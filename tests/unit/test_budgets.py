@@ -0,0 +1,46 @@
+"""Adaptive budgets: learned from history, clamped, mapped to Appium."""
+import pytest
+
+from ..harness import budgets
+from ..harness.budgets import BudgetStore
+
+
+@pytest.fixture
+def store(harness_cache):
+    harness_cache.mkdir(parents=True, exist_ok=True)
+    return BudgetStore()
+
+
+def test_no_budget_before_enough_samples(store):
+    for _ in range(budgets.MIN_SAMPLES - 1):
+        store.record("step:navigate", 1.0)
+    assert store.p99("step:navigate") is None
+    assert store.budget("step:navigate", 60) == 60
+
+
+def test_budget_is_clamped_between_floor_and_ceiling(store):
+    for _ in range(budgets.MIN_SAMPLES):
+        store.record("fast", 0.1)
+        store.record("usual", 4.0)
+        store.record("slow", 100.0)
+    assert store.budget("fast", 60) == budgets.BUDGET_FLOOR_S
+    assert store.budget("usual", 60) == pytest.approx(4.0 * budgets.MARGIN)
+    assert store.budget("slow", 60) == 60
+
+
+def test_history_is_bounded_and_persisted(store):
+    for i in range(budgets.HISTORY_SIZE + 10):
+        store.record("key", float(i))
+    store.save()
+    reloaded = BudgetStore()
+    assert len(reloaded.data["key"]) == budgets.HISTORY_SIZE
+    assert reloaded.data["key"][-1] == budgets.HISTORY_SIZE + 9
+
+
+def test_command_timeouts_only_for_commands_with_history(store, monkeypatch):
+    monkeypatch.setattr(budgets, "ENABLED", True)
+    for _ in range(budgets.MIN_SAMPLES):
+        store.record("command:getTitle", 4.0)
+    store.save()
+    timeouts = budgets.command_timeouts(60000)
+    assert timeouts == {"default": 60000, "title": int(4.0 * budgets.MARGIN * 1000)}
@@ -0,0 +1,110 @@
+"""Flakiness ledger: failure signatures, flake rates and warm reruns."""
+import pytest
+
+from ..harness import ledger
+from ..harness.ledger import Ledger, failure_signature
+
+RERUN_CONFTEST = """
+from tests.harness.ledger import FlakinessPlugin
+
+
+def pytest_addoption(parser):
+    parser.addoption("--reruns-warm", type=int, default=0, dest="reruns_warm")
+    parser.addoption("--ledger-failed", action="store_true", default=False, dest="ledger_failed")
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(FlakinessPlugin(config), "ledger-under-test")
+"""
+
+
+@pytest.fixture
+def db(harness_cache):
+    harness_cache.mkdir(parents=True, exist_ok=True)
+    store = Ledger(str(harness_cache / "ledger.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_signature_ignores_run_specific_noise():
+    a = failure_signature("Timed out after 12.5s loading https://reddit.com/?_cb=1712345678 (0x7f3a)")
+    b = failure_signature("Timed out after 30s loading https://reddit.com/?_cb=1799999999 (0x1b2c)\nmore")
+    assert a == b
+    assert a != failure_signature("Timed out after 12.5s loading https://youtube.com/")
+
+
+def test_flake_rate_needs_history_and_a_pass(db):
+    for run in ("r1", "r2"):
+        db.record(run, "t", "call", "passed")
+    assert db.flake_rate("t") is None
+    db.record("r3", "t", "call", "rerun", message="boom")
+    db.record("r3", "t", "call", "passed")
+    assert db.flake_rate("t") == pytest.approx(1 / 3)
+
+    for run in ("r1", "r2", "r3"):
+        db.record(run, "broken", "call", "failed", message="boom")
+    assert db.flake_rate("broken") == 0.0
+
+
+def test_failed_in_last_run_uses_final_outcomes(db):
+    db.start_run("old", [])
+    db.record("old", "a", "call", "failed", message="boom")
+    db.conn.execute("UPDATE runs SET started_at = 0 WHERE run_id = 'old'")
+    db.start_run("new", [])
+    db.record("new", "a", "call", "rerun", message="boom")
+    db.record("new", "a", "call", "passed")
+    db.record("new", "b", "setup", "error", message="no driver")
+    db.start_run("collect-only", [])
+    assert db.failed_in_last_run() == {"b"}
+    assert db.failed_in_last_run(exclude_run="new") == {"a"}
+
+
+def test_rerun_keeps_class_fixtures(pytester, monkeypatch):
+    monkeypatch.setattr(ledger, "RUN_ID", "unit-rerun")
+    pytester.makeconftest(RERUN_CONFTEST)
+    pytester.makepyfile(
+        """
+        import pytest
+
+        LOG = []
+        attempts = []
+
+
+        @pytest.fixture(scope="class")
+        def warm():
+            LOG.append("class-setup")
+            yield
+            LOG.append("class-teardown")
+
+
+        @pytest.fixture
+        def fresh():
+            LOG.append("function-setup")
+            yield
+            LOG.append("function-teardown")
+
+
+        class TestFlaky:
+            def test_first(self, warm, fresh):
+                pass
+
+            # Last in its class: a plain rerun would tear the class down
+            def test_flaky(self, warm, fresh):
+                attempts.append(1)
+                assert len(attempts) > 1
+
+
+        def test_log():
+            assert LOG == [
+                "class-setup",
+                "function-setup", "function-teardown",
+                "function-setup", "function-teardown",
+                "function-setup", "function-teardown",
+                "class-teardown",
+            ]
+        """
+    )
+    result = pytester.runpytest("--reruns-warm=1", "-p", "no:cacheprovider")
+    outcomes = result.parseoutcomes()
+    assert outcomes.get("passed") == 3 and outcomes.get("rerun") == 1, result.stdout.str()
+    assert "failed" not in outcomes and "errors" not in outcomes
@@ -0,0 +1,52 @@
+"""Scheduler: measured transition costs and the suite order they produce."""
+import pytest
+
+from ..harness import scheduler
+
+SUITE = """
+import pytest
+
+
+@pytest.fixture(scope="class")
+def ios_driver():
+    yield
+
+
+class TestVienna:
+    @pytest.mark.device_state(location="social_hub_vienna")
+    def test_at_location(self, ios_driver):
+        pass
+
+    def test_at_home(self, ios_driver):
+        pass
+
+    @pytest.mark.device_state(location="social_hub_vienna")
+    def test_at_location_again(self, ios_driver):
+        pass
+
+
+class TestHome:
+    def test_home(self, ios_driver):
+        pass
+"""
+
+
+def test_measured_costs_are_averaged(harness_cache):
+    harness_cache.mkdir(parents=True, exist_ok=True)
+    assert scheduler.load_costs() == scheduler.DEFAULT_COSTS
+    scheduler.record_cost("location_move", 10.0)
+    scheduler.record_cost("location_move", 20.0)
+    expected = scheduler.EWMA_ALPHA * 20.0 + (1 - scheduler.EWMA_ALPHA) * 10.0
+    assert scheduler.load_costs()["location_move"] == pytest.approx(expected)
+
+
+def test_schedule_groups_locations_and_keeps_classes_together(pytester):
+    items = pytester.getitems(SUITE)
+    ordered, planned, baseline = scheduler.schedule(items, dict(scheduler.DEFAULT_COSTS))
+
+    classes = [item.getparent(pytest.Class).name for item in ordered]
+    assert classes in (["TestVienna"] * 3 + ["TestHome"], ["TestHome"] + ["TestVienna"] * 3)
+    locations = [scheduler.state_for(item).location for item in ordered]
+    # The two tests at the location run back to back
+    assert "social_hub_vienna,social_hub_vienna" in ",".join(locations)
+    assert planned < baseline
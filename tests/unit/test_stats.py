@@ -0,0 +1,19 @@
+"""Percentiles and histograms of the harness reports."""
+import math
+
+from ..harness.stats import histogram, percentile, summarize
+
+
+def test_percentile_interpolates():
+    assert percentile([], 50) is None
+    assert percentile([7], 99) == 7
+    assert percentile([4, 1, 3, 2], 50) == 2.5
+    assert percentile(range(101), 99) == 99
+
+
+def test_summarize_without_data():
+    assert summarize([]) == {"count": 0, "min": None, "p50": None, "p95": None, "p99": None, "max": None}
+
+
+def test_histogram_buckets_are_inclusive_with_overflow():
+    assert histogram([0.5, 1, 1.5, 9], [1, 2]) == [(1, 2), (2, 1), (math.inf, 1)]
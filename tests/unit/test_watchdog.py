@@ -0,0 +1,96 @@
+"""WDA watchdog: hang floor and recycle-and-retry, with a fake WDA."""
+import threading
+
+import pytest
+
+from ..harness import watchdog
+
+
+class FakeDriver:
+    session_id = "old"
+
+    def __init__(self):
+        self.sessions = []
+
+    def start_session(self, capabilities):
+        self.sessions.append(capabilities)
+        self.session_id = "new"
+
+
+@pytest.fixture
+def fake_wda(monkeypatch):
+    """A WDA that stops answering /status; killing it aborts the command in flight."""
+    monkeypatch.setattr(watchdog, "POLL_S", 0.05)
+    monkeypatch.setattr(watchdog, "RECYCLES", [])
+    killed = threading.Event()
+    monkeypatch.setattr(watchdog, "port_open", lambda port, timeout=None: True)
+    monkeypatch.setattr(watchdog, "wda_alive", lambda port, timeout=None: False)
+    monkeypatch.setattr(watchdog, "wda_processes", lambda: ["4242"])
+
+    def kill():
+        killed.set()
+        return ["4242"]
+
+    monkeypatch.setattr(watchdog, "kill_wda_processes", kill)
+    return killed
+
+
+def make_watchdog(timeout_ms: int) -> watchdog.WdaWatchdog:
+    capabilities = {"appium:commandTimeouts": {"default": timeout_ms}}
+    return watchdog.WdaWatchdog(FakeDriver(), capabilities, 8100, "http://127.0.0.1:1")
+
+
+def test_hang_floor_stays_below_the_command_timeout():
+    dog = make_watchdog(60000)
+    try:
+        assert dog.hang_after("getTitle") == pytest.approx(30.0)
+        dog.history["getTitle"] = [10.0] * 10
+        # p99 x 3 = 30s, but the probes must finish before 60s x 0.8
+        assert dog.hang_after("getTitle") < 60 * watchdog.DECIDE_BY_SHARE
+        dog.timeouts = {"default": 60000, "title": 5000}
+        decided_by = dog.hang_after("getTitle") + watchdog.HUNG_PROBES * (
+            dog.probe_timeout("getTitle") + watchdog.POLL_S
+        )
+        assert decided_by < 5.0
+    finally:
+        dog.stop()
+
+
+def test_stalled_command_is_recycled_and_retried_once(fake_wda):
+    dog = make_watchdog(2000)
+    calls = []
+
+    def call_next(command, params):
+        calls.append(command)
+        if len(calls) == 1:
+            # Hung until the watchdog kills WDA, then Appium fails the command
+            assert fake_wda.wait(5), "watchdog never fired"
+            raise RuntimeError("socket hang up")
+        return {"value": "title"}
+
+    try:
+        assert dog(call_next, "getTitle", {"sessionId": "old"}) == {"value": "title"}
+    finally:
+        dog.stop()
+    assert calls == ["getTitle", "getTitle"]
+    assert dog.driver.sessions == [dog.capabilities]
+    assert [(command, recycled) for _, command, _, recycled in watchdog.RECYCLES] == [("getTitle", True)]
+
+
+def test_hang_without_a_wda_process_is_only_reported(fake_wda, monkeypatch):
+    monkeypatch.setattr(watchdog, "wda_processes", lambda: [])
+    dog = make_watchdog(2000)
+
+    def call_next(command, params):
+        # Appium's own timeout ends it
+        fake_wda.wait(1.8)
+        raise RuntimeError("timeout")
+
+    try:
+        with pytest.raises(RuntimeError):
+            dog(call_next, "getTitle", {})
+    finally:
+        dog.stop()
+    assert not fake_wda.is_set()
+    assert dog.driver.sessions == []
+    assert [recycled for *_, recycled in watchdog.RECYCLES] == [False]